@@ -0,0 +1,392 @@
+import threading
+import time
+from datetime import datetime
+from unittest.mock import Mock
+
+import pytest
+from flask_jwt_extended import create_access_token, decode_token, view_decorators
+from sqlalchemy import event
+
+from app import app
+from database import db
+from models.roommate import Revoked_Token, Roommate
+from utils.context import Membership, MembershipCache, membership_cache
+from utils.notification_outbox import notification_outbox
+from utils.password_hashing import PasswordHasherBusy, password_hasher
+from utils.push_dispatcher import push_dispatcher
+from utils.rate_limit import MemoryBucketStore, SqliteBucketStore, rate_limiter
+from utils.revocation import revocation_list
+
+
+@pytest.fixture
+def client():
+    """
+    Pytest fixture to provide a Flask test client.
+    We rely on DATABASE_URL and JWT_SECRET_KEY
+    being set in the environment (via Docker Compose).
+    """
+    app.config["TESTING"] = True
+
+    rate_limiter.reset()
+    # Ids are reused once the tables are recreated
+    membership_cache.clear()
+
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+            yield client
+            # Let background writers finish before the tables go away
+            notification_outbox.flush()
+            push_dispatcher.wait()
+            db.session.remove()
+            db.drop_all()
+
+
+@pytest.fixture
+def low_cost_hashing(monkeypatch):
+    """Use the cheapest bcrypt cost so tests stay fast."""
+    monkeypatch.setattr(password_hasher, "rounds", 4)
+
+
+# --------------------------------------------------------------------------------
+# UNIT TESTS (password hashing pool)
+# --------------------------------------------------------------------------------
+
+
+def test_hash_and_verify_password(low_cost_hashing):
+    """Test that hashes made in the pool verify and reject correctly."""
+    password_hash = password_hasher.hash("secret")
+
+    assert password_hash.startswith("$2b$04$")
+    assert password_hasher.verify(password_hash, "secret") is True
+    assert password_hasher.verify(password_hash, "wrong") is False
+    assert password_hasher.verify(password_hash, None) is False
+
+
+def test_needs_rehash_when_cost_changes(low_cost_hashing, monkeypatch):
+    """Test that hashes made with another cost factor are flagged for rehash."""
+    password_hash = password_hasher.hash("secret")
+    assert password_hasher.needs_rehash(password_hash) is False
+
+    monkeypatch.setattr(password_hasher, "rounds", 5)
+    assert password_hasher.needs_rehash(password_hash) is True
+
+
+def test_hasher_busy_when_queue_is_full(low_cost_hashing, monkeypatch):
+    """Test that callers are turned away when every slot is taken."""
+    monkeypatch.setattr(password_hasher, "timeout", 0.01)
+    monkeypatch.setattr(password_hasher, "_slots", password_hasher._slots.__class__(1))
+    password_hasher._slots.acquire()
+
+    with pytest.raises(PasswordHasherBusy):
+        password_hasher.hash("secret")
+
+
+@pytest.mark.parametrize("store_type", ["memory", "sqlite"])
+def test_token_bucket(store_type, tmp_path):
+    """Test that a bucket empties, rejects, and refills over time."""
+    if store_type == "memory":
+        store = MemoryBucketStore()
+    else:
+        store = SqliteBucketStore(str(tmp_path / "buckets.sqlite"))
+
+    # Capacity 2, refilled at one token per second
+    assert store.take("key", 2, 1, now=100.0) == (True, 0)
+    assert store.take("key", 2, 1, now=100.0) == (True, 0)
+    allowed, retry_after = store.take("key", 2, 1, now=100.5)
+    assert allowed is False
+    assert retry_after == pytest.approx(0.5)
+    assert store.take("key", 2, 1, now=101.0)[0] is True
+    # Other keys have their own bucket
+    assert store.take("other", 2, 1, now=101.0)[0] is True
+
+
+@pytest.mark.parametrize("store_type", ["memory", "sqlite"])
+def test_token_bucket_take_all(store_type, tmp_path):
+    """Test that a rejected attempt takes no token from any of its buckets."""
+    if store_type == "memory":
+        store = MemoryBucketStore()
+    else:
+        store = SqliteBucketStore(str(tmp_path / "buckets.sqlite"))
+
+    ip, user = ("ip", 5, 0.001), ("user", 1, 0.001)
+    assert store.take_all([ip, user], now=100.0) == (True, 0, None)
+    allowed, _, key = store.take_all([ip, user], now=100.0)
+    assert (allowed, key) == (False, "user")
+    # Only the first attempt used up the IP bucket
+    for _ in range(4):
+        assert store.take("ip", 5, 0.001, now=100.0)[0] is True
+    assert store.take("ip", 5, 0.001, now=100.0)[0] is False
+
+
+# --------------------------------------------------------------------------------
+# INTEGRATION TESTS (register / login)
+# --------------------------------------------------------------------------------
+
+
+def test_register_and_login(client, low_cost_hashing):
+    """Test registering a user and logging in with the new password."""
+    register_data = {
+        "first_name": "John",
+        "last_name": "Doe",
+        "username": "john",
+        "password": "secret",
+    }
+    response = client.post("/register", json=register_data)
+    assert response.status_code == 204
+
+    response = client.post("/login", json={"username": "john", "password": "secret"})
+    assert response.status_code == 200
+    assert "access_token" in response.get_json()
+
+    response = client.post("/login", json={"username": "john", "password": "wrong"})
+    assert response.status_code == 401
+
+
+def test_login_rehashes_outdated_hash(client, low_cost_hashing, monkeypatch):
+    """Test that logging in upgrades a hash made with an old cost factor."""
+    with app.app_context():
+        db.session.add(
+            Roommate(
+                first_name="John",
+                last_name="Doe",
+                username="john",
+                password_hash=password_hasher.hash("secret"),
+            )
+        )
+        db.session.commit()
+
+    monkeypatch.setattr(password_hasher, "rounds", 5)
+    response = client.post("/login", json={"username": "john", "password": "secret"})
+    assert response.status_code == 200
+
+    with app.app_context():
+        roommate = Roommate.query.filter_by(username="john").first()
+        assert roommate.password_hash.startswith("$2b$05$")
+
+
+def test_login_rate_limited_per_username(client, monkeypatch):
+    """Test that repeated logins for one username get a 429 with Retry-After."""
+    monkeypatch.setitem(app.config, "AUTH_USER_BUCKET_CAPACITY", 2)
+    login_data = {"username": "john", "password": "wrong"}
+
+    for _ in range(2):
+        response = client.post("/login", json=login_data)
+        assert response.status_code == 401
+
+    response = client.post("/login", json=login_data)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+    # Another username from the same client is still allowed
+    response = client.post("/login", json={"username": "jane", "password": "wrong"})
+    assert response.status_code == 401
+
+
+def test_jwt_decoded_once_per_request(client, monkeypatch):
+    """Test that the logger and the route guard share one decoded token."""
+    with app.app_context():
+        roommate = Roommate(
+            first_name="John", last_name="Doe", username="john", password_hash="hash"
+        )
+        db.session.add(roommate)
+        db.session.commit()
+        access_token = create_access_token(identity=str(roommate.id))
+
+    decode = Mock(wraps=view_decorators._decode_jwt_from_request)
+    monkeypatch.setattr(view_decorators, "_decode_jwt_from_request", decode)
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.get("/room", headers=headers)
+
+    assert response.status_code == 200
+    assert decode.call_count == 1
+
+
+def test_missing_and_invalid_tokens_rejected(client):
+    """Test that guarded routes still reject missing and malformed tokens."""
+    assert client.get("/room").status_code == 401
+    headers = {"Authorization": "Bearer not-a-token"}
+    assert client.get("/room", headers=headers).status_code == 422
+
+
+# --------------------------------------------------------------------------------
+# ROOM MEMBERSHIP CACHE
+# --------------------------------------------------------------------------------
+
+
+def test_membership_cache_evicts_and_expires(monkeypatch):
+    """Test that the cache drops its least recently used and expired entries."""
+    cache = MembershipCache(max_size=2, ttl=60)
+    cache.set(Membership(1, 10, 0))
+    cache.set(Membership(2, 10, 0))
+    assert cache.get(1) == Membership(1, 10, 0)
+
+    # 2 is now the least recently used
+    cache.set(Membership(3, 20, 0))
+    assert cache.get(2) is None
+    assert cache.get(1) == Membership(1, 10, 0)
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    assert cache.get(1) is None
+
+
+def test_membership_follows_room_changes(client):
+    """Test that creating, joining and leaving a room are seen immediately."""
+    with app.app_context():
+        roommate = Roommate(
+            first_name="John", last_name="Doe", username="john", password_hash="hash"
+        )
+        db.session.add(roommate)
+        db.session.commit()
+        access_token = create_access_token(identity=str(roommate.id))
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    assert client.get("/room", headers=headers).get_json()["room_id"] is None
+
+    response = client.post("/rooms", json={"room_name": "Home"}, headers=headers)
+    room_id = response.get_json()["room_id"]
+    assert client.get("/room", headers=headers).get_json()["room_id"] == room_id
+
+    client.post("/rooms/leave", headers=headers)
+    assert client.get("/room", headers=headers).get_json()["room_id"] is None
+
+
+def test_room_changes_reissue_tokens(client):
+    """Test that room changes issue tokens with the new room and version."""
+    with app.app_context():
+        roommate = Roommate(
+            first_name="John", last_name="Doe", username="john", password_hash="hash"
+        )
+        db.session.add(roommate)
+        db.session.commit()
+        roommate_id = roommate.id
+        first_token = create_access_token(identity=str(roommate.id))
+
+    headers = {"Authorization": f"Bearer {first_token}"}
+    response = client.post("/rooms", json={"room_name": "Home"}, headers=headers)
+    room_id = response.get_json()["room_id"]
+    room_token = response.get_json()["access_token"]
+
+    claims = decode_token(room_token)
+    assert claims["room_id"] == room_id
+    assert claims["membership_version"] == 1
+
+    # Another worker still caching the old membership catches up from the token
+    membership_cache.set(Membership(roommate_id, None, 0))
+    headers = {"Authorization": f"Bearer {room_token}"}
+    assert client.get("/room", headers=headers).get_json()["room_id"] == room_id
+
+    response = client.post("/rooms/leave", headers=headers)
+    assert decode_token(response.get_json()["access_token"])["room_id"] is None
+
+    # The token from before leaving is stale and no longer grants the room
+    assert client.get("/room", headers=headers).get_json()["room_id"] is None
+
+
+# --------------------------------------------------------------------------------
+# REFRESH TOKENS AND REVOCATION
+# --------------------------------------------------------------------------------
+
+
+def login(client):
+    register_data = {
+        "first_name": "John",
+        "last_name": "Doe",
+        "username": "john",
+        "password": "secret",
+    }
+    client.post("/register", json=register_data)
+    response = client.post("/login", json={"username": "john", "password": "secret"})
+    return response.get_json()
+
+
+def test_refresh_rotates_tokens(client, low_cost_hashing):
+    """Test that a refresh token is exchanged once for a new pair of tokens."""
+    tokens = login(client)
+
+    headers = {"Authorization": f"Bearer {tokens['refresh_token']}"}
+    response = client.post("/refresh", headers=headers)
+    assert response.status_code == 200
+    new_tokens = response.get_json()
+    assert new_tokens["refresh_token"] != tokens["refresh_token"]
+
+    new_headers = {"Authorization": f"Bearer {new_tokens['access_token']}"}
+    assert client.get("/room", headers=new_headers).status_code == 200
+
+    # The old refresh token was revoked when it was used
+    assert client.post("/refresh", headers=headers).status_code == 401
+
+    # Access tokens can't be used to refresh
+    assert client.post("/refresh", headers=new_headers).status_code == 422
+
+
+def test_refresh_token_reuse_is_rejected(client, low_cost_hashing, monkeypatch):
+    """Test that a refresh token used twice concurrently only gets one new pair."""
+    tokens = login(client)
+    headers = {"Authorization": f"Bearer {tokens['refresh_token']}"}
+
+    # Both requests get past the revocation check before either revokes it
+    monkeypatch.setattr(revocation_list, "is_revoked", lambda jti: False)
+    assert client.post("/refresh", headers=headers).status_code == 200
+    response = client.post("/refresh", headers=headers)
+    assert response.status_code == 401
+    assert "access_token" not in response.get_json()
+
+    # Revoked by another worker, which this one hasn't synced yet
+    tokens = client.post(
+        "/login", json={"username": "john", "password": "secret"}
+    ).get_json()
+    claims = decode_token(tokens["refresh_token"])
+    db.session.add(
+        Revoked_Token(
+            jti=claims["jti"],
+            roommate_fkey=claims["sub"],
+            expires_at=datetime.utcfromtimestamp(claims["exp"]),
+        )
+    )
+    db.session.commit()
+    headers = {"Authorization": f"Bearer {tokens['refresh_token']}"}
+    response = client.post("/refresh", headers=headers)
+    assert response.status_code == 401
+    assert "access_token" not in response.get_json()
+
+
+def test_logout_revokes_tokens(client, low_cost_hashing):
+    """Test that logging out revokes both the access and the refresh token."""
+    tokens = login(client)
+
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    response = client.post(
+        "/logout", json={"refresh_token": tokens["refresh_token"]}, headers=headers
+    )
+    assert response.status_code == 204
+
+    assert client.get("/room", headers=headers).status_code == 401
+    refresh_headers = {"Authorization": f"Bearer {tokens['refresh_token']}"}
+    assert client.post("/refresh", headers=refresh_headers).status_code == 401
+
+
+def test_revocation_check_needs_no_queries(client, low_cost_hashing):
+    """Test that checking tokens against the revocation list stays in memory."""
+    tokens = login(client)
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    client.get("/room", headers=headers)
+
+    statements = []
+    # The test client handles the request on this thread; the revocation sync
+    # thread's own queries don't count
+    request_thread = threading.get_ident()
+
+    def record(conn, cursor, statement, *args):
+        if threading.get_ident() == request_thread:
+            statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        assert client.get("/room", headers=headers).status_code == 200
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+
+    assert not [s for s in statements if "revoked_tokens" in s]
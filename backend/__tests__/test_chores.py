@@ -6,9 +6,14 @@ from flask_jwt_extended import create_access_token
 
 from app import app
 from database import db
+from jobs.chore_reminders import generate_chore_reminders
 from models.chore import Chore
+from models.notifications import Notification
 from models.roommate import Room, Roommate
 from routes.chore import rotate_chore
+from utils.context import membership_cache
+from utils.notification_outbox import notification_outbox
+from utils.push_dispatcher import push_dispatcher
 
 
 @pytest.fixture
@@ -20,10 +25,16 @@ def client():
     """
     app.config["TESTING"] = True
 
+    # Ids are reused once the tables are recreated
+    membership_cache.clear()
+
     with app.test_client() as client:
         with app.app_context():
             db.create_all()
             yield client
+            # Let background writers finish before the tables go away
+            notification_outbox.flush()
+            push_dispatcher.wait()
             db.session.remove()
             db.drop_all()
 
@@ -270,3 +281,51 @@ def test_unauthorized_access(client):
     """Test accessing endpoints without authorization should fail (401)."""
     response = client.get("/chores")
     assert response.status_code == 401
+
+
+def test_generate_chore_reminders(client, test_data):
+    """Test that due-soon reminders are created once per chore window."""
+    with app.app_context():
+        now = datetime.now()
+        created_ids = generate_chore_reminders(timedelta(days=2), now=now)
+        assert len(created_ids) == 1
+
+        reminder = Notification.query.get(created_ids[0])
+        assert reminder.notification_recipient == test_data["roommate1_id"]
+        assert reminder.room_fkey == test_data["room_id"]
+        assert reminder.subject_key.startswith(f"chore_due:{test_data['chore_id']}:")
+
+        # Running the job again for the same window is a no-op
+        assert generate_chore_reminders(timedelta(days=2), now=now) == []
+        # Chores due outside the lead time are not reminded
+        assert generate_chore_reminders(timedelta(hours=1), now=now) == []
+
+
+def test_create_chore_notifies_assignee(client, test_data):
+    """Test that assigning a chore to someone else notifies them after commit."""
+    with app.app_context():
+        access_token = create_access_token(identity=str(test_data["roommate1_id"]))
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    post_data = {
+        "description": "Clean the kitchen",
+        "start_date": datetime.now().isoformat(),
+        "end_date": (datetime.now() + timedelta(days=1)).isoformat(),
+        "is_task": True,
+        "recurrence": "none",
+        "assigned_roommate_id": test_data["roommate2_id"],
+    }
+
+    response = client.post("/chores", json=post_data, headers=headers)
+    assert response.status_code == 201
+    chore_id = response.get_json()["chore"]["id"]
+
+    with app.app_context():
+        notification_outbox.flush()
+        notifications = Notification.query.filter_by(
+            subject_key=f"chore:{chore_id}"
+        ).all()
+        assert len(notifications) == 1
+        assert notifications[0].notification_sender == test_data["roommate1_id"]
+        assert notifications[0].notification_recipient == test_data["roommate2_id"]
+        assert notifications[0].room_fkey == test_data["room_id"]
@@ -1,10 +1,17 @@
+from datetime import datetime
+
 import pytest
 from flask import g
 from flask_jwt_extended import create_access_token
 
 from app import app
 from database import db
+from models.expense import Expense, Expense_Period, Roommate_Expense
 from models.roommate import Room, Roommate
+from utils.context import membership_cache
+from utils.notification_outbox import notification_outbox
+from utils.push_dispatcher import push_dispatcher
+from utils.query_profiler import query_profiler
 
 
 @pytest.fixture
@@ -16,10 +23,16 @@ def client():
     """
     app.config["TESTING"] = True
 
+    # Ids are reused once the tables are recreated
+    membership_cache.clear()
+
     with app.test_client() as client:
         with app.app_context():
             db.create_all()
             yield client
+            # Let background writers finish before the tables go away
+            notification_outbox.flush()
+            push_dispatcher.wait()
             db.session.remove()
             db.drop_all()
 
@@ -193,3 +206,44 @@ def test_delete_expense_period(client, test_data):
     get_response = client.get("/expense_period", headers=headers)
     get_data = get_response.get_json()
     assert len(get_data) == 0
+
+
+def test_get_expense_query_budget(client, test_data):
+    """Test that listing expenses runs the same queries however many there are"""
+    with app.app_context():
+        period = Expense_Period(
+            room_fkey=test_data["room_id"], start_date=datetime.utcnow(), open=True
+        )
+        db.session.add(period)
+        db.session.flush()
+        for i in range(10):
+            expense = Expense(
+                title=f"Expense {i}",
+                cost=10,
+                expense_period_fkey=period.id,
+                room_fkey=test_data["room_id"],
+                roommate_fkey=test_data["roommate_id"],
+            )
+            db.session.add(expense)
+            db.session.flush()
+            db.session.add(
+                Roommate_Expense(
+                    expense_fkey=expense.id,
+                    roommate_fkey=test_data["roommate_id"],
+                    percentage=100,
+                )
+            )
+        db.session.commit()
+        access_token = create_access_token(identity=str(test_data["roommate_id"]))
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    with query_profiler.capture() as captured:
+        response = client.get("/expense", headers=headers)
+
+    assert response.status_code == 200
+    assert len(response.get_json()) == 10
+    assert all(len(e["roommate_expenses"]) == 1 for e in response.get_json())
+    # Membership lookup, expenses, and every expense's split in one query
+    assert captured[0].count <= 3
+    assert captured[0].repeated(1) == []
+    assert response.headers["Server-Timing"].startswith("db;dur=")
@@ -0,0 +1,131 @@
+import json
+import logging
+import queue
+
+from app import app
+from logs.logging_config import (
+    REDACTED,
+    BoundedQueueHandler,
+    JsonFormatter,
+    sample_rate,
+    summarize,
+)
+
+
+def make_record(level=logging.INFO, msg="message"):
+    return logging.LogRecord("test", level, __file__, 0, msg, None, None)
+
+
+def drain(log_queue):
+    records = []
+    while not log_queue.empty():
+        records.append(log_queue.get_nowait())
+    return records
+
+
+def test_full_queue_drops_records_without_blocking():
+    """A full queue drops records, then reports how many with the next one"""
+    log_queue = queue.Queue(maxsize=2)
+    handler = BoundedQueueHandler(log_queue, sample_above=1, sample_rate=0)
+
+    for i in range(5):
+        handler.handle(make_record(msg=f"message {i}"))
+
+    assert handler.dropped == 3
+    assert [r.getMessage() for r in drain(log_queue)] == ["message 0", "message 1"]
+
+    handler.handle(make_record(msg="after"))
+    messages = [r.getMessage() for r in drain(log_queue)]
+    assert messages == [
+        "after",
+        "Dropped 3 log records while the log queue was full",
+    ]
+    assert handler.dropped == 0
+
+
+def test_nearly_full_queue_samples_info_but_keeps_warnings():
+    """Past the sampling threshold INFO records are sampled, warnings are kept"""
+    log_queue = queue.Queue(maxsize=10)
+    handler = BoundedQueueHandler(log_queue, sample_above=0.5, sample_rate=0)
+
+    for i in range(8):
+        handler.handle(make_record(msg=f"info {i}"))
+    handler.handle(make_record(logging.WARNING, "warning"))
+
+    messages = [r.getMessage() for r in drain(log_queue)]
+    assert messages[:5] == [f"info {i}" for i in range(5)]
+    assert "warning" in messages
+    assert "info 5" not in messages
+
+
+def request_records(caplog):
+    return [r for r in caplog.records if getattr(r, "fields", None)]
+
+
+def test_request_log_redacts_and_truncates(caplog):
+    """Request records skip secrets and stay small whatever the payload"""
+    caplog.set_level(logging.INFO)
+    client = app.test_client()
+    client.post(
+        "/missing",
+        json={"username": "jane", "password": "hunter2", "note": "n" * 1000},
+        headers={"Authorization": "Bearer secret-token", "User-Agent": "tests"},
+    )
+    client.post("/missing", json={"profile_picture": "p" * 100000})
+
+    small, large = request_records(caplog)
+    assert small.fields["status"] == 404
+    assert small.fields["headers"]["user-agent"] == "tests"
+    assert "authorization" not in small.fields["headers"]
+    assert small.fields["body"]["username"] == "jane"
+    assert small.fields["body"]["password"] == REDACTED
+    assert len(small.fields["body"]["note"]) < 300
+    # Large bodies are logged by size only
+    assert "body" not in large.fields
+    assert large.fields["request_bytes"] > 100000
+
+    line = JsonFormatter().format(small)
+    assert "hunter2" not in line and "secret-token" not in line
+    assert json.loads(line)["path"] == "/missing"
+
+
+def test_sample_rate_prefers_the_most_specific_key():
+    """Endpoint and status class rates combine, most specific first"""
+    rates = {"2xx": 0.1, "get_chore_route": 0.5, "get_chore_route:5xx": 1.0}
+    assert sample_rate(rates, "get_chore_route", 500) == 1.0
+    assert sample_rate(rates, "get_chore_route", 200) == 0.5
+    assert sample_rate(rates, "get_expense_route", 201) == 0.1
+    assert sample_rate(rates, "get_expense_route", 404) == 1.0
+
+
+def test_sampled_out_requests_are_not_logged(caplog, monkeypatch):
+    """A rate of 0 drops every matching request record"""
+    caplog.set_level(logging.INFO)
+    monkeypatch.setitem(app.config, "LOG_SAMPLE_RATES", {"4xx": 0})
+    app.test_client().get("/missing")
+    assert request_records(caplog) == []
+
+
+def test_summarize_caps_keys():
+    """Only the first keys of a wide body are kept"""
+    summary = summarize({f"k{i}": i for i in range(50)}, 10, set(), max_keys=5)
+    assert len(summary) == 6
+    assert summary["..."] == "<45 more keys>"
+
+
+def test_summarize_redacts_nested_secrets():
+    """Secrets inside nested objects and lists are redacted before truncating"""
+    redact = {"password", "refresh_token"}
+    summary = summarize(
+        {
+            "user": {"username": "jane", "password": "hunter2"},
+            "sessions": [{"refresh_token": "r-secret", "device": "phone"}],
+        },
+        256,
+        redact,
+    )
+    assert "hunter2" not in json.dumps(summary)
+    assert "r-secret" not in json.dumps(summary)
+    assert json.loads(summary["user"]) == {"username": "jane", "password": REDACTED}
+    assert json.loads(summary["sessions"])[0]["device"] == "phone"
+    assert "r-secret" not in summarize([{"refresh_token": "r-secret"}], 256, redact)
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from app import app
+from utils.metrics import RequestMetrics, request_metrics
+
+
+@pytest.fixture
+def metrics(tmp_path, monkeypatch):
+    """Points the request metrics at an empty file for the test"""
+    monkeypatch.setattr(request_metrics, "path", str(tmp_path / "metrics.sqlite"))
+    monkeypatch.setattr(request_metrics, "_local", threading.local())
+    request_metrics.reset()
+    return request_metrics
+
+
+def sample(text, line_prefix):
+    for line in text.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def test_metrics_endpoint_exports_request_histograms(metrics):
+    """Requests show up at /metrics with counts and cumulative buckets"""
+    client = app.test_client()
+    for _ in range(3):
+        client.get("/missing")
+
+    text = client.get("/metrics").get_data(as_text=True)
+    labels = 'endpoint="unmatched",method="GET"'
+    assert "# TYPE http_request_duration_seconds histogram" in text
+    assert sample(text, f'http_requests_total{{{labels},status="404"}}') == 3
+    assert sample(text, f"http_request_duration_seconds_count{{{labels}}}") == 3
+    assert (
+        sample(text, f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}}') == 3
+    )
+    assert sample(text, f"http_response_size_bytes_count{{{labels}}}") == 3
+
+
+def test_histogram_buckets_are_cumulative(metrics):
+    """An observation counts towards every bucket at or above it"""
+    metrics.observe("get_chore_route", "GET", 200, 0.2, 2000)
+    metrics.observe("get_chore_route", "GET", 200, 3, 2000)
+
+    text = metrics.render()
+    labels = 'endpoint="get_chore_route",method="GET"'
+    bucket = f"http_request_duration_seconds_bucket{{{labels}"
+    assert sample(text, f'{bucket},le="0.1"}}') is None
+    assert sample(text, f'{bucket},le="0.25"}}') == 1
+    assert sample(text, f'{bucket},le="2.5"}}') == 1
+    assert sample(text, f'{bucket},le="5"}}') == 2
+    assert sample(text, f"http_request_duration_seconds_sum{{{labels}}}") == 3.2
+
+
+def test_metrics_are_shared_through_the_file(metrics, monkeypatch):
+    """Another process's totals (another instance on the same file) add up"""
+    monkeypatch.setitem(app.extensions, "request_metrics", metrics)
+    other = RequestMetrics(app)
+    other.path = metrics.path
+    other.observe("get_chore_route", "GET", 200, 0.01)
+    other.flush()
+    metrics.observe("get_chore_route", "GET", 200, 0.01)
+
+    text = metrics.render()
+    total = 'http_requests_total{endpoint="get_chore_route",method="GET",status="200"}'
+    assert sample(text, total) == 2
+
+
+def test_metrics_token(metrics, monkeypatch):
+    """A configured METRICS_TOKEN is required to scrape"""
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", "scrape-me")
+    client = app.test_client()
+    assert client.get("/metrics").status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer scrape-me"})
+    assert response.status_code == 200
@@ -1,4 +1,6 @@
-from datetime import datetime
+import json
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock
 
 import pytest
 from flask import g
@@ -6,8 +8,16 @@ from flask_jwt_extended import create_access_token
 
 from app import app
 from database import db
+from jobs.partitions import (
+    create_notification_partition,
+    maintain_notification_partitions,
+    month_start,
+)
 from models.notifications import Notification
-from models.roommate import Room, Roommate
+from models.roommate import Device_Token, Room, Roommate
+from utils.context import membership_cache
+from utils.notification_outbox import notification_outbox
+from utils.push_dispatcher import FilePushBackend, PushDeliveryError, push_dispatcher
 
 
 @pytest.fixture
@@ -19,10 +29,16 @@ def client():
     """
     app.config["TESTING"] = True
 
+    # Ids are reused once the tables are recreated
+    membership_cache.clear()
+
     with app.test_client() as client:
         with app.app_context():
             db.create_all()
             yield client
+            # Let background writers finish before the tables go away
+            notification_outbox.flush()
+            push_dispatcher.wait()
             db.session.remove()
             db.drop_all()
 
@@ -192,6 +208,58 @@ def test_get_all_notifications(client, test_data):
     assert len(set(notification_ids)) == 3
 
 
+def test_get_notifications_paginated(client, test_data):
+    """Test keyset pagination of the notification list."""
+    with app.app_context():
+        access_token = create_access_token(identity=str(test_data["roommate1_id"]))
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.get("/notifications?limit=2", headers=headers)
+
+    assert response.status_code == 200
+    first_page = response.get_json()
+    assert [n["id"] for n in first_page] == [
+        test_data["notification3_id"],
+        test_data["notification2_id"],
+    ]
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(f"/notifications?limit=2&cursor={cursor}", headers=headers)
+
+    assert response.status_code == 200
+    second_page = response.get_json()
+    assert [n["id"] for n in second_page] == [test_data["notification1_id"]]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_notifications_scoped_to_room(client, test_data):
+    """Test that sender filters never return notifications from other rooms."""
+    with app.app_context():
+        other_room = Room(name="Other Room", invite_code="TEST2")
+        db.session.add(other_room)
+        db.session.flush()
+        db.session.add(
+            Notification(
+                notification_sender=test_data["roommate2_id"],
+                notification_recipient=test_data["roommate2_id"],
+                title="Other room notification",
+                is_read=False,
+                notification_time=datetime.utcnow(),
+                room_fkey=other_room.id,
+            )
+        )
+        db.session.commit()
+        access_token = create_access_token(identity=str(test_data["roommate1_id"]))
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    data = {"notification_sender": test_data["roommate2_id"]}
+    response = client.get("/notifications", json=data, headers=headers)
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [n["id"] for n in data] == [test_data["notification3_id"]]
+
+
 # Test POST /notifications endpoint
 def test_create_notification(client, test_data):
     """Test creating a new notification."""
@@ -218,6 +286,42 @@ def test_create_notification(client, test_data):
     assert data["is_read"] is False
 
 
+def test_create_notification_coalesces_repeated_nudges(client, test_data):
+    """Test that repeated unread nudges about the same subject share one row."""
+    with app.app_context():
+        access_token = create_access_token(identity=str(test_data["roommate1_id"]))
+        recipient_token = create_access_token(identity=str(test_data["roommate2_id"]))
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    post_data = {
+        "title": "Take out the trash",
+        "notification_recipient": test_data["roommate2_id"],
+        "subject_key": "chore:1",
+    }
+
+    first = client.post("/notifications", json=post_data, headers=headers)
+    assert first.status_code == 201
+    assert first.get_json()["coalesced_count"] == 1
+
+    post_data["title"] = "Take out the trash, please!"
+    second = client.post("/notifications", json=post_data, headers=headers)
+    assert second.status_code == 200
+    data = second.get_json()
+    assert data["id"] == first.get_json()["id"]
+    assert data["coalesced_count"] == 2
+    assert data["title"] == "Take out the trash, please!"
+
+    # Once read, the next nudge starts a new notification
+    client.put(
+        "/notifications/read",
+        json={"notification_ids": [data["id"]]},
+        headers={"Authorization": f"Bearer {recipient_token}"},
+    )
+    third = client.post("/notifications", json=post_data, headers=headers)
+    assert third.status_code == 201
+    assert third.get_json()["id"] != data["id"]
+
+
 # Test PUT /notifications endpoint
 def test_update_notification(client, test_data):
     """Test updating a notification."""
@@ -242,6 +346,89 @@ def test_update_notification(client, test_data):
     assert data["notification_recipient"] == test_data["roommate1_id"]
 
 
+# Test PUT /notifications/read endpoint
+def test_mark_notifications_read_by_ids(client, test_data):
+    """Test bulk marking the caller's notifications as read by id."""
+    with app.app_context():
+        access_token = create_access_token(identity=str(test_data["roommate1_id"]))
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    # notification2 belongs to roommate2 and must not be touched
+    data = {
+        "notification_ids": [
+            test_data["notification1_id"],
+            test_data["notification2_id"],
+        ]
+    }
+    response = client.put("/notifications/read", json=data, headers=headers)
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["updated_ids"] == [test_data["notification1_id"]]
+    assert data["unread_count"] == 1
+
+    with app.app_context():
+        assert Notification.query.get(test_data["notification1_id"]).is_read is True
+        assert Notification.query.get(test_data["notification2_id"]).is_read is False
+
+
+def test_mark_notifications_read_up_to_id(client, test_data):
+    """Test bulk marking everything up to an id as read."""
+    with app.app_context():
+        access_token = create_access_token(identity=str(test_data["roommate1_id"]))
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    data = {"up_to_id": test_data["notification3_id"]}
+    response = client.put("/notifications/read", json=data, headers=headers)
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert sorted(data["updated_ids"]) == [
+        test_data["notification1_id"],
+        test_data["notification3_id"],
+    ]
+    assert data["unread_count"] == 0
+
+
+def test_mark_notifications_read_up_to_time_with_offset(client, test_data):
+    """Test that an up_to_time with a UTC offset is converted, not stripped."""
+    with app.app_context():
+        access_token = create_access_token(identity=str(test_data["roommate1_id"]))
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    # An hour before the notifications were sent, written in UTC+2: its wall
+    # clock reads an hour after them
+    up_to_time = datetime.now(timezone.utc) - timedelta(hours=1)
+    up_to_time = up_to_time.astimezone(timezone(timedelta(hours=2)))
+    data = {"up_to_time": up_to_time.isoformat()}
+    response = client.put("/notifications/read", json=data, headers=headers)
+
+    assert response.status_code == 200
+    assert response.get_json()["updated_ids"] == []
+
+
+def test_mark_notifications_read_rejects_bool_ids(client, test_data):
+    """Test that true and false aren't taken as ids."""
+    with app.app_context():
+        access_token = create_access_token(identity=str(test_data["roommate1_id"]))
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    for data in ({"up_to_id": True}, {"notification_ids": [True]}):
+        response = client.put("/notifications/read", json=data, headers=headers)
+        assert response.status_code == 400
+
+
+def test_mark_notifications_read_requires_one_selector(client, test_data):
+    """Test that exactly one selector must be provided."""
+    with app.app_context():
+        access_token = create_access_token(identity=str(test_data["roommate1_id"]))
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    data = {"notification_ids": [1], "up_to_id": 1}
+    response = client.put("/notifications/read", json=data, headers=headers)
+    assert response.status_code == 400
+
+
 # Test DELETE /notifications endpoint
 def test_delete_notification(client, test_data):
     """Test deleting a notification."""
@@ -258,3 +445,135 @@ def test_delete_notification(client, test_data):
     get_data = {"notification_id": test_data["notification1_id"]}
     get_response = client.get("/notifications", json=get_data, headers=headers)
     assert get_response.status_code == 404
+
+
+# Test the write-behind notification outbox
+def test_notification_outbox_flush(client, test_data):
+    """Test that queued notifications are written in a batch on flush."""
+    with app.app_context():
+        for i in range(5):
+            notification_outbox.enqueue(
+                room_fkey=test_data["room_id"],
+                notification_recipient=test_data["roommate2_id"],
+                title=f"Queued Notification {i}",
+            )
+        notification_outbox.flush()
+
+        queued = Notification.query.filter(
+            Notification.title.like("Queued Notification %")
+        ).all()
+        assert len(queued) == 5
+        assert all(n.room_fkey == test_data["room_id"] for n in queued)
+        assert all(n.is_read is False for n in queued)
+
+
+def test_notification_outbox_keeps_batch_with_a_bad_row(client, test_data, monkeypatch):
+    """Test that one row the database rejects doesn't drop the rest of its batch."""
+    # Shortens the pause before the bad row's retry (0 would make the flusher
+    # thread spin)
+    monkeypatch.setattr(notification_outbox, "flush_interval", 0.01)
+    with app.app_context():
+        for i in range(3):
+            notification_outbox.enqueue(
+                room_fkey=test_data["room_id"],
+                notification_recipient=test_data["roommate2_id"],
+                title=f"Batched Notification {i}",
+            )
+        # No such roommate: violates the recipient foreign key
+        notification_outbox.enqueue(
+            room_fkey=test_data["room_id"],
+            notification_recipient=999999,
+            title="Batched Notification bad",
+        )
+        notification_outbox.flush()
+
+        titles = {
+            n.title
+            for n in Notification.query.filter(
+                Notification.title.like("Batched Notification %")
+            )
+        }
+        assert titles == {f"Batched Notification {i}" for i in range(3)}
+
+
+# Test push dispatch for new notifications
+def test_create_notification_pushes_to_each_device(
+    client, test_data, tmp_path, monkeypatch
+):
+    """Test that a new notification is pushed once to every recipient device."""
+    push_log = tmp_path / "push.log"
+    monkeypatch.setattr(push_dispatcher, "backend", FilePushBackend(str(push_log)))
+
+    with app.app_context():
+        access_token = create_access_token(identity=str(test_data["roommate1_id"]))
+        db.session.add_all(
+            [
+                Device_Token(roommate_fkey=test_data["roommate2_id"], token="phone"),
+                Device_Token(roommate_fkey=test_data["roommate2_id"], token="tablet"),
+            ]
+        )
+        db.session.commit()
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    post_data = {
+        "title": "Pushed Notification",
+        "notification_recipient": test_data["roommate2_id"],
+    }
+    response = client.post("/notifications", json=post_data, headers=headers)
+    assert response.status_code == 201
+    push_dispatcher.wait()
+
+    batches = [json.loads(line) for line in push_log.read_text().splitlines()]
+    assert sorted(batch["token"] for batch in batches) == ["phone", "tablet"]
+    for batch in batches:
+        assert batch["messages"] == [
+            {
+                "notification_id": response.get_json()["id"],
+                "title": "Pushed Notification",
+                "body": None,
+            }
+        ]
+
+
+def test_push_dispatch_retries_failed_batches(monkeypatch):
+    """Test that a failed push batch is retried with backoff."""
+    backend = Mock()
+    backend.send.side_effect = [PushDeliveryError("gateway down"), None]
+    monkeypatch.setattr(push_dispatcher, "backend", backend)
+    monkeypatch.setattr(push_dispatcher, "backoff", 0)
+
+    push_dispatcher._send_with_retry("phone", [{"title": "Retry me"}])
+
+    assert backend.send.call_count == 2
+
+
+# Test notification partition maintenance
+def test_maintain_notification_partitions(client, test_data):
+    """Test that future partitions are created and expired ones are dropped."""
+    with app.app_context():
+        now = datetime(2026, 3, 15)
+        old_start = month_start(now, -12)
+        create_notification_partition(old_start)
+        db.session.add(
+            Notification(
+                title="Old Notification",
+                notification_time=old_start + timedelta(days=3),
+                room_fkey=test_data["room_id"],
+                is_read=False,
+            )
+        )
+        db.session.commit()
+
+        result = maintain_notification_partitions(
+            retention_months=6, months_ahead=2, now=now
+        )
+
+        assert result["created"] == [
+            "notifications_p202603",
+            "notifications_p202604",
+            "notifications_p202605",
+        ]
+        assert result["dropped"] == ["notifications_p202503"]
+        assert Notification.query.filter_by(title="Old Notification").count() == 0
+        # Notifications outside the dropped partition are untouched
+        assert Notification.query.count() == 3
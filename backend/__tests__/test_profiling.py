@@ -0,0 +1,172 @@
+import logging
+
+import pytest
+from flask import Response
+from sqlalchemy import create_engine, text
+
+from app import app
+from logs.logging_config import REDACTED
+from utils.query_profiler import RequestQueries, normalize_sql, query_profiler
+from utils.slow_query_log import SlowQueryLog, can_analyze, slow_query_log
+
+
+def test_normalize_sql_ignores_values_and_list_lengths():
+    """Statements differing only in values normalise to the same shape"""
+    assert normalize_sql("SELECT *  FROM chores\n WHERE id = 12") == (
+        "SELECT * FROM chores WHERE id = ?"
+    )
+    assert normalize_sql("SELECT * FROM a WHERE name = 'O''Brien'") == (
+        "SELECT * FROM a WHERE name = ?"
+    )
+    assert normalize_sql(
+        "SELECT * FROM a WHERE id IN (%(id_1_1)s, %(id_1_2)s, %(id_1_3)s)"
+    ) == normalize_sql("SELECT * FROM a WHERE id IN (%(id_1_1)s, %(id_1_2)s)")
+
+
+def test_repeated_statements_are_flagged_as_n_plus_one(caplog):
+    """A statement run in a loop is logged and counted once per run"""
+    engine = create_engine("sqlite://")
+    with app.test_request_context("/expense"):
+        query_profiler.start()
+        with engine.connect() as conn:
+            for i in range(query_profiler.repeat_threshold + 1):
+                conn.execute(text("SELECT :value"), {"value": i})
+            conn.execute(text("SELECT 1 + 1"))
+
+        with caplog.at_level(logging.WARNING), query_profiler.capture() as captured:
+            response = query_profiler.finish(Response())
+
+    queries = captured[0]
+    assert queries.count == query_profiler.repeat_threshold + 2
+    assert queries.repeated(query_profiler.repeat_threshold) == [
+        ("SELECT ?", query_profiler.repeat_threshold + 1)
+    ]
+    assert "Possible N+1 query" in caplog.text
+    assert f'desc="{queries.count} queries"' in response.headers["Server-Timing"]
+
+
+def test_server_timing_header():
+    """Every response carries database and application time"""
+    response = app.test_client().get("/missing")
+    timing = response.headers["Server-Timing"]
+    assert timing.startswith('db;dur=0.0;desc="0 queries", app;dur=')
+
+
+def test_repeated_threshold_is_exclusive():
+    """Running a shape exactly `threshold` times is not flagged"""
+    queries = RequestQueries()
+    for _ in range(3):
+        queries.record("SELECT 1", 0.001)
+    assert queries.repeated(3) == []
+    assert queries.repeated(2) == [("SELECT ?", 3)]
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def slow_queries(monkeypatch):
+    """Treats every statement as slow and collects the slow query records"""
+    monkeypatch.setattr(slow_query_log, "threshold_ms", 0)
+    slow_query_log.reset()
+    handler = RecordingHandler()
+    file_logger = logging.getLogger("slow_queries")
+    file_logger.addHandler(handler)
+    yield handler.records
+    slow_query_log.wait()
+    file_logger.removeHandler(handler)
+    slow_query_log.reset()
+
+
+def test_slow_queries_are_logged_once_per_fingerprint(slow_queries, monkeypatch):
+    """Slow statements are logged with their shape and deduplicated"""
+    engine = create_engine("sqlite://")
+    with app.test_request_context("/expense"), engine.connect() as conn:
+        for i in range(3):
+            conn.execute(text("SELECT :value"), {"value": i})
+        slow_query_log.wait()
+
+        assert len(slow_queries) == 1
+        fields = slow_queries[0].fields
+        assert fields["sql"] == "SELECT ?"
+        # SQLite takes positional parameters, logged by type only
+        assert fields["parameters"] == ["<int>"]
+        assert fields["skipped_since_last"] == 0
+        assert fields["duration_ms"] >= 0
+
+        # Once the window is over the next run is logged with the skipped count
+        monkeypatch.setattr(slow_query_log, "dedupe_seconds", 0)
+        conn.execute(text("SELECT :value"), {"value": 3})
+        slow_query_log.wait()
+
+    assert len(slow_queries) == 2
+    assert slow_queries[1].fields["skipped_since_last"] == 2
+    assert slow_queries[1].fields["fingerprint"] == fields["fingerprint"]
+
+
+def test_slow_query_parameters_are_redacted_or_truncated(slow_queries):
+    """Secrets are never logged and large parameters are logged by size"""
+    summary = slow_query_log._summarize_parameters(
+        {
+            "password_hash": "$2b$12$" + "h" * 53,
+            "token_1": "device-token",
+            "data": b"x" * 100000,
+            "note": "n" * 1000,
+            "id_1": 7,
+        },
+        False,
+    )
+    assert summary["password_hash"] == REDACTED
+    assert summary["token_1"] == REDACTED
+    assert summary["data"] == "<100000 bytes>"
+    assert len(summary["note"]) < 100
+    assert summary["id_1"] == 7
+
+    assert slow_query_log._summarize_parameters(("secret", b"xy", 3), False) == [
+        "<str, 6 chars>",
+        "<bytes, 2 bytes>",
+        "<int>",
+    ]
+
+
+def test_slow_queries_outside_requests_are_ignored(slow_queries):
+    """Jobs, CLI commands and migrations aren't recorded"""
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    slow_query_log.wait()
+    assert slow_queries == []
+
+
+def test_failed_explain_still_logs_the_record(slow_queries, monkeypatch):
+    """A statement that can't be explained is logged without its plan"""
+
+    def fail(job):
+        raise RuntimeError("canceling statement due to lock timeout")
+
+    monkeypatch.setattr(SlowQueryLog, "EXPLAIN_DIALECTS", {"sqlite"})
+    monkeypatch.setattr(slow_query_log, "_explain", fail)
+    engine = create_engine("sqlite://")
+    with app.test_request_context("/expense"), engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    slow_query_log.wait()
+
+    fields = slow_queries[0].fields
+    assert fields["plan"] is None
+    assert "lock timeout" in fields["explain_error"]
+
+
+def test_only_plain_selects_are_analyzed():
+    """Statements that write or take locks are only planned, never run"""
+    assert can_analyze("SELECT * FROM chores WHERE room_fkey = %(room_fkey_1)s")
+    assert not can_analyze("UPDATE roommates SET password_hash = %(password_hash)s")
+    assert not can_analyze("INSERT INTO notifications (title) VALUES (%(title)s)")
+    assert not can_analyze("SELECT * FROM chores WHERE id = 1 FOR UPDATE")
+    assert not can_analyze("SELECT pg_advisory_xact_lock(%(key)s)")
+    assert not can_analyze("SELECT nextval('notifications_id_seq')")
@@ -0,0 +1,415 @@
+import base64
+import hashlib
+import io
+import os
+import struct
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from flask_jwt_extended import create_access_token
+from PIL import Image
+from sqlalchemy.engine.cursor import CursorFetchStrategy
+
+from app import app
+from database import db
+from models.chore import Chore
+from models.roommate import Room, Roommate
+from utils.blob_store import BlobStore, BlobTooLarge, blob_store
+from utils.context import membership_cache
+from utils.notification_outbox import notification_outbox
+from utils.push_dispatcher import push_dispatcher
+from utils.thumbnails import thumbnail_generator
+
+# Smallest valid JPEG header, enough for the tests that only move bytes around
+JPEG_BYTES = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00" + b"\x00" * 64
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """
+    Pytest fixture to provide a Flask test client.
+    We rely on DATABASE_URL and JWT_SECRET_KEY
+    being set in the environment (via Docker Compose).
+    Pictures are written to a temporary blob store.
+    """
+    app.config["TESTING"] = True
+    monkeypatch.setattr(blob_store, "root", str(tmp_path))
+
+    # Ids are reused once the tables are recreated
+    membership_cache.clear()
+
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+            yield client
+            # Let background writers finish before the tables go away
+            notification_outbox.flush()
+            push_dispatcher.wait()
+            db.session.remove()
+            db.drop_all()
+
+
+@pytest.fixture
+def auth_headers(client):
+    """Creates a roommate and returns Authorization headers for them."""
+    with app.app_context():
+        roommate = Roommate(
+            first_name="John", last_name="Doe", username="john", password_hash="hash"
+        )
+        db.session.add(roommate)
+        db.session.commit()
+        access_token = create_access_token(identity=str(roommate.id))
+    return {"Authorization": f"Bearer {access_token}"}
+
+
+# --------------------------------------------------------------------------------
+# UNIT TESTS (blob store)
+# --------------------------------------------------------------------------------
+
+
+def test_blob_store_deduplicates(tmp_path):
+    """Test that identical bytes are stored once under their SHA-256."""
+    store = BlobStore()
+    store.root = str(tmp_path)
+
+    digest = store.put(b"picture")
+    assert store.put(b"picture") == digest
+    assert store.read(digest) == b"picture"
+    assert list(store.digests()) == [digest]
+    assert store.path(digest).endswith(os.path.join(digest[:2], digest[2:4], digest))
+
+    with pytest.raises(ValueError):
+        store.path("../../etc/passwd")
+
+
+def test_blob_store_put_refreshes_existing_blob(tmp_path):
+    """Test that storing existing bytes again restarts the prune grace period."""
+    store = BlobStore()
+    store.root = str(tmp_path)
+
+    digest = store.put(b"picture")
+    day_ago = time.time() - 86400
+    os.utime(store.path(digest), (day_ago, day_ago))
+
+    store.put(b"picture")
+    assert os.path.getmtime(store.path(digest)) > day_ago + 3600
+
+
+def test_blob_store_streams_with_size_cap(tmp_path):
+    """Test that streamed blobs are hashed as written and capped in size."""
+    store = BlobStore()
+    store.root = str(tmp_path)
+
+    digest = store.put_stream(iter([b"pic", b"ture"]), max_bytes=7)
+    assert digest == store.put(b"picture")
+
+    with pytest.raises(BlobTooLarge):
+        store.put_stream(iter([b"pic", b"tures"]), max_bytes=7)
+    assert list(store.digests()) == [digest]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+# --------------------------------------------------------------------------------
+# INTEGRATION TESTS (profile pictures)
+# --------------------------------------------------------------------------------
+
+
+def test_profile_picture_round_trip(client, auth_headers):
+    """Test that an uploaded picture is stored by hash and served back."""
+    response = client.get("/profile_picture", headers=auth_headers)
+    assert response.status_code == 404
+
+    response = client.put(
+        "/profile_picture",
+        json={"profile_picture": base64.b64encode(JPEG_BYTES).decode()},
+        headers=auth_headers,
+    )
+    assert response.status_code == 200
+
+    with app.app_context():
+        roommate = Roommate.query.filter_by(username="john").first()
+        assert blob_store.read(roommate.profile_picture_hash) == JPEG_BYTES
+
+    response = client.get("/profile_picture", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.mimetype == "image/jpeg"
+    assert response.get_data() == JPEG_BYTES
+
+
+def test_profile_picture_raw_and_multipart_uploads(client, auth_headers):
+    """Test that pictures can be streamed as the raw body or a multipart part."""
+    response = client.put(
+        "/profile_picture",
+        data=JPEG_BYTES,
+        headers={**auth_headers, "Content-Type": "image/jpeg"},
+    )
+    assert response.status_code == 200
+    assert client.get("/profile_picture", headers=auth_headers).data == JPEG_BYTES
+
+    png_bytes = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+    response = client.put(
+        "/profile_picture",
+        data={"profile_picture": (io.BytesIO(png_bytes), "profile.png")},
+        content_type="multipart/form-data",
+        headers=auth_headers,
+    )
+    assert response.status_code == 200
+    response = client.get("/profile_picture", headers=auth_headers)
+    assert response.data == png_bytes
+    assert response.mimetype == "image/png"
+
+
+def test_profile_picture_upload_rejected(client, auth_headers, monkeypatch):
+    """Test that uploads that aren't images, or are too large, are rejected."""
+    response = client.put(
+        "/profile_picture",
+        data=b"not an image at all",
+        headers={**auth_headers, "Content-Type": "image/jpeg"},
+    )
+    assert response.status_code == 415
+
+    monkeypatch.setitem(app.config, "PROFILE_PICTURE_MAX_BYTES", 32)
+    response = client.put(
+        "/profile_picture",
+        data=JPEG_BYTES,
+        headers={**auth_headers, "Content-Type": "image/jpeg"},
+    )
+    assert response.status_code == 413
+    response = client.put(
+        "/profile_picture",
+        data={"profile_picture": (io.BytesIO(JPEG_BYTES), "profile.jpg")},
+        content_type="multipart/form-data",
+        headers=auth_headers,
+    )
+    assert response.status_code == 413
+
+    # Nothing was stored
+    assert client.get("/profile_picture", headers=auth_headers).status_code == 404
+
+
+def test_profile_picture_etag_and_cache_headers(client, auth_headers):
+    """Test that pictures are revalidated by hash and cached when versioned."""
+    client.put(
+        "/profile_picture",
+        data=JPEG_BYTES,
+        headers={**auth_headers, "Content-Type": "image/jpeg"},
+    )
+    digest = hashlib.sha256(JPEG_BYTES).hexdigest()
+
+    response = client.get("/profile_picture", headers=auth_headers)
+    assert response.headers["ETag"] == f'"{digest}"'
+    assert response.headers["Cache-Control"] == "private, no-cache"
+
+    client.post("/rooms", json={"room_name": "Home"}, headers=auth_headers)
+    response = client.get("/roommates", headers=auth_headers)
+    assert response.get_json()["roommates"][0]["profile_picture_version"] == digest
+
+    response = client.get(f"/profile_picture?v={digest}", headers=auth_headers)
+    assert "immutable" in response.headers["Cache-Control"]
+
+    # The 304 is answered without touching the file
+    os.remove(blob_store.path(digest))
+    response = client.get(
+        "/profile_picture", headers={**auth_headers, "If-None-Match": f'"{digest}"'}
+    )
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_profile_picture_not_cached_while_thumbnail_pending(
+    client, auth_headers, monkeypatch
+):
+    """Test that the original isn't cached forever in place of a thumbnail."""
+    # Keep the thumbnails from being made
+    monkeypatch.setattr(thumbnail_generator, "generate", lambda digest: None)
+    client.put(
+        "/profile_picture",
+        data=JPEG_BYTES,
+        headers={**auth_headers, "Content-Type": "image/jpeg"},
+    )
+    digest = hashlib.sha256(JPEG_BYTES).hexdigest()
+
+    response = client.get(f"/profile_picture?size=64&v={digest}", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.get_data() == JPEG_BYTES
+    assert response.headers["Cache-Control"] == "private, no-cache"
+
+    # The original is the final answer when no thumbnail is that big
+    response = client.get(
+        f"/profile_picture?size=5000&v={digest}", headers=auth_headers
+    )
+    assert "immutable" in response.headers["Cache-Control"]
+
+
+def test_profile_picture_thumbnails(client, auth_headers):
+    """Test that ?size= serves the smallest thumbnail at least that big."""
+    image_file = io.BytesIO()
+    Image.new("RGB", (800, 600), (200, 10, 10)).save(image_file, "JPEG")
+    client.put(
+        "/profile_picture",
+        json={"profile_picture": base64.b64encode(image_file.getvalue()).decode()},
+        headers=auth_headers,
+    )
+
+    with app.app_context():
+        digest = Roommate.query.filter_by(username="john").first().profile_picture_hash
+    # Wait for the thumbnails queued by the upload
+    thumbnail_generator.generate(digest).result(timeout=30)
+
+    response = client.get("/profile_picture?size=100", headers=auth_headers)
+    assert response.status_code == 200
+    assert Image.open(io.BytesIO(response.get_data())).size == (128, 128)
+
+    # Larger than every thumbnail: the original is served
+    response = client.get("/profile_picture?size=5000", headers=auth_headers)
+    assert response.get_data() == image_file.getvalue()
+
+    response = client.get("/profile_picture?size=big", headers=auth_headers)
+    assert response.status_code == 400
+
+
+def parse_avatar_bundle(body):
+    """Parses GET /roommates/avatars into {roommate id: (status, etag, image)}."""
+    entries = {}
+    offset = 0
+    while offset < len(body):
+        roommate_id, status, etag_length = struct.unpack_from(">IBB", body, offset)
+        offset += 6
+        etag = body[offset : offset + etag_length].decode()
+        offset += etag_length
+        image = None
+        if status == 2:
+            mimetype_length = body[offset]
+            offset += 1 + mimetype_length
+            (image_length,) = struct.unpack_from(">I", body, offset)
+            offset += 4
+            image = body[offset : offset + image_length]
+            offset += image_length
+        entries[roommate_id] = (status, etag, image)
+    return entries
+
+
+def test_roommate_avatars_bundle(client, auth_headers):
+    """Test that a room's avatars come back in one response, skipping known ones."""
+    client.post("/rooms", json={"room_name": "Home"}, headers=auth_headers)
+    client.put(
+        "/profile_picture",
+        data=JPEG_BYTES,
+        headers={**auth_headers, "Content-Type": "image/jpeg"},
+    )
+    with app.app_context():
+        john = Roommate.query.filter_by(username="john").first()
+        jane = Roommate(
+            first_name="Jane",
+            last_name="Smith",
+            username="jane",
+            password_hash="hash",
+            room_fkey=john.room_fkey,
+        )
+        db.session.add(jane)
+        db.session.commit()
+        john_id, jane_id = john.id, jane.id
+
+    response = client.get("/roommates/avatars", headers=auth_headers)
+    assert response.status_code == 200
+    entries = parse_avatar_bundle(response.data)
+    status, etag, image = entries[john_id]
+    assert status == 2
+    assert image == JPEG_BYTES
+    assert entries[jane_id] == (0, "", None)
+
+    response = client.get(
+        "/roommates/avatars", headers={**auth_headers, "If-None-Match": f'"{etag}"'}
+    )
+    assert parse_avatar_bundle(response.data)[john_id] == (1, etag, None)
+
+
+# --------------------------------------------------------------------------------
+# INTEGRATION TESTS (columns fetched by list endpoints)
+# --------------------------------------------------------------------------------
+
+
+@contextmanager
+def count_fetched_bytes():
+    """Counts the bytes of every value fetched from the database."""
+    fetched = {"bytes": 0}
+    originals = {
+        name: getattr(CursorFetchStrategy, name)
+        for name in ("fetchone", "fetchmany", "fetchall")
+    }
+
+    def size(value):
+        if value is None:
+            return 0
+        if isinstance(value, (str, bytes, bytearray, memoryview)):
+            return len(value)
+        return 8
+
+    def counting(name, original):
+        def wrapper(self, result, dbapi_cursor, *args):
+            rows = original(self, result, dbapi_cursor, *args)
+            for row in [rows] if name == "fetchone" else rows:
+                if row is not None:
+                    fetched["bytes"] += sum(size(value) for value in row)
+            return rows
+
+        return wrapper
+
+    for name, original in originals.items():
+        setattr(CursorFetchStrategy, name, counting(name, original))
+    try:
+        yield fetched
+    finally:
+        for name, original in originals.items():
+            setattr(CursorFetchStrategy, name, original)
+
+
+@pytest.fixture
+def crowded_room(client):
+    """A room of roommates whose rows carry a large column, plus one chore."""
+    with app.app_context():
+        room = Room(name="Test Room", invite_code="TEST1")
+        db.session.add(room)
+        db.session.flush()
+
+        roommates = [
+            Roommate(
+                first_name="John",
+                last_name="Doe",
+                username=f"john{i}",
+                password_hash="x" * 10000,
+                room_fkey=room.id,
+            )
+            for i in range(5)
+        ]
+        db.session.add_all(roommates)
+        db.session.flush()
+
+        db.session.add(
+            Chore(
+                description="Test Chore",
+                start_date=datetime.now(),
+                end_date=datetime.now() + timedelta(days=1),
+                is_task=True,
+                completed=False,
+                recurrence="none",
+                assignee_fkey=roommates[0].id,
+                assignor_fkey=roommates[0].id,
+            )
+        )
+        db.session.commit()
+        access_token = create_access_token(identity=str(roommates[0].id))
+    return {"Authorization": f"Bearer {access_token}"}
+
+
+@pytest.mark.parametrize("path", ["/roommates", "/chores"])
+def test_list_endpoints_skip_heavy_columns(client, crowded_room, path):
+    """Test that list endpoints only fetch the columns they serialise."""
+    with count_fetched_bytes() as fetched:
+        response = client.get(path, headers=crowded_room)
+
+    assert response.status_code == 200
+    # A single password_hash is 10000 bytes
+    assert fetched["bytes"] < 10000
@@ -1,14 +1,26 @@
 import base64
+import hmac
 import logging
+import math
 import os
+import time
+from datetime import timedelta
 
-from flask import Flask, jsonify, request
-from flask_bcrypt import Bcrypt
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token
+from flask_jwt_extended import (
+    JWTManager,
+    create_refresh_token,
+    decode_token,
+    get_jwt,
+    jwt_required,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import undefer
 
 from database import db, migrate
-from logs.logging_config import log_request_info, log_response_info, setup_logging
+from jobs.cli import jobs_cli
+from logs.logging_config import log_request, setup_logging, start_request_log
 from models.chore import Chore
 from models.expense import Expense, Roommate_Expense
 from models.roommate import Room, Roommate
@@ -24,16 +36,33 @@ from routes.notifications import (
     create_notification,
     delete_notification,
     get_notification,
+    mark_notifications_read,
     update_notification,
 )
 from routes.room import create_room, get_current_room, join_room, leave_room
 from routes.roommate import (
     get_profile_picture,
+    get_roommate_avatars,
     get_roommates_in_room,
+    register_device,
+    store_profile_picture,
+    unregister_device,
     update_profile_picture,
     update_user_info,
 )
 from routes.roommate_expense import get_roommate_expense
+from utils.blob_store import blob_store
+from utils.context import create_identity_token, membership_cache
+from utils.identity import identity_required, load_identity
+from utils.metrics import request_metrics
+from utils.notification_outbox import notification_outbox
+from utils.password_hashing import PasswordHasherBusy, password_hasher
+from utils.push_dispatcher import push_dispatcher
+from utils.query_profiler import query_profiler
+from utils.rate_limit import rate_limiter
+from utils.revocation import revocation_list
+from utils.slow_query_log import slow_query_log
+from utils.thumbnails import thumbnail_generator
 
 app = Flask(__name__)
 # The following environment variables are set in docker-compose.yml
@@ -42,32 +71,261 @@ app.config["JWT_SECRET_KEY"] = os.getenv(
     "JWT_SECRET_KEY"
 )  # Change this to a strong secret key. Used to sign all JWT's
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Access tokens are short-lived; clients get new ones from POST /refresh with the
+# refresh token issued at login, which is rotated on every use
+app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(
+    minutes=int(os.getenv("JWT_ACCESS_TOKEN_EXPIRES_MINUTES", "15"))
+)
+app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(
+    days=int(os.getenv("JWT_REFRESH_TOKEN_EXPIRES_DAYS", "30"))
+)
+# Directory holding profile pictures, named by their SHA-256 (defaults to
+# backend/blobs)
+app.config["BLOB_STORE_PATH"] = os.getenv("BLOB_STORE_PATH")
+# Largest profile picture accepted by PUT /profile_picture (default 5 MiB)
+app.config["PROFILE_PICTURE_MAX_BYTES"] = int(
+    os.getenv("PROFILE_PICTURE_MAX_BYTES", str(5 * 1024 * 1024))
+)
+# Square thumbnails (in pixels) made of every uploaded profile picture, served
+# with GET /profile_picture?size=
+app.config["THUMBNAIL_SIZES"] = [
+    int(size) for size in os.getenv("THUMBNAIL_SIZES", "64,128,256").split(",")
+]
+app.config["THUMBNAIL_WORKERS"] = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+# Seconds before a token revoked by one worker process is rejected by the others
+app.config["REVOCATION_SYNC_INTERVAL"] = float(
+    os.getenv("REVOCATION_SYNC_INTERVAL", "5")
+)
+# bcrypt cost factor; stored hashes are upgraded on login when this changes
+app.config["BCRYPT_LOG_ROUNDS"] = int(os.getenv("BCRYPT_LOG_ROUNDS", "12"))
+# Password hashing runs in its own process pool (defaults to one per CPU) with at
+# most PASSWORD_HASH_MAX_PENDING jobs queued
+app.config["PASSWORD_HASH_WORKERS"] = int(os.getenv("PASSWORD_HASH_WORKERS", "0"))
+app.config["PASSWORD_HASH_MAX_PENDING"] = int(
+    os.getenv("PASSWORD_HASH_MAX_PENDING", "64")
+)
+# Token buckets throttling /login and /register per username and per client IP.
+# RATE_LIMIT_STORAGE is "sqlite" (shared by every worker process on the host) or
+# "memory" (per process)
+app.config["RATE_LIMIT_STORAGE"] = os.getenv("RATE_LIMIT_STORAGE", "sqlite")
+app.config["AUTH_USER_BUCKET_CAPACITY"] = int(
+    os.getenv("AUTH_USER_BUCKET_CAPACITY", "5")
+)
+app.config["AUTH_USER_REFILL_PER_MINUTE"] = float(
+    os.getenv("AUTH_USER_REFILL_PER_MINUTE", "5")
+)
+app.config["AUTH_IP_BUCKET_CAPACITY"] = int(os.getenv("AUTH_IP_BUCKET_CAPACITY", "20"))
+app.config["AUTH_IP_REFILL_PER_MINUTE"] = float(
+    os.getenv("AUTH_IP_REFILL_PER_MINUTE", "20")
+)
+# Per-process cache of each roommate's room, used to scope requests without
+# loading the roommate row. Other workers see a membership change within the TTL.
+app.config["MEMBERSHIP_CACHE_SIZE"] = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "10000"))
+app.config["MEMBERSHIP_CACHE_TTL"] = int(os.getenv("MEMBERSHIP_CACHE_TTL", "60"))
+# Notifications are partitioned by month; see `flask jobs maintain-partitions`
+app.config["NOTIFICATION_RETENTION_MONTHS"] = int(
+    os.getenv("NOTIFICATION_RETENTION_MONTHS", "6")
+)
+app.config["NOTIFICATION_PARTITIONS_AHEAD"] = int(
+    os.getenv("NOTIFICATION_PARTITIONS_AHEAD", "2")
+)
+# How far ahead of a chore's end_date `flask jobs chore-reminders` reminds assignees
+app.config["CHORE_REMINDER_LEAD_HOURS"] = float(
+    os.getenv("CHORE_REMINDER_LEAD_HOURS", "24")
+)
+# Server-generated notifications are buffered and written in batches of up to
+# BATCH_SIZE rows every FLUSH_MS milliseconds
+app.config["NOTIFICATION_OUTBOX_FLUSH_MS"] = int(
+    os.getenv("NOTIFICATION_OUTBOX_FLUSH_MS", "200")
+)
+app.config["NOTIFICATION_OUTBOX_BATCH_SIZE"] = int(
+    os.getenv("NOTIFICATION_OUTBOX_BATCH_SIZE", "100")
+)
+app.config["NOTIFICATION_OUTBOX_MAX_PENDING"] = int(
+    os.getenv("NOTIFICATION_OUTBOX_MAX_PENDING", "10000")
+)
+# Push notifications for new notifications. PUSH_BACKEND is "file" (appends to
+# PUSH_FILE_PATH, for local development) or "http" (POSTs to PUSH_HTTP_URL)
+app.config["PUSH_BACKEND"] = os.getenv("PUSH_BACKEND", "file")
+app.config["PUSH_FILE_PATH"] = os.getenv("PUSH_FILE_PATH", "logs/push.log")
+app.config["PUSH_HTTP_URL"] = os.getenv("PUSH_HTTP_URL", "http://localhost:5001/push")
+app.config["PUSH_WORKERS"] = int(os.getenv("PUSH_WORKERS", "4"))
+app.config["PUSH_BATCH_SIZE"] = int(os.getenv("PUSH_BATCH_SIZE", "50"))
+app.config["PUSH_MAX_RETRIES"] = int(os.getenv("PUSH_MAX_RETRIES", "3"))
+# Seconds within which repeated nudges with the same subject_key are coalesced
+app.config["NOTIFICATION_COALESCE_WINDOW"] = int(
+    os.getenv("NOTIFICATION_COALESCE_WINDOW", "86400")
+)
+
+# Request logging goes through a bounded queue to a background writer. Above
+# LOG_QUEUE_SAMPLE_ABOVE (a fraction of LOG_QUEUE_SIZE) INFO records are sampled
+# at LOG_QUEUE_SAMPLE_RATE; when the queue is full they are dropped
+app.config["LOG_FILE"] = os.getenv("LOG_FILE", "logs/app.log")
+app.config["LOG_MAX_BYTES"] = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+app.config["LOG_BACKUP_COUNT"] = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+app.config["LOG_QUEUE_SIZE"] = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+app.config["LOG_QUEUE_SAMPLE_ABOVE"] = float(os.getenv("LOG_QUEUE_SAMPLE_ABOVE", "0.8"))
+app.config["LOG_QUEUE_SAMPLE_RATE"] = float(os.getenv("LOG_QUEUE_SAMPLE_RATE", "0.1"))
+
+# Each request is logged as one JSON record. Only the LOG_HEADERS request headers
+# are included, fields named in LOG_REDACT_FIELDS are never logged, every field
+# is cut to LOG_FIELD_MAX_CHARS and JSON bodies over LOG_BODY_MAX_BYTES are
+# logged by size only
+app.config["LOG_HEADERS"] = {
+    name.strip().lower()
+    for name in os.getenv(
+        "LOG_HEADERS",
+        "User-Agent,Content-Type,Content-Length,X-Forwarded-For,X-Request-Id",
+    ).split(",")
+    if name.strip()
+}
+app.config["LOG_REDACT_FIELDS"] = {
+    name.strip().lower()
+    for name in os.getenv(
+        "LOG_REDACT_FIELDS",
+        "authorization,cookie,password,password_hash,profile_picture,"
+        "access_token,refresh_token,token,jti",
+    ).split(",")
+    if name.strip()
+}
+app.config["LOG_FIELD_MAX_CHARS"] = int(os.getenv("LOG_FIELD_MAX_CHARS", "256"))
+app.config["LOG_BODY_MAX_BYTES"] = int(os.getenv("LOG_BODY_MAX_BYTES", "4096"))
+# Comma-separated key=rate pairs, where a key is a status class ("2xx"), an
+# endpoint ("get_profile_picture_route") or both ("get_chore_route:2xx"), e.g.
+# "2xx=0.1,get_profile_picture_route=0.01". Unmatched requests are all logged
+app.config["LOG_SAMPLE_RATES"] = {
+    key.strip(): float(rate)
+    for key, rate in (
+        item.split("=", 1)
+        for item in os.getenv("LOG_SAMPLE_RATES", "").split(",")
+        if item.strip()
+    )
+}
+
+# Request metrics are summed across worker processes in a SQLite file (in
+# /dev/shm by default) every METRICS_FLUSH_INTERVAL seconds. When METRICS_TOKEN
+# is set, GET /metrics requires it as a bearer token
+app.config["METRICS_SQLITE_PATH"] = os.getenv("METRICS_SQLITE_PATH")
+app.config["METRICS_FLUSH_INTERVAL"] = int(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN")
+
+# A statement shape run more than this many times in one request is logged as a
+# possible N+1 query
+app.config["QUERY_REPEAT_THRESHOLD"] = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+
+# Statements slower than SLOW_QUERY_THRESHOLD_MS are written to
+# SLOW_QUERY_LOG_FILE with their plan (on Postgres, unless SLOW_QUERY_EXPLAIN is
+# "false"), at most once per SLOW_QUERY_DEDUPE_SECONDS per statement
+app.config["SLOW_QUERY_THRESHOLD_MS"] = int(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+app.config["SLOW_QUERY_LOG_FILE"] = os.getenv(
+    "SLOW_QUERY_LOG_FILE", "logs/slow_queries.log"
+)
+app.config["SLOW_QUERY_EXPLAIN"] = os.getenv("SLOW_QUERY_EXPLAIN", "true") == "true"
+app.config["SLOW_QUERY_EXPLAIN_TIMEOUT_MS"] = int(
+    os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "5000")
+)
+app.config["SLOW_QUERY_DEDUPE_SECONDS"] = int(
+    os.getenv("SLOW_QUERY_DEDUPE_SECONDS", "3600")
+)
 
 
 jwt = JWTManager(app)  # Must take app as a parameter to use secret key
-bcrypt = Bcrypt(app)
-CORS(app)  # Allow all origins for development -> will need to change for production
+
+
+@jwt.token_in_blocklist_loader
+def is_token_revoked(jwt_header, jwt_payload):
+    return revocation_list.is_revoked(jwt_payload["jti"])
+
+
+# Allow all origins for development -> will need to change for production
+CORS(app, expose_headers=["X-Next-Cursor", "ETag"])
 
 db.init_app(app)
 migrate.init_app(app, db)
+app.cli.add_command(jobs_cli)
+notification_outbox.init_app(app)
+push_dispatcher.init_app(app)
+password_hasher.init_app(app)
+rate_limiter.init_app(app)
+membership_cache.init_app(app)
+revocation_list.init_app(app)
+blob_store.init_app(app)
+thumbnail_generator.init_app(app)
+request_metrics.init_app(app)
+query_profiler.init_app(app)
+slow_query_log.init_app(app)
 
 # Set up logging
-logger = setup_logging()
+logger = setup_logging(app)
 
 
-# Log request details and set user info
+# Decode the JWT once for the whole request and start timing it for the log and
+# the query profiler
 @app.before_request
 def before_request():
-    log_request_info(logger)
+    load_identity()
+    start_request_log()
+    query_profiler.start()
 
 
-# Log response details
+# Record the request's metrics and queries and log it along with its response
 @app.after_request
 def after_request(response):
-    return log_response_info(response, logger)
+    started = g.get("request_started")
+    response = query_profiler.finish(response, started)
+    if started is not None:
+        request_metrics.observe(
+            request.endpoint,
+            request.method,
+            response.status_code,
+            time.perf_counter() - started,
+            response.content_length,
+        )
+    return log_request(response, logger)
+
+
+# Prometheus scrape endpoint
+@app.route("/metrics", methods=["GET"])
+def metrics_route():
+    token = app.config.get("METRICS_TOKEN")
+    if token and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return jsonify({"message": "Invalid metrics token"}), 401
+    return Response(request_metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 # AUTHENTICATION ROUTES
+# Throttles credential attempts per client IP and per username. Called before any
+# database lookup or bcrypt work; returns a 429 response when over the limit.
+def limit_auth_attempts(endpoint, username):
+    buckets = [
+        (
+            f"{endpoint}:ip:{request.remote_addr}",
+            app.config["AUTH_IP_BUCKET_CAPACITY"],
+            app.config["AUTH_IP_REFILL_PER_MINUTE"],
+        )
+    ]
+    if username:
+        buckets.append(
+            (
+                f"{endpoint}:user:{str(username).lower()}",
+                app.config["AUTH_USER_BUCKET_CAPACITY"],
+                app.config["AUTH_USER_REFILL_PER_MINUTE"],
+            )
+        )
+
+    # Tokens are only taken when every bucket has one, so an attempt rejected
+    # for its username doesn't use up the client's IP allowance
+    allowed, retry_after, key = rate_limiter.take_all(buckets)
+    if not allowed:
+        logger.warning(f"Rate limited {endpoint} attempt: {key}")
+        response = jsonify({"message": "Too many attempts, try again later"})
+        response.headers["Retry-After"] = str(math.ceil(retry_after))
+        return response, 429
+    return None
+
+
 @app.route("/register", methods=["POST"])
 def register():
     logger.info("Register endpoint called")
@@ -78,6 +336,10 @@ def register():
     password = data.get("password")
     file = data.get("profile_picture")
 
+    rate_limited = limit_auth_attempts("register", username)
+    if rate_limited:
+        return rate_limited
+
     if not (first_name and last_name and username and password):
         return jsonify({"message": "All fields are required"}), 400
 
@@ -93,7 +355,10 @@ def register():
         logger.warning(f"Attempt to register with existing username: {username}")
         return jsonify({"message": "Username already exists"}), 400
 
-    hashed_pw = bcrypt.generate_password_hash(password).decode("utf-8")
+    try:
+        hashed_pw = password_hasher.hash(password)
+    except PasswordHasherBusy:
+        return jsonify({"message": "Server busy, please try again"}), 503
 
     if file:
         try:
@@ -108,7 +373,9 @@ def register():
         last_name=last_name,
         username=username,
         password_hash=hashed_pw,
-        profile_picture=profile_picture,
+        profile_picture_hash=(
+            store_profile_picture(profile_picture) if profile_picture else None
+        ),
     )
     db.session.add(new_roommate)
     db.session.commit()
@@ -123,14 +390,79 @@ def login():
     username = data.get("username")
     password = data.get("password")
 
-    roommate = Roommate.query.filter_by(username=username).first()
-    if not roommate or not bcrypt.check_password_hash(roommate.password_hash, password):
+    rate_limited = limit_auth_attempts("login", username)
+    if rate_limited:
+        return rate_limited
+
+    roommate = (
+        Roommate.query.options(undefer(Roommate.password_hash))
+        .filter_by(username=username)
+        .first()
+    )
+    try:
+        valid = roommate and password_hasher.verify(roommate.password_hash, password)
+        if valid and password_hasher.needs_rehash(roommate.password_hash):
+            # Upgrade hashes made with an old cost factor while we have the password
+            roommate.password_hash = password_hasher.hash(password)
+            db.session.commit()
+    except PasswordHasherBusy:
+        return jsonify({"message": "Server busy, please try again"}), 503
+    if not valid:
         logger.warning(f"Failed login attempt for username: {username}")
         return jsonify({"message": "Invalid username or password"}), 401
     logger.info(f"User logged in: {username} (ID: {roommate.id})")
 
-    access_token = create_access_token(identity=str(roommate.id))
-    return jsonify({"access_token": access_token}), 200
+    access_token = create_identity_token(roommate)
+    refresh_token = create_refresh_token(identity=str(roommate.id))
+    return jsonify({"access_token": access_token, "refresh_token": refresh_token}), 200
+
+
+# Exchanges a refresh token for a new access token and a new refresh token. The
+# presented refresh token is revoked, so each one can only be used once: of two
+# concurrent requests with the same token, only the first gets a new pair.
+@app.route("/refresh", methods=["POST"])
+@jwt_required(refresh=True)
+def refresh():
+    claims = get_jwt()
+    roommate = Roommate.query.get(int(claims["sub"]))
+    if not roommate:
+        return jsonify({"message": "User not found"}), 401
+
+    if not revocation_list.revoke(db.session, claims):
+        return jsonify({"message": "Token has been revoked"}), 401
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker revoked it first
+        db.session.rollback()
+        return jsonify({"message": "Token has been revoked"}), 401
+
+    access_token = create_identity_token(roommate)
+    refresh_token = create_refresh_token(identity=str(roommate.id))
+    return jsonify({"access_token": access_token, "refresh_token": refresh_token}), 200
+
+
+# Revokes the current access token and, if given, the refresh token issued with it
+@app.route("/logout", methods=["POST"])
+@identity_required
+def logout():
+    data = request.get_json(silent=True) or {}
+    refresh_claims = None
+    if data.get("refresh_token"):
+        try:
+            refresh_claims = decode_token(data["refresh_token"])
+        except Exception:
+            return jsonify({"message": "Invalid refresh token"}), 422
+        if refresh_claims.get("type") != "refresh":
+            return jsonify({"message": "Invalid refresh token"}), 422
+        if refresh_claims["sub"] != g.jwt_claims.get("sub"):
+            return jsonify({"message": "Invalid refresh token"}), 422
+
+    revocation_list.revoke(db.session, g.jwt_claims)
+    if refresh_claims:
+        revocation_list.revoke(db.session, refresh_claims)
+    db.session.commit()
+    return {}, 204
 
 
 # ROOM ROUTES
@@ -165,6 +497,12 @@ def get_roommates_route():
     return get_roommates_in_room()
 
 
+@app.route("/roommates/avatars", methods=["GET"])
+def get_roommate_avatars_route():
+    logger.info("Get roommate avatars endpoint called")
+    return get_roommate_avatars()
+
+
 @app.route("/profile_picture", methods=["GET"])
 def get_profile_picture_route():
     logger.info("Get profile picture endpoint called")
@@ -177,6 +515,18 @@ def update_profile_picture_route():
     return update_profile_picture()
 
 
+@app.route("/devices", methods=["POST"])
+def register_device_route():
+    logger.info("Register device endpoint called")
+    return register_device()
+
+
+@app.route("/devices", methods=["DELETE"])
+def unregister_device_route():
+    logger.info("Unregister device endpoint called")
+    return unregister_device()
+
+
 @app.route("/user", methods=["PUT"])
 def update_user_info_route():
     logger.info("Update user info endpoint called")
@@ -284,6 +634,12 @@ def update_notification_route():
     return update_notification()
 
 
+@app.route("/notifications/read", methods=["PUT"])
+def mark_notifications_read_route():
+    logger.info("Mark notifications read endpoint called")
+    return mark_notifications_read()
+
+
 @app.route("/notifications", methods=["DELETE"])
 def delete_notification_route():
     logger.info("Delete notification endpoint called")
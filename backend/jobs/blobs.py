@@ -0,0 +1,36 @@
+import logging
+import os
+import time
+
+from database import db
+from models.roommate import Roommate
+from utils.blob_store import blob_store
+
+logger = logging.getLogger(__name__)
+
+
+# Deletes stored blobs that no roommate references any more. Blobs are written
+# before the row pointing at them commits, so anything modified within
+# `grace_seconds` is kept. Returns the deleted digests.
+def prune_unreferenced_blobs(grace_seconds=3600):
+    referenced = {
+        digest
+        for (digest,) in db.session.query(Roommate.profile_picture_hash).filter(
+            Roommate.profile_picture_hash.isnot(None)
+        )
+    }
+    cutoff = time.time() - grace_seconds
+
+    deleted = []
+    for digest in list(blob_store.digests()):
+        if digest in referenced:
+            continue
+        try:
+            if os.path.getmtime(blob_store.path(digest)) > cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        blob_store.delete(digest)
+        deleted.append(digest)
+    logger.info(f"Pruned {len(deleted)} unreferenced blobs")
+    return deleted
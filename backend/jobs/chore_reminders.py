@@ -0,0 +1,79 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import text
+
+from database import db
+from utils.push_dispatcher import push_dispatcher
+
+logger = logging.getLogger(__name__)
+
+
+# Creates a "due soon" notification for the assignee of every unfinished chore, in
+# any room, whose end_date falls within `lead_time` from now. The lookup uses the
+# chores.end_date index and the reminders go in with one INSERT ... SELECT.
+# Each reminder carries subject_key "chore_due:<chore id>:<end_date>", so running
+# the job again for the same chore window doesn't create duplicates.
+def generate_chore_reminders(lead_time, now=None):
+    now = now or datetime.utcnow()
+
+    # Serialise overlapping runs so they can't both miss each other's reminders
+    db.session.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext('generate_chore_reminders'))")
+    )
+    created = (
+        db.session.execute(
+            text(
+                """
+                WITH due AS (
+                    SELECT
+                        chores.id,
+                        chores.description,
+                        chores.assignee_fkey,
+                        roommates.room_fkey,
+                        'chore_due:' || chores.id || ':'
+                            || to_char(chores.end_date, 'YYYY-MM-DD"T"HH24:MI:SS')
+                            AS subject_key
+                    FROM chores
+                    JOIN roommates ON roommates.id = chores.assignee_fkey
+                    WHERE chores.end_date > :now
+                        AND chores.end_date <= :due_before
+                        AND chores.completed IS NOT TRUE
+                        AND roommates.room_fkey IS NOT NULL
+                )
+                INSERT INTO notifications (
+                    title, description, notification_time, notification_sender,
+                    notification_recipient, room_fkey, is_read, subject_key,
+                    coalesced_count
+                )
+                SELECT
+                    'Chore due soon', due.description, :now, NULL,
+                    due.assignee_fkey, due.room_fkey, FALSE, due.subject_key, 1
+                FROM due
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM notifications
+                    WHERE notifications.room_fkey = due.room_fkey
+                        AND notifications.notification_recipient = due.assignee_fkey
+                        AND notifications.subject_key = due.subject_key
+                        -- A reminder for this window can't be older than this,
+                        -- which lets Postgres skip older partitions
+                        AND notifications.notification_time >= :reminded_after
+                )
+                RETURNING id, title, description, notification_recipient
+                """
+            ),
+            {
+                "now": now,
+                "due_before": now + lead_time,
+                "reminded_after": now - lead_time,
+            },
+        )
+        .mappings()
+        .all()
+    )
+    db.session.commit()
+
+    push_dispatcher.dispatch([dict(row) for row in created])
+
+    logger.info(f"Created {len(created)} chore due reminders")
+    return [row["id"] for row in created]
@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from jobs.blobs import prune_unreferenced_blobs
+from jobs.chore_reminders import generate_chore_reminders
+from jobs.partitions import maintain_notification_partitions
+from jobs.thumbnails import backfill_thumbnails
+from utils.revocation import prune_revoked_tokens
+
+# Maintenance commands, run with `flask jobs <command>` (e.g. from cron)
+jobs_cli = AppGroup("jobs", help="Scheduled maintenance jobs.")
+
+
+@jobs_cli.command("maintain-partitions")
+@click.option(
+    "--retention-months",
+    type=int,
+    default=None,
+    help="Drop notification partitions older than this many months.",
+)
+@click.option(
+    "--months-ahead",
+    type=int,
+    default=None,
+    help="Pre-create notification partitions this many months ahead.",
+)
+def maintain_partitions_command(retention_months, months_ahead):
+    if retention_months is None:
+        retention_months = current_app.config["NOTIFICATION_RETENTION_MONTHS"]
+    if months_ahead is None:
+        months_ahead = current_app.config["NOTIFICATION_PARTITIONS_AHEAD"]
+
+    result = maintain_notification_partitions(retention_months, months_ahead)
+    click.echo(f"Created partitions: {', '.join(result['created']) or 'none'}")
+    click.echo(f"Dropped partitions: {', '.join(result['dropped']) or 'none'}")
+
+
+@jobs_cli.command("chore-reminders")
+@click.option(
+    "--lead-hours",
+    type=float,
+    default=None,
+    help="Remind assignees about chores due within this many hours.",
+)
+def chore_reminders_command(lead_hours):
+    if lead_hours is None:
+        lead_hours = current_app.config["CHORE_REMINDER_LEAD_HOURS"]
+
+    created_ids = generate_chore_reminders(timedelta(hours=lead_hours))
+    click.echo(f"Created {len(created_ids)} chore reminders")
+
+
+@jobs_cli.command("prune-revoked-tokens")
+def prune_revoked_tokens_command():
+    deleted = prune_revoked_tokens()
+    click.echo(f"Deleted {deleted} expired revoked tokens")
+
+
+@jobs_cli.command("prune-blobs")
+@click.option(
+    "--grace-seconds",
+    type=int,
+    default=3600,
+    help="Keep unreferenced blobs written within this many seconds.",
+)
+def prune_blobs_command(grace_seconds):
+    deleted = prune_unreferenced_blobs(grace_seconds)
+    click.echo(f"Deleted {len(deleted)} unreferenced blobs")
+
+
+@jobs_cli.command("backfill-thumbnails")
+def backfill_thumbnails_command():
+    digests = backfill_thumbnails()
+    click.echo(f"Made thumbnails for {len(digests)} profile pictures")
@@ -0,0 +1,114 @@
+import logging
+import re
+from datetime import datetime
+
+from sqlalchemy import text
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r"^notifications_p(\d{4})(\d{2})$")
+
+
+def month_start(dt, offset=0):
+    # First instant of the month `offset` months away from dt
+    month_index = dt.year * 12 + (dt.month - 1) + offset
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(start):
+    return f"notifications_p{start.year:04d}{start.month:02d}"
+
+
+def list_notification_partitions():
+    # Returns {partition_name: month_start} for every monthly partition
+    rows = db.session.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = 'notifications'"
+        )
+    ).scalars()
+
+    partitions = {}
+    for name in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[name] = datetime(int(match.group(1)), int(match.group(2)), 1)
+    return partitions
+
+
+def create_notification_partition(start):
+    name = partition_name(start)
+    end = month_start(start, 1)
+    bounds = {"start": start, "end": end}
+
+    # Rows that landed in the default partition for this month have to be moved
+    # out first, otherwise Postgres refuses to create the overlapping partition
+    stranded = db.session.execute(
+        text(
+            "SELECT EXISTS (SELECT 1 FROM notifications_default "
+            "WHERE notification_time >= :start AND notification_time < :end)"
+        ),
+        bounds,
+    ).scalar()
+
+    if stranded:
+        db.session.execute(
+            text("ALTER TABLE notifications DETACH PARTITION notifications_default")
+        )
+
+    db.session.execute(
+        text(
+            f"CREATE TABLE {name} PARTITION OF notifications "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    )
+
+    if stranded:
+        db.session.execute(
+            text(
+                "WITH moved AS (DELETE FROM notifications_default "
+                "WHERE notification_time >= :start AND notification_time < :end "
+                "RETURNING *) INSERT INTO notifications SELECT * FROM moved"
+            ),
+            bounds,
+        )
+        db.session.execute(
+            text(
+                "ALTER TABLE notifications ATTACH PARTITION notifications_default "
+                "DEFAULT"
+            )
+        )
+    return name
+
+
+# Pre-creates monthly partitions up to `months_ahead` months in the future and drops
+# whole partitions that are older than `retention_months`. Dropping a partition is a
+# catalog operation, so expired notifications go away without a DELETE scan.
+def maintain_notification_partitions(retention_months, months_ahead, now=None):
+    now = now or datetime.utcnow()
+    existing = list_notification_partitions()
+
+    created = []
+    for offset in range(0, months_ahead + 1):
+        start = month_start(now, offset)
+        if partition_name(start) not in existing:
+            created.append(create_notification_partition(start))
+
+    dropped = []
+    cutoff = month_start(now, -retention_months)
+    for name, start in sorted(existing.items(), key=lambda item: item[1]):
+        # Only drop partitions whose whole range is older than the cutoff
+        if month_start(start, 1) <= cutoff:
+            db.session.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+
+    db.session.commit()
+
+    logger.info(
+        f"Notification partitions maintained: created {created}, dropped {dropped}"
+    )
+    return {"created": created, "dropped": dropped}
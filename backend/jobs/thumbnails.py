@@ -0,0 +1,34 @@
+import os
+from concurrent.futures import wait
+
+from database import db
+from models.roommate import Roommate
+from utils.blob_store import blob_store
+from utils.thumbnails import thumbnail_generator
+
+
+# Makes any missing thumbnails for every profile picture in use, e.g. after
+# THUMBNAIL_SIZES changes or for pictures uploaded before thumbnails existed.
+# Returns the digests that had thumbnails queued.
+def backfill_thumbnails():
+    digests = {
+        digest
+        for (digest,) in db.session.query(Roommate.profile_picture_hash)
+        .filter(Roommate.profile_picture_hash.isnot(None))
+        .distinct()
+    }
+
+    queued = {}
+    for digest in digests:
+        missing = [
+            size
+            for size in thumbnail_generator.sizes
+            if not os.path.exists(blob_store.variant_path(digest, str(size)))
+        ]
+        if missing and blob_store.exists(digest):
+            future = thumbnail_generator.generate(digest)
+            if future is not None:
+                queued[digest] = future
+
+    wait(queued.values())
+    return [digest for digest, future in queued.items() if not future.exception()]
@@ -1,72 +1,258 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
 
-from flask import g, request
-from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask import current_app, g, request
 
+REDACTED = "<redacted>"
 
-def setup_logging():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        handlers=[logging.FileHandler("logs/app.log"), logging.StreamHandler()],
+
+# Formats records as one JSON object per line. Structured fields passed as
+# `extra={"fields": {...}}` are merged into the object. Runs on the
+# QueueListener thread, so serialisation stays off the request thread.
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        return json.dumps(entry, default=str)
+
+
+# QueueHandler over a bounded queue, so logging on a request thread never waits
+# on disk or the console. Once the queue is `sample_above` full, records below
+# WARNING are kept at `sample_rate`; once it's completely full, records are
+# dropped. Dropped records are counted and reported with the next record that
+# fits.
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue, sample_above=0.8, sample_rate=0.1):
+        super().__init__(log_queue)
+        self.sample_threshold = int(log_queue.maxsize * sample_above)
+        self.sample_rate = sample_rate
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def enqueue(self, record):
+        if (
+            record.levelno < logging.WARNING
+            and self.queue.qsize() >= self.sample_threshold
+            and random.random() >= self.sample_rate
+        ):
+            self._count_dropped()
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._count_dropped()
+            return
+        if self.dropped:
+            self._report_dropped()
+
+    def _count_dropped(self):
+        with self._dropped_lock:
+            self.dropped += 1
+
+    def _report_dropped(self):
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        if not dropped:
+            return
+        record = logging.LogRecord(
+            __name__,
+            logging.WARNING,
+            __file__,
+            0,
+            f"Dropped {dropped} log records while the log queue was full",
+            None,
+            None,
+        )
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += dropped
+
+
+# Routes the root logger through a BoundedQueueHandler. A QueueListener thread
+# writes the records to a rotating logs/app.log and to the console, so rotation
+# also happens off the request thread. The listener is stopped (draining the
+# queue) at exit, and restarted with a fresh queue in forked workers.
+def setup_logging(app):
+    root = logging.getLogger()
+    if any(isinstance(h, BoundedQueueHandler) for h in root.handlers):
+        return logging.getLogger(__name__)
+
+    formatter = JsonFormatter()
+    file_handler = logging.handlers.RotatingFileHandler(
+        app.config.get("LOG_FILE", "logs/app.log"),
+        maxBytes=app.config.get("LOG_MAX_BYTES", 10 * 1024 * 1024),
+        backupCount=app.config.get("LOG_BACKUP_COUNT", 5),
+    )
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=app.config.get("LOG_QUEUE_SIZE", 10000))
+    queue_handler = BoundedQueueHandler(
+        log_queue,
+        sample_above=app.config.get("LOG_QUEUE_SAMPLE_ABOVE", 0.8),
+        sample_rate=app.config.get("LOG_QUEUE_SAMPLE_RATE", 0.1),
+    )
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, stream_handler, respect_handler_level=True
     )
+
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    # The listener thread doesn't survive a fork, and the queue's lock may have
+    # been held when it happened
+    def restart_in_child():
+        log_queue = queue.Queue(maxsize=queue_handler.queue.maxsize)
+        queue_handler.queue = log_queue
+        listener.queue = log_queue
+        listener._thread = None
+        listener.start()
+
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=restart_in_child)
+
+    app.extensions["log_listener"] = listener
     return logging.getLogger(__name__)
 
 
-# Log request details and set user info
-def log_request_info(logger):
+# Records when the request started; the request itself is logged once it has a
+# response (see log_request)
+def start_request_log():
+    g.request_started = time.perf_counter()
+
+
+# Logs one structured record per request: method, path, endpoint, status,
+# duration, user, the allowlisted headers and a summary of small JSON bodies.
+# Every field is truncated to LOG_FIELD_MAX_CHARS, and redacted fields are never
+# logged, so a record's size doesn't depend on the payload. Requests are sampled
+# at the rate configured for their endpoint and status class (see sample_rate).
+# Relies on utils.identity.load_identity() having already decoded the JWT (if
+# any) into g.user_id.
+def log_request(response, logger):
+    config = current_app.config
+    rate = sample_rate(
+        config.get("LOG_SAMPLE_RATES", {}), request.endpoint, response.status_code
+    )
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return response
+
     try:
-        verify_jwt_in_request()
-        g.user_id = get_jwt_identity()
-        # Log headers
-        logger.info(f"Request Headers: {dict(request.headers)}")
-
-        if request.method == "POST":
-            # Try to get JSON data
-            try:
-                json_data = request.get_json(silent=True)
-                logger.info(
-                    f"Request: {request.method} {request.url} - JSON Data: {json_data} - User: {g.user_id}"
-                )
-            except Exception as e:
-                logger.error(f"Error parsing JSON: {str(e)}")
-                # Log raw data if JSON parsing fails
-                logger.info(
-                    f"Request: {request.method} {request.url} - Raw Data: {request.get_data()} - User: {g.user_id}"
+        limit = config.get("LOG_FIELD_MAX_CHARS", 256)
+        redact = config.get("LOG_REDACT_FIELDS", set())
+        started = g.get("request_started")
+        fields = {
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "duration_ms": (
+                round((time.perf_counter() - started) * 1000, 1)
+                if started is not None
+                else None
+            ),
+            "user_id": g.get("user_id"),
+            "response_bytes": response.content_length,
+            "headers": {
+                name.lower(): (
+                    REDACTED if name.lower() in redact else truncate(value, limit)
                 )
-        else:
-            logger.info(
-                f"Request: {request.method} {request.url} - Params: {request.args} - User: {g.user_id}"
-            )
+                for name, value in request.headers.items()
+                if name.lower() in config.get("LOG_HEADERS", set())
+            },
+        }
+        if request.args:
+            fields["args"] = summarize(request.args.to_dict(), limit, redact)
+        if request.content_length:
+            fields["request_bytes"] = request.content_length
+            if request.is_json and request.content_length <= config.get(
+                "LOG_BODY_MAX_BYTES", 4096
+            ):
+                fields["body"] = summarize(request.get_json(silent=True), limit, redact)
+        if (
+            response.status_code >= 400
+            and not response.is_streamed
+            and response.is_json
+        ):
+            # Error bodies are short messages; successful ones aren't logged
+            fields["response"] = truncate(response.get_data(as_text=True), limit)
+        if rate < 1:
+            fields["sample_rate"] = rate
+        logger.info(
+            f"{request.method} {request.path} {response.status_code}",
+            extra={"fields": fields},
+        )
     except Exception as e:
-        # Log headers even when JWT is not present
-        logger.info(f"Request Headers: {dict(request.headers)}")
-
-        if request.method == "POST":
-            try:
-                json_data = request.get_json(silent=True)
-                logger.info(
-                    f"Request: {request.method} {request.url} - JSON Data: {json_data} - No JWT present"
-                )
-            except Exception as json_e:
-                logger.error(f"Error parsing JSON: {str(json_e)}")
-                logger.info(
-                    f"Request: {request.method} {request.url} - Raw Data: {request.get_data()} - No JWT present"
-                )
-        else:
-            logger.info(
-                f"Request: {request.method} {request.url} - Params: {request.args} - No JWT present"
+        logger.error(f"Error logging request: {str(e)}")
+    return response
+
+
+# Rate at which requests to `endpoint` answered with `status` are logged.
+# `rates` maps keys to rates between 0 and 1; the first key present of
+# "<endpoint>:<class>", "<endpoint>" and "<class>" (e.g. "get_chore_route:2xx",
+# "get_chore_route", "2xx") applies, and requests with no matching key are
+# always logged.
+def sample_rate(rates, endpoint, status):
+    status_class = f"{status // 100}xx"
+    for key in (f"{endpoint}:{status_class}", endpoint, status_class):
+        if key in rates:
+            return rates[key]
+    return 1.0
+
+
+# Shallow summary of a JSON value: redacted keys are replaced (at any depth),
+# other values are truncated, and at most `max_keys` keys of a dict are kept
+def summarize(value, limit, redact, max_keys=20):
+    if not isinstance(value, dict):
+        return truncate(redact_nested(value, redact), limit)
+    summary = {}
+    for i, (key, item) in enumerate(value.items()):
+        if i == max_keys:
+            summary["..."] = f"<{len(value) - max_keys} more keys>"
+            break
+        summary[key] = (
+            REDACTED
+            if key.lower() in redact
+            else truncate(redact_nested(item, redact), limit)
+        )
+    return summary
+
+
+# Copy of a JSON value with the value of every key named in `redact` replaced,
+# in nested dicts and lists too, so nothing secret survives serialisation
+def redact_nested(value, redact):
+    if isinstance(value, dict):
+        return {
+            key: (
+                REDACTED if str(key).lower() in redact else redact_nested(item, redact)
             )
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [redact_nested(item, redact) for item in value]
+    return value
 
 
-# Log response details
-def log_response_info(response, logger):
-    logger.info(
-        f"Response: {response.status_code} - {response.status} for {request.method} {request.url}"
-    )
-    if response.status_code >= 400:  # Log response data for errors
-        try:
-            logger.info(f"Response Data: {response.get_data(as_text=True)}")
-        except Exception as e:
-            logger.error(f"Error logging response data: {str(e)}")
-    return response
+def truncate(value, limit):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = value if isinstance(value, str) else json.dumps(value, default=str)
+    if len(text) > limit:
+        return f"{text[:limit]}...<{len(text)} chars>"
+    return text
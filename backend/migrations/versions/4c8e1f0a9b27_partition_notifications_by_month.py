@@ -0,0 +1,121 @@
+"""Partition notifications by month on notification_time
+
+Revision ID: 4c8e1f0a9b27
+Revises: 6ebdc67f9a78
+Create Date: 2026-10-19 09:12:40.118204
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import text
+
+
+# revision identifiers, used by Alembic.
+revision = '4c8e1f0a9b27'
+down_revision = '6ebdc67f9a78'
+branch_labels = None
+depends_on = None
+
+# Matches NOTIFICATION_PARTITIONS_AHEAD's default; `flask jobs maintain-partitions`
+# keeps creating partitions after this
+MONTHS_AHEAD = 2
+
+
+def _month_start(dt, offset=0):
+    month_index = dt.year * 12 + (dt.month - 1) + offset
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    op.execute(text("ALTER TABLE notifications RENAME TO notifications_unpartitioned"))
+    op.execute(text(
+        "ALTER TABLE notifications_unpartitioned "
+        "RENAME CONSTRAINT notifications_pkey TO notifications_unpartitioned_pkey"
+    ))
+
+    # The partition key has to be part of the primary key. The id sequence is
+    # reused so existing ids stay valid.
+    op.execute(text("""
+        CREATE TABLE notifications (
+            id INTEGER NOT NULL DEFAULT nextval('notifications_id_seq'),
+            title VARCHAR,
+            description VARCHAR,
+            notification_time TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            notification_sender INTEGER REFERENCES roommates (id),
+            notification_recipient INTEGER REFERENCES roommates (id),
+            room_fkey INTEGER REFERENCES rooms (id),
+            is_read BOOLEAN NOT NULL,
+            PRIMARY KEY (id, notification_time)
+        ) PARTITION BY RANGE (notification_time)
+    """))
+    op.execute(text("ALTER SEQUENCE notifications_id_seq OWNED BY notifications.id"))
+    op.execute(text(
+        "CREATE TABLE notifications_default PARTITION OF notifications DEFAULT"
+    ))
+
+    # One partition per month from the oldest notification up to MONTHS_AHEAD
+    # months from now, created before copying so nothing lands in the default
+    oldest = conn.execute(
+        text("SELECT MIN(notification_time) FROM notifications_unpartitioned")
+    ).scalar()
+    now = datetime.utcnow()
+    start = _month_start(oldest or now)
+    last = _month_start(now, MONTHS_AHEAD)
+    while start <= last:
+        end = _month_start(start, 1)
+        op.execute(text(
+            f"CREATE TABLE notifications_p{start.year:04d}{start.month:02d} "
+            f"PARTITION OF notifications "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+        start = end
+
+    op.execute(text("""
+        INSERT INTO notifications (
+            id, title, description, notification_time, notification_sender,
+            notification_recipient, room_fkey, is_read
+        )
+        SELECT
+            id, title, description, notification_time, notification_sender,
+            notification_recipient, room_fkey, is_read
+        FROM notifications_unpartitioned
+    """))
+    op.execute(text("DROP TABLE notifications_unpartitioned"))
+
+
+def downgrade():
+    op.create_table('notifications_unpartitioned',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('notifications_id_seq')"), nullable=False),
+    sa.Column('title', sa.String(), nullable=True),
+    sa.Column('description', sa.String(), nullable=True),
+    sa.Column('notification_time', sa.DateTime(), nullable=False),
+    sa.Column('notification_sender', sa.Integer(), nullable=True),
+    sa.Column('notification_recipient', sa.Integer(), nullable=True),
+    sa.Column('room_fkey', sa.Integer(), nullable=True),
+    sa.Column('is_read', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['notification_recipient'], ['roommates.id'], ),
+    sa.ForeignKeyConstraint(['notification_sender'], ['roommates.id'], ),
+    sa.ForeignKeyConstraint(['room_fkey'], ['rooms.id'], ),
+    sa.PrimaryKeyConstraint('id', name='notifications_unpartitioned_pkey')
+    )
+    op.execute(text("""
+        INSERT INTO notifications_unpartitioned
+        SELECT
+            id, title, description, notification_time, notification_sender,
+            notification_recipient, room_fkey, is_read
+        FROM notifications
+    """))
+    op.execute(text(
+        "ALTER SEQUENCE notifications_id_seq OWNED BY notifications_unpartitioned.id"
+    ))
+    # Dropping the parent drops every partition with it
+    op.execute(text("DROP TABLE notifications"))
+    op.execute(text("ALTER TABLE notifications_unpartitioned RENAME TO notifications"))
+    op.execute(text(
+        "ALTER TABLE notifications "
+        "RENAME CONSTRAINT notifications_unpartitioned_pkey TO notifications_pkey"
+    ))
@@ -0,0 +1,31 @@
+"""Add composite indexes for notification listing
+
+Revision ID: a3f27d6c5e10
+Revises: 4c8e1f0a9b27
+Create Date: 2026-10-19 11:03:17.604592
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f27d6c5e10'
+down_revision = '4c8e1f0a9b27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Indexes on the partitioned parent are created on every partition
+    op.create_index('ix_notifications_room_time', 'notifications', ['room_fkey', 'notification_time', 'id'], unique=False)
+    op.create_index('ix_notifications_room_recipient_time', 'notifications', ['room_fkey', 'notification_recipient', 'notification_time', 'id'], unique=False)
+    op.create_index('ix_notifications_room_sender_time', 'notifications', ['room_fkey', 'notification_sender', 'notification_time', 'id'], unique=False)
+    op.create_index('ix_notifications_room_recipient_sender_time', 'notifications', ['room_fkey', 'notification_recipient', 'notification_sender', 'notification_time', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_notifications_room_recipient_sender_time', table_name='notifications')
+    op.drop_index('ix_notifications_room_sender_time', table_name='notifications')
+    op.drop_index('ix_notifications_room_recipient_time', table_name='notifications')
+    op.drop_index('ix_notifications_room_time', table_name='notifications')
@@ -0,0 +1,68 @@
+"""Move profile pictures to the blob store
+
+Revision ID: c47e2a915b3d
+Revises: 8f3b6c0d2e57
+Create Date: 2026-10-19 19:48:13.527961
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy.sql import text
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47e2a915b3d'
+down_revision = '8f3b6c0d2e57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('roommates', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('profile_picture_hash', sa.String(length=64), nullable=True))
+
+    # Copy each picture into the blob store (on the app's BLOB_STORE_PATH) one
+    # row at a time so only one image is held in memory
+    blob_store = current_app.extensions['blob_store']
+    conn = op.get_bind()
+    ids = conn.execute(
+        text("SELECT id FROM roommates WHERE profile_picture IS NOT NULL")
+    ).scalars().all()
+    for roommate_id in ids:
+        data = conn.execute(
+            text("SELECT profile_picture FROM roommates WHERE id = :id"),
+            {"id": roommate_id},
+        ).scalar()
+        conn.execute(
+            text("UPDATE roommates SET profile_picture_hash = :digest WHERE id = :id"),
+            {"digest": blob_store.put(bytes(data)), "id": roommate_id},
+        )
+
+    with op.batch_alter_table('roommates', schema=None) as batch_op:
+        batch_op.drop_column('profile_picture')
+
+
+def downgrade():
+    with op.batch_alter_table('roommates', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('profile_picture', sa.LargeBinary(), nullable=True))
+
+    # Blobs are left in the store; `flask jobs prune-blobs` can remove them
+    blob_store = current_app.extensions['blob_store']
+    conn = op.get_bind()
+    rows = conn.execute(
+        text(
+            "SELECT id, profile_picture_hash FROM roommates "
+            "WHERE profile_picture_hash IS NOT NULL"
+        )
+    ).all()
+    for roommate_id, digest in rows:
+        if not blob_store.exists(digest):
+            continue
+        conn.execute(
+            text("UPDATE roommates SET profile_picture = :data WHERE id = :id"),
+            {"data": blob_store.read(digest), "id": roommate_id},
+        )
+
+    with op.batch_alter_table('roommates', schema=None) as batch_op:
+        batch_op.drop_column('profile_picture_hash')
@@ -0,0 +1,29 @@
+"""Add subject_key and coalesced_count to notifications
+
+Revision ID: d81b4e7a2c93
+Revises: a3f27d6c5e10
+Create Date: 2026-10-19 13:41:52.287310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81b4e7a2c93'
+down_revision = 'a3f27d6c5e10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('subject_key', sa.String(), nullable=True))
+        # Existing notifications each count as a single nudge
+        batch_op.add_column(sa.Column('coalesced_count', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_column('coalesced_count')
+        batch_op.drop_column('subject_key')
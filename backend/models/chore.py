@@ -22,7 +22,7 @@ class Chore(db.Model):
     start_date = Column(
         DateTime, default=datetime.utcnow, nullable=False
     )  # auto-set at creation (should be midnight)
-    end_date = Column(DateTime, nullable=False)
+    end_date = Column(DateTime, nullable=False, index=True)
     is_task = Column(Boolean, default=False, nullable=False)
     completed = Column(Boolean, nullable=True)
     # use as title
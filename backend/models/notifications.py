@@ -1,6 +1,16 @@
 from datetime import datetime
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import (
+    DDL,
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    event,
+)
 from sqlalchemy.orm import relationship
 
 from database import db
@@ -10,12 +20,63 @@ from database import db
 
 class Notification(db.Model):
     __tablename__ = "notifications"
+    # Range-partitioned by month on notification_time so old months can be dropped
+    # whole (see jobs/partitions.py). Postgres requires the partition key to be part
+    # of the primary key, but rows are still looked up by id alone.
+    # The composite indexes back every filter combination of GET /notifications,
+    # ending in (notification_time, id) for keyset pagination.
+    __table_args__ = (
+        Index("ix_notifications_room_time", "room_fkey", "notification_time", "id"),
+        Index(
+            "ix_notifications_room_recipient_time",
+            "room_fkey",
+            "notification_recipient",
+            "notification_time",
+            "id",
+        ),
+        Index(
+            "ix_notifications_room_sender_time",
+            "room_fkey",
+            "notification_sender",
+            "notification_time",
+            "id",
+        ),
+        Index(
+            "ix_notifications_room_recipient_sender_time",
+            "room_fkey",
+            "notification_recipient",
+            "notification_sender",
+            "notification_time",
+            "id",
+        ),
+        {"postgresql_partition_by": "RANGE (notification_time)"},
+    )
 
-    id = Column(Integer, primary_key=True, nullable=False)
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     title = Column(String, unique=False, nullable=True)
     description = Column(String, unique=False, nullable=True)
-    notification_time = Column(DateTime, default=datetime.utcnow, nullable=False)
+    notification_time = Column(
+        DateTime, primary_key=True, default=datetime.utcnow, nullable=False
+    )
     notification_sender = Column(Integer, ForeignKey("roommates.id"), nullable=True)
     notification_recipient = Column(Integer, ForeignKey("roommates.id"), nullable=True)
     room_fkey = Column(Integer, ForeignKey("rooms.id"), nullable=True)
     is_read = Column(Boolean, default=False, nullable=False)
+    # Identifies what the notification is about (e.g. "chore:12") so repeated
+    # nudges can be coalesced into one row; coalesced_count counts the nudges
+    subject_key = Column(String, nullable=True)
+    coalesced_count = Column(Integer, default=1, nullable=False)
+
+    __mapper_args__ = {"primary_key": [id]}
+
+
+# Catch-all partition so inserts never fail when no monthly partition exists yet
+# (e.g. tables created with db.create_all() in tests)
+event.listen(
+    Notification.__table__,
+    "after_create",
+    DDL(
+        "CREATE TABLE IF NOT EXISTS notifications_default "
+        "PARTITION OF notifications DEFAULT"
+    ).execute_if(dialect="postgresql"),
+)
@@ -1,7 +1,7 @@
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, LargeBinary, String
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy.orm import deferred, relationship
 
 from database import db
 
@@ -30,8 +30,11 @@ class Roommate(db.Model):
     first_name = Column(String, nullable=False)  # new field for first name
     last_name = Column(String, nullable=False)  # new field for last name
     username = Column(String, unique=True, nullable=False)  # unique username for login
-    password_hash = Column(String, nullable=False)  # hashed password
-    profile_picture = Column(LargeBinary, nullable=True)
+    # hashed password; deferred since only login needs it
+    password_hash = deferred(Column(String, nullable=False))
+    # SHA-256 of the picture's bytes, which live in the blob store
+    # (utils/blob_store.py) rather than in this table
+    profile_picture_hash = Column(String(64), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(
         DateTime(timezone=True),
@@ -40,6 +43,9 @@ class Roommate(db.Model):
         nullable=False,
     )
     room_fkey = Column(Integer, ForeignKey("rooms.id"), nullable=True)
+    # Bumped whenever room_fkey changes; access tokens carry the version they were
+    # issued at so stale ones can be spotted (see utils/context.py)
+    membership_version = Column(Integer, default=0, server_default="0", nullable=False)
 
     expense_list = relationship(
         "Expense", secondary="roommate_expenses", back_populates="roommate_list"
@@ -51,3 +57,27 @@ class Roommate(db.Model):
         foreign_keys="[Chore.assignee_fkey]",
         back_populates="assignee",
     )
+
+
+# Push notification token for one of a roommate's devices
+class Device_Token(db.Model):
+    __tablename__ = "device_tokens"
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    roommate_fkey = Column(
+        Integer, ForeignKey("roommates.id"), nullable=False, index=True
+    )
+    token = Column(String, unique=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+# A revoked access or refresh token, kept until the token would have expired
+# anyway. Every worker mirrors this table in memory (see utils/revocation.py).
+class Revoked_Token(db.Model):
+    __tablename__ = "revoked_tokens"
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    jti = Column(String, unique=True, nullable=False)
+    roommate_fkey = Column(Integer, ForeignKey("roommates.id"), nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
@@ -1,11 +1,14 @@
 from datetime import datetime, timedelta, timezone
 
 from flask import jsonify, request
-from flask_jwt_extended import get_jwt_identity, jwt_required
 
 from database import db
 from models.chore import Chore
 from models.roommate import Roommate
+from utils.context import current_context, get_membership
+from utils.domain_events import record_event
+from utils.identity import identity_required
+from utils.projection import project
 
 
 # Rotates the chore to the next roommate in the rotation if the end_date has passed
@@ -60,20 +63,23 @@ def rotate_chore(chore):
 
 # GET /chores
 # Returns all active chores in the current user's room.
-@jwt_required()
+@identity_required
 def get_chores():
-    current_roommate_id = int(get_jwt_identity())
-
-    current_roommate = Roommate.query.get(current_roommate_id)
-    if not current_roommate:
+    context = current_context()
+    if not context:
         return jsonify({"message": "User not found"}), 404
 
-    if not current_roommate.room_fkey:
+    if not context.room_id:
         return jsonify({"message": "User is not in a room"}), 400
 
-    # Get all roommates in the same room
-    roommates = Roommate.query.filter_by(room_fkey=current_roommate.room_fkey).all()
-    roommate_ids = [rm.id for rm in roommates]
+    # Get all roommates in the same room (only the columns the response uses)
+    roommates = {
+        rm.id: rm
+        for rm in project(Roommate, "id", "first_name", "last_name").filter_by(
+            room_fkey=context.room_id
+        )
+    }
+    roommate_ids = list(roommates)
 
     # Get active chores in the same room (active meaning start_date <= now() <= end_date)
     now_utc = datetime.now()
@@ -91,11 +97,12 @@ def get_chores():
     data = []
     for chore in active_chores:
         assigned_roommate_data = None
-        if chore.assignee:
+        assignee = roommates.get(chore.assignee_fkey)
+        if assignee:
             assigned_roommate_data = {
-                "id": chore.assignee.id,
-                "first_name": chore.assignee.first_name,
-                "last_name": chore.assignee.last_name,
+                "id": assignee.id,
+                "first_name": assignee.first_name,
+                "last_name": assignee.last_name,
                 # etc. add fields we want. can change in future
             }
         chore_data = {
@@ -116,7 +123,7 @@ def get_chores():
             .replace("+00:00", "Z"),
             "is_task": chore.is_task,
             "completed": chore.completed,
-            "room_id": current_roommate.room_fkey,
+            "room_id": context.room_id,
             "assigned_roommate": assigned_roommate_data,
             "roommate_assignor_id": chore.assignor_fkey,
             "rotation_order": chore.rotation_order,
@@ -129,15 +136,13 @@ def get_chores():
 
 # POST /chores
 # Creates a new chore.
-@jwt_required()
+@identity_required
 def create_chore():
-    current_roommate_id = int(get_jwt_identity())
-
-    current_roommate = Roommate.query.get(current_roommate_id)
-    if not current_roommate:
+    context = current_context()
+    if not context:
         return jsonify({"message": "User not found"}), 404
 
-    if not current_roommate.room_fkey:
+    if not context.room_id:
         return jsonify({"message": "User is not in a room"}), 400
 
     data = request.get_json()
@@ -162,22 +167,22 @@ def create_chore():
     ):
         return jsonify({"message": "Missing required fields"}), 400
 
-    assigned_roommate = Roommate.query.get(assigned_roommate_id)
+    assigned_roommate = get_membership(assigned_roommate_id)
     if not assigned_roommate:
         return jsonify({"message": "Assigned roommate not found"}), 404
 
-    if assigned_roommate.room_fkey != current_roommate.room_fkey:
+    if assigned_roommate.room_id != context.room_id:
         return jsonify({"message": "Assigned roommate is not in the same room"}), 400
 
     if recurrence != "none" and rotation_order is not None:
         for roommate_id in rotation_order:
-            roommate = Roommate.query.get(roommate_id)
+            roommate = get_membership(roommate_id)
             if not roommate:
                 return (
                     jsonify({"message": "Rotation order contains invalid roommate id"}),
                     400,
                 )
-            if roommate.room_fkey != current_roommate.room_fkey:
+            if roommate.room_id != context.room_id:
                 return (
                     jsonify(
                         {
@@ -200,13 +205,23 @@ def create_chore():
         end_date=end_date,
         is_task=is_task,
         completed=False,
-        assignor_fkey=current_roommate_id,  # using the current user as assignor
+        assignor_fkey=context.roommate_id,  # using the current user as assignor
         assignee_fkey=assigned_roommate_id,
         recurrence=recurrence,
         rotation_order=rotation_order,
     )
 
     db.session.add(new_chore)
+    db.session.flush()  # Ensures new_chore.id is generated
+    record_event(
+        db.session,
+        "chore_assigned",
+        room_id=context.room_id,
+        chore_id=new_chore.id,
+        description=new_chore.description,
+        assignor_id=context.roommate_id,
+        assignee_id=new_chore.assignee_fkey,
+    )
     db.session.commit()
 
     assigned_roommate_data = None
@@ -236,7 +251,7 @@ def create_chore():
         "completed": new_chore.completed,
         "assigned_roommate": assigned_roommate_data,
         "roommate_assignor_id": new_chore.assignor_fkey,
-        "room_id": current_roommate.room_fkey,
+        "room_id": context.room_id,
         "recurrence": new_chore.recurrence,
         "rotation_order": new_chore.rotation_order,
     }
@@ -246,23 +261,21 @@ def create_chore():
 
 # PUT /chores/<int:chore_id>
 # Updates an existing chore.
-@jwt_required()
+@identity_required
 def update_chore(chore_id):
-    current_roommate_id = int(get_jwt_identity())
-
-    current_roommate = Roommate.query.get(current_roommate_id)
-    if not current_roommate:
+    context = current_context()
+    if not context:
         return jsonify({"message": "User not found"}), 404
 
-    if not current_roommate.room_fkey:
+    if not context.room_id:
         return jsonify({"message": "User is not in a room"}), 400
 
     chore = Chore.query.get(chore_id)
     if not chore:
         return jsonify({"message": "Chore not found"}), 404
 
-    current_assigned_roommate = Roommate.query.get(chore.assignee_fkey)
-    if current_assigned_roommate.room_fkey != current_roommate.room_fkey:
+    current_assigned_roommate = get_membership(chore.assignee_fkey)
+    if current_assigned_roommate.room_id != context.room_id:
         return jsonify({"message": "This chore does not belong to the same room"}), 400
 
     data = request.get_json()
@@ -279,13 +292,13 @@ def update_chore(chore_id):
     # Update rotation_order and assignee_fkey together if rotation_order is provided
     if recurrence != "none" and rotation_order is not None:
         for roommate_id in rotation_order:
-            roommate = Roommate.query.get(roommate_id)
+            roommate = get_membership(roommate_id)
             if not roommate:
                 return (
                     jsonify({"message": "Rotation order contains invalid roommate id"}),
                     400,
                 )
-            if roommate.room_fkey != current_roommate.room_fkey:
+            if roommate.room_id != context.room_id:
                 return (
                     jsonify(
                         {
@@ -301,10 +314,10 @@ def update_chore(chore_id):
             chore.assignee_fkey = rotation_order[0]
     # If this is not a recurring chore (no rotation_order) and assigned_roommate_id is provided
     elif assigned_roommate_id is not None:
-        roommate = Roommate.query.get(assigned_roommate_id)
+        roommate = get_membership(assigned_roommate_id)
         if not roommate:
             return jsonify({"message": "Assigned roommate not found"}), 404
-        if roommate.room_fkey != current_roommate.room_fkey:
+        if roommate.room_id != context.room_id:
             return (
                 jsonify({"message": "Assigned roommate is not in the same room"}),
                 400,
@@ -333,6 +346,17 @@ def update_chore(chore_id):
     if completed is not None:
         chore.completed = completed
 
+    if chore.assignee_fkey != current_assigned_roommate.roommate_id:
+        record_event(
+            db.session,
+            "chore_assigned",
+            room_id=context.room_id,
+            chore_id=chore.id,
+            description=chore.description,
+            assignor_id=context.roommate_id,
+            assignee_id=chore.assignee_fkey,
+        )
+
     db.session.commit()
 
     assigned_roommate_data = None
@@ -362,7 +386,7 @@ def update_chore(chore_id):
         "completed": chore.completed,
         "assigned_roommate": assigned_roommate_data,
         "roommate_assignor_id": chore.assignor_fkey,
-        "room_id": current_roommate.room_fkey,
+        "room_id": context.room_id,
         "recurrence": chore.recurrence,
         "rotation_order": chore.rotation_order,
     }
@@ -372,23 +396,21 @@ def update_chore(chore_id):
 
 # DELETE /chores/<int:chore_id>
 # Deletes a chore.
-@jwt_required()
+@identity_required
 def delete_chore(chore_id):
-    current_roommate_id = int(get_jwt_identity())
-
-    current_roommate = Roommate.query.get(current_roommate_id)
-    if not current_roommate:
+    context = current_context()
+    if not context:
         return jsonify({"message": "User not found"}), 404
 
-    if not current_roommate.room_fkey:
+    if not context.room_id:
         return jsonify({"message": "User is not in a room"}), 400
 
     chore = Chore.query.get(chore_id)
     if not chore:
         return jsonify({"message": "Chore not found"}), 404
 
-    assigned_roommate = Roommate.query.get(chore.assignee_fkey)
-    if assigned_roommate.room_fkey != current_roommate.room_fkey:
+    assigned_roommate = get_membership(chore.assignee_fkey)
+    if assigned_roommate.room_id != context.room_id:
         return jsonify({"message": "This chore does not belong to the same room"}), 400
 
     db.session.delete(chore)
@@ -5,26 +5,25 @@ from flask_jwt_extended import (
     JWTManager,
     create_access_token,
     get_jwt_identity,
-    jwt_required,
 )
 
 from database import db
 from models.expense import Expense, Expense_Period, Roommate_Expense
-from models.roommate import Room, Roommate
+from models.roommate import Roommate
+from utils.context import current_context
+from utils.domain_events import record_event
+from utils.identity import identity_required
+from utils.projection import project
 
 
-@jwt_required()
+@identity_required
 def create_expense():
-    roommate_id = get_jwt_identity()
-    roommate = Roommate.query.get(roommate_id)
-    if not roommate or not roommate.room_fkey:
+    context = current_context()
+    if not context or not context.room_id:
         return jsonify({"room_id": None}), 404
-    room = Room.query.get(roommate.room_fkey)
-    if not room:
-        return jsonify({"message": "Room not found"}), 404
 
     expense_period = Expense_Period.query.filter_by(
-        room_fkey=room.id, open=True
+        room_fkey=context.room_id, open=True
     ).first()
 
     if not expense_period:
@@ -39,11 +38,11 @@ def create_expense():
         cost=data["cost"],
         description=data["description"].strip(),
         expense_period_fkey=expense_period.id,
-        room_fkey=room.id,
+        room_fkey=context.room_id,
         roommate_fkey=(
             data["roommate_spendor_id"]
             if "roommate_spendor_id" in data
-            else roommate.id
+            else context.roommate_id
         ),
     )
 
@@ -53,9 +52,13 @@ def create_expense():
 
     roommate_expenses = []
     for expense in expenses:
-        roommate = Roommate.query.filter_by(
-            room_fkey=room.id, username=expense.get("username").strip()
-        ).first()
+        roommate = (
+            project(Roommate, "id")
+            .filter_by(
+                room_fkey=context.room_id, username=expense.get("username").strip()
+            )
+            .first()
+        )
         if roommate:
             new_roommate_expense = Roommate_Expense(
                 expense_fkey=new_expense.id,
@@ -80,6 +83,16 @@ def create_expense():
                 404,
             )
 
+    db.session.flush()  # Ensures new_expense.id is generated
+    record_event(
+        db.session,
+        "expense_created",
+        room_id=context.room_id,
+        expense_id=new_expense.id,
+        title=new_expense.title,
+        spender_id=new_expense.roommate_fkey,
+        participant_ids=[re["roommate_fkey"] for re in roommate_expenses],
+    )
     db.session.commit()
 
     return (
@@ -101,32 +114,31 @@ def create_expense():
     )
 
 
-@jwt_required()
+@identity_required
 def get_expense():
-    roommate_id = get_jwt_identity()
-    roommate = Roommate.query.get(roommate_id)
-    if not roommate or not roommate.room_fkey:
+    context = current_context()
+    if not context or not context.room_id:
         return jsonify({"room_id": None}), 404
-    room = Room.query.get(roommate.room_fkey)
-    if not room:
-        return jsonify({"message": "Room not found"}), 404
 
-    expenses = Expense.query.filter_by(room_fkey=room.id).all()
+    expenses = Expense.query.filter_by(room_fkey=context.room_id).all()
 
-    result = []
-    for expense in expenses:
-        roommate_expenses_result = []
-        roommate_expenses = Roommate_Expense.query.filter_by(
-            expense_fkey=expense.id
+    # Load every expense's split in one query rather than one per expense
+    roommate_expenses_by_expense = {expense.id: [] for expense in expenses}
+    if expenses:
+        roommate_expenses = Roommate_Expense.query.filter(
+            Roommate_Expense.expense_fkey.in_(list(roommate_expenses_by_expense))
         ).all()
         for roommate_expense in roommate_expenses:
-            roommate_expenses_result.append(
+            roommate_expenses_by_expense[roommate_expense.expense_fkey].append(
                 {
                     "expense_fkey": roommate_expense.expense_fkey,
                     "roommate_fkey": roommate_expense.roommate_fkey,
                     "percentage": roommate_expense.percentage,
                 }
             )
+
+    result = []
+    for expense in expenses:
         result.append(
             {
                 "id": expense.id,
@@ -138,25 +150,23 @@ def get_expense():
                 "expense_period_fkey": expense.expense_period_fkey,
                 "room_fkey": expense.room_fkey,
                 "roommate_fkey": expense.roommate_fkey,
-                "roommate_expenses": roommate_expenses_result,
+                "roommate_expenses": roommate_expenses_by_expense[expense.id],
             }
         )
     return jsonify(result), 200
 
 
-@jwt_required()
+@identity_required
 def update_expense():
-    roommate_id = get_jwt_identity()
-    roommate = Roommate.query.get(roommate_id)
-    if not roommate or not roommate.room_fkey:
+    context = current_context()
+    if not context or not context.room_id:
         return jsonify({"room_id": None}), 404
-    room = Room.query.get(roommate.room_fkey)
-    if not room:
-        return jsonify({"message": "Room not found"}), 404
 
     data = request.get_json()
 
-    expense = Expense.query.filter_by(roommate_fkey=roommate_id, id=data["id"]).first()
+    expense = Expense.query.filter_by(
+        roommate_fkey=context.roommate_id, id=data["id"]
+    ).first()
 
     if expense:
         expense.updated_at = datetime.utcnow()
@@ -171,9 +181,13 @@ def update_expense():
         if "expenses" in data:
             expenses = data.get("expenses", [])
             for ex in expenses:
-                roommate = Roommate.query.filter_by(
-                    room_fkey=room.id, username=ex.get("username").strip()
-                ).first()
+                roommate = (
+                    project(Roommate, "id")
+                    .filter_by(
+                        room_fkey=context.room_id, username=ex.get("username").strip()
+                    )
+                    .first()
+                )
                 if roommate:
                     roommate_expense = Roommate_Expense.query.filter_by(
                         roommate_fkey=roommate.id, expense_fkey=expense.id
@@ -230,19 +244,15 @@ def update_expense():
     )
 
 
-@jwt_required()
+@identity_required
 def remove_expense():
-    roommate_id = get_jwt_identity()
-    roommate = Roommate.query.get(roommate_id)
-    if not roommate or not roommate.room_fkey:
+    context = current_context()
+    if not context or not context.room_id:
         return jsonify({"room_id": None}), 404
-    room = Room.query.get(roommate.room_fkey)
-    if not room:
-        return jsonify({"message": "Room not found"}), 404
 
     data = request.get_json()
 
-    expense = Expense.query.filter_by(room_fkey=room.id, id=data["id"]).first()
+    expense = Expense.query.filter_by(room_fkey=context.room_id, id=data["id"]).first()
 
     if expense:
         roommate_expenses = Roommate_Expense.query.filter_by(
@@ -5,26 +5,24 @@ from flask_jwt_extended import (
     JWTManager,
     create_access_token,
     get_jwt_identity,
-    jwt_required,
 )
 
 from database import db
 from models.expense import Expense, Expense_Period
-from models.roommate import Room, Roommate
+from models.roommate import Roommate
+from utils.context import current_context
+from utils.domain_events import record_event
+from utils.identity import identity_required
 
 
-@jwt_required()
+@identity_required
 def create_expense_period():
-    roommate_id = get_jwt_identity()
-    roommate = Roommate.query.get(roommate_id)
-    if not roommate or not roommate.room_fkey:
+    context = current_context()
+    if not context or not context.room_id:
         return jsonify({"room_id": None}), 404
-    room = Room.query.get(roommate.room_fkey)
-    if not room:
-        return jsonify({"message": "Room not found"}), 404
 
     new_expense_period = Expense_Period(
-        room_fkey=room.id,
+        room_fkey=context.room_id,
         start_date=datetime.utcnow(),
         end_date=datetime.utcnow(),
         open=True,
@@ -47,17 +45,13 @@ def create_expense_period():
     )
 
 
-@jwt_required()
+@identity_required
 def get_expense_period():
-    roommate_id = get_jwt_identity()
-    roommate = Roommate.query.get(roommate_id)
-    if not roommate or not roommate.room_fkey:
+    context = current_context()
+    if not context or not context.room_id:
         return jsonify({"room_id": None}), 404
-    room = Room.query.get(roommate.room_fkey)
-    if not room:
-        return jsonify({"message": "Room not found"}), 404
 
-    expense_periods = Expense_Period.query.filter_by(room_fkey=room.id).all()
+    expense_periods = Expense_Period.query.filter_by(room_fkey=context.room_id).all()
 
     expense_period_result = []
     for expense_period in expense_periods:
@@ -90,38 +84,53 @@ def get_expense_period():
     return jsonify(expense_period_result), 200
 
 
-@jwt_required()
+@identity_required
 def close_expense_period():
-    roommate_id = get_jwt_identity()
-    roommate = Roommate.query.get(roommate_id)
-    if not roommate or not roommate.room_fkey:
+    context = current_context()
+    if not context or not context.room_id:
         return jsonify({"room_id": None}), 404
-    room = Room.query.get(roommate.room_fkey)
-    if not room:
-        return jsonify({"message": "Room not found"}), 404
 
     expense_period = Expense_Period.query.filter_by(
-        room_fkey=room.id, open=True
+        room_fkey=context.room_id, open=True
     ).first()
 
     if expense_period:
         expense_period.open = False
         expense_period.end_date = datetime.utcnow()
+        roommate_ids = [
+            roommate_id
+            for (roommate_id,) in db.session.query(Roommate.id).filter_by(
+                room_fkey=context.room_id
+            )
+        ]
+        record_event(
+            db.session,
+            "expense_period_closed",
+            room_id=context.room_id,
+            expense_period_id=expense_period.id,
+            closed_by_id=context.roommate_id,
+            roommate_ids=roommate_ids,
+        )
         db.session.commit()
         return create_expense_period()
     else:
         return jsonify({"message": "Open expense period not found"}), 404
 
 
-@jwt_required()
+@identity_required
 def delete_expense_period():
-    data = request.get_json()
+    context = current_context()
+    if not context or not context.room_id:
+        return jsonify({"room_id": None}), 404
 
-    expense_period = Expense_Period.query.filter_by(id=data["id"]).first()
+    data = request.get_json()
 
-    expenses = Expense.query.filter_by(expense_period_fkey=expense_period.id).all()
+    expense_period = Expense_Period.query.filter_by(
+        id=data["id"], room_fkey=context.room_id
+    ).first()
 
     if expense_period:
+        expenses = Expense.query.filter_by(expense_period_fkey=expense_period.id).all()
         for expense in expenses:
             db.session.delete(expense)
         db.session.delete(expense_period)
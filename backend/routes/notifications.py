@@ -1,53 +1,149 @@
-from datetime import datetime
+import base64
+from datetime import datetime, timedelta, timezone
 
-from flask import jsonify, request
+from flask import current_app, jsonify, request
 from flask_jwt_extended import (
     JWTManager,
     create_access_token,
     get_jwt_identity,
-    jwt_required,
 )
+from sqlalchemy import func, text, tuple_, update
 
 from database import db
 from models.notifications import Notification
-from models.roommate import Room, Roommate
+from utils.context import current_context, get_membership
+from utils.identity import identity_required
+from utils.push_dispatcher import push_dispatcher
 
 
-@jwt_required()
+# Inserts a notification, or folds it into the newest unread notification with the
+# same (sender, recipient, subject_key) from within `window`, bumping its count and
+# time. Notifications is partitioned on notification_time, so Postgres can't hold
+# the unique index ON CONFLICT would need; the upsert is a single writable CTE and
+# an advisory lock on the key serialises concurrent nudges.
+# Returns the resulting row and whether an existing notification was updated.
+# NOTE: This relies on the caller to commit the changes to the database
+def upsert_coalesced_notification(
+    room_id, sender_id, recipient_id, subject_key, title, description, window
+):
+    now = datetime.utcnow()
+    params = {
+        "room_fkey": room_id,
+        "sender": sender_id,
+        "recipient": recipient_id,
+        "subject_key": subject_key,
+        "title": title,
+        "description": description,
+        "now": now,
+        "window_start": now - window,
+    }
+
+    db.session.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext(:lock_key))"),
+        {"lock_key": f"notification:{sender_id}:{recipient_id}:{subject_key}"},
+    )
+    row = db.session.execute(
+        text(
+            """
+            WITH existing AS (
+                SELECT id, notification_time FROM notifications
+                WHERE room_fkey = :room_fkey
+                    AND notification_recipient = :recipient
+                    AND notification_sender = :sender
+                    AND subject_key = :subject_key
+                    AND is_read = FALSE
+                    AND notification_time >= :window_start
+                ORDER BY notification_time DESC, id DESC
+                LIMIT 1
+            ), updated AS (
+                UPDATE notifications
+                SET coalesced_count = notifications.coalesced_count + 1,
+                    notification_time = :now,
+                    title = :title,
+                    description = :description
+                FROM existing
+                WHERE notifications.id = existing.id
+                    AND notifications.notification_time = existing.notification_time
+                RETURNING notifications.*, TRUE AS coalesced
+            ), inserted AS (
+                INSERT INTO notifications (
+                    title, description, notification_time, notification_sender,
+                    notification_recipient, room_fkey, is_read, subject_key,
+                    coalesced_count
+                )
+                SELECT
+                    :title, :description, :now, :sender, :recipient, :room_fkey,
+                    FALSE, :subject_key, 1
+                WHERE NOT EXISTS (SELECT 1 FROM existing)
+                RETURNING notifications.*, FALSE AS coalesced
+            )
+            SELECT * FROM updated UNION ALL SELECT * FROM inserted
+            """
+        ),
+        params,
+    ).first()
+    return row, row.coalesced
+
+
+@identity_required
 def create_notification():
-    roommate_id = get_jwt_identity()
-    roommate = Roommate.query.get(roommate_id)
-    if not roommate or not roommate.room_fkey:
+    context = current_context()
+    if not context or not context.room_id:
         return jsonify({"room_id": None}), 404
-    room = Room.query.get(roommate.room_fkey)
-    if not room:
-        return jsonify({"message": "Room not found"}), 404
 
     data = request.get_json()
 
     if "notification_sender" in data:
-        notification_sender = Roommate.query.get(data.get("notification_sender"))
+        notification_sender = get_membership(data.get("notification_sender"))
         if not notification_sender:
             return jsonify({"message": "Roommate sender id not found"}), 404
     else:
-        notification_sender = roommate
+        notification_sender = context
 
-    notification_recipient = Roommate.query.get(data.get("notification_recipient"))
+    notification_recipient = get_membership(data.get("notification_recipient"))
     if not notification_recipient:
         return jsonify({"message": "Roommate recipient id not found"}), 404
 
-    new_notification = Notification(
-        title=data.get("title"),
-        description=data.get("description"),
-        notification_time=datetime.utcnow(),
-        notification_sender=notification_sender.id,
-        notification_recipient=notification_recipient.id,
-        room_fkey=room.id,
-        is_read=False,
-    )
+    # Repeated nudges about the same chore/expense ("subject_key", e.g. "chore:12")
+    # are folded into the existing unread notification instead of piling up
+    subject_key = data.get("subject_key")
+    if subject_key:
+        new_notification, coalesced = upsert_coalesced_notification(
+            context.room_id,
+            notification_sender.roommate_id,
+            notification_recipient.roommate_id,
+            subject_key,
+            data.get("title"),
+            data.get("description"),
+            timedelta(seconds=current_app.config["NOTIFICATION_COALESCE_WINDOW"]),
+        )
+        db.session.commit()
+        status = 200 if coalesced else 201
+    else:
+        new_notification = Notification(
+            title=data.get("title"),
+            description=data.get("description"),
+            notification_time=datetime.utcnow(),
+            notification_sender=notification_sender.roommate_id,
+            notification_recipient=notification_recipient.roommate_id,
+            room_fkey=context.room_id,
+            is_read=False,
+        )
 
-    db.session.add(new_notification)
-    db.session.commit()
+        db.session.add(new_notification)
+        db.session.commit()
+        status = 201
+
+    push_dispatcher.dispatch(
+        [
+            {
+                "id": new_notification.id,
+                "title": new_notification.title,
+                "description": new_notification.description,
+                "notification_recipient": new_notification.notification_recipient,
+            }
+        ]
+    )
 
     return (
         jsonify(
@@ -60,26 +156,56 @@ def create_notification():
                 "notification_recipient": new_notification.notification_recipient,
                 "room_fkey": new_notification.room_fkey,
                 "is_read": new_notification.is_read,
+                "subject_key": new_notification.subject_key,
+                "coalesced_count": new_notification.coalesced_count,
             }
         ),
-        201,
+        status,
     )
 
 
-@jwt_required()
+# Page size for GET /notifications when the caller doesn't pass "limit"
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+# Cursors are "<notification_time>_<id>" of the last row on the previous page,
+# base64-encoded so clients treat them as opaque
+def encode_cursor(notification):
+    raw = f"{notification.notification_time.isoformat()}_{notification.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    notification_time, notification_id = raw.rsplit("_", 1)
+    return datetime.fromisoformat(notification_time), int(notification_id)
+
+
+# GET /notifications
+# Filters may be sent in the JSON body or as query parameters. Lists are always
+# scoped to the caller's room, newest first, and paginated by keyset on
+# (notification_time, id); the next page's cursor is returned in X-Next-Cursor.
+@identity_required
 def get_notification():
-    roommate_id = get_jwt_identity()
-    roommate = Roommate.query.get(roommate_id)
-    if not roommate or not roommate.room_fkey:
+    context = current_context()
+    if not context or not context.room_id:
         return jsonify({"room_id": None}), 404
-    room = Room.query.get(roommate.room_fkey)
-    if not room:
-        return jsonify({"message": "Room not found"}), 404
 
-    data = request.get_json(silent=True)
+    data = request.get_json(silent=True) or {}
+    filters = {}
+    for key in ("notification_id", "notification_sender", "notification_recipient"):
+        value = data.get(key, request.args.get(key))
+        if value is not None:
+            try:
+                filters[key] = int(value)
+            except (TypeError, ValueError):
+                return jsonify({"message": f"Invalid {key}"}), 400
 
-    if not data is None and "notification_id" in data:
-        notification = Notification.query.get(data["notification_id"])
+    if "notification_id" in filters:
+        notification = Notification.query.filter_by(
+            id=filters["notification_id"], room_fkey=context.room_id
+        ).first()
 
         if not notification:
             return jsonify({"message": "Notification not found"}), 404
@@ -95,27 +221,50 @@ def get_notification():
                     "notification_recipient": notification.notification_recipient,
                     "room_fkey": notification.room_fkey,
                     "is_read": notification.is_read,
+                    "subject_key": notification.subject_key,
+                    "coalesced_count": notification.coalesced_count,
                 }
             ),
             200,
         )
 
-    elif not data is None:
-        if "notification_recipient" in data and "notification_sender" in data:
-            notifications = Notification.query.filter_by(
-                notification_recipient=data["notification_recipient"],
-                notification_sender=data["notification_sender"],
-            ).all()
-        elif "notification_sender" in data:
-            notifications = Notification.query.filter_by(
-                notification_sender=data["notification_sender"]
-            ).all()
-        elif "notification_recipient" in data:
-            notifications = Notification.query.filter_by(
-                notification_recipient=data["notification_recipient"]
-            ).all()
-    else:
-        notifications = Notification.query.filter_by(room_fkey=room.id)
+    try:
+        limit = int(data.get("limit", request.args.get("limit", DEFAULT_PAGE_SIZE)))
+    except (TypeError, ValueError):
+        return jsonify({"message": "Invalid limit"}), 400
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    # Every combination is served by one of the (room_fkey, ...,
+    # notification_time, id) indexes on the notifications table
+    query = Notification.query.filter(Notification.room_fkey == context.room_id)
+    if "notification_recipient" in filters:
+        query = query.filter(
+            Notification.notification_recipient == filters["notification_recipient"]
+        )
+    if "notification_sender" in filters:
+        query = query.filter(
+            Notification.notification_sender == filters["notification_sender"]
+        )
+
+    cursor = data.get("cursor", request.args.get("cursor"))
+    if cursor:
+        try:
+            cursor_time, cursor_id = decode_cursor(cursor)
+        except Exception:
+            return jsonify({"message": "Invalid cursor"}), 400
+        query = query.filter(
+            tuple_(Notification.notification_time, Notification.id)
+            < tuple_(cursor_time, cursor_id)
+        )
+
+    # Fetch one extra row to know whether there is a next page
+    notifications = (
+        query.order_by(Notification.notification_time.desc(), Notification.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(notifications) > limit
+    notifications = notifications[:limit]
 
     result = []
     for n in notifications:
@@ -129,24 +278,38 @@ def get_notification():
                 "notification_recipient": n.notification_recipient,
                 "room_fkey": n.room_fkey,
                 "is_read": n.is_read,
+                "subject_key": n.subject_key,
+                "coalesced_count": n.coalesced_count,
             }
         )
-    return jsonify(result), 200
 
+    response = jsonify(result)
+    if has_more:
+        response.headers["X-Next-Cursor"] = encode_cursor(notifications[-1])
+    return response, 200
 
-@jwt_required()
+
+@identity_required
 def update_notification():
+    context = current_context()
+    if not context or not context.room_id:
+        return jsonify({"room_id": None}), 404
+
     data = request.get_json()
 
-    notification = Notification.query.get(data["notification_id"])
+    notification = Notification.query.filter_by(
+        id=data["notification_id"], room_fkey=context.room_id
+    ).first()
+    if not notification:
+        return jsonify({"message": "Notification not found"}), 404
 
     if "notification_sender" in data:
-        notification_sender = Roommate.query.get(data.get("notification_sender"))
+        notification_sender = get_membership(data.get("notification_sender"))
         if not notification_sender:
             return jsonify({"message": "Roommate sender id not found"}), 404
 
     if "notification_sender" in data:
-        notification_recipient = Roommate.query.get(data.get("notification_recipient"))
+        notification_recipient = get_membership(data.get("notification_recipient"))
         if not notification_recipient:
             return jsonify({"message": "Roommate recipient id not found"}), 404
 
@@ -190,16 +353,107 @@ def update_notification():
                 "notification_recipient": notification.notification_recipient,
                 "room_fkey": notification.room_fkey,
                 "is_read": notification.is_read,
+                "subject_key": notification.subject_key,
+                "coalesced_count": notification.coalesced_count,
             }
         ),
         200,
     )
 
 
-@jwt_required()
+# JSON ids are ints; bools are ints in Python, but True isn't id 1
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# PUT /notifications/read
+# Marks the caller's notifications as read in a single UPDATE. Accepts either a list
+# of ids ("notification_ids") or everything up to an id ("up_to_id") or a time
+# ("up_to_time").
+@identity_required
+def mark_notifications_read():
+    context = current_context()
+    if not context or not context.room_id:
+        return jsonify({"room_id": None}), 404
+
+    data = request.get_json(silent=True) or {}
+
+    selectors = [
+        key for key in ("notification_ids", "up_to_id", "up_to_time") if key in data
+    ]
+    if len(selectors) != 1:
+        return (
+            jsonify(
+                {
+                    "message": "Provide exactly one of notification_ids, up_to_id or up_to_time"
+                }
+            ),
+            400,
+        )
+
+    if "notification_ids" in data:
+        notification_ids = data["notification_ids"]
+        if not isinstance(notification_ids, list) or not all(
+            _is_id(notification_id) for notification_id in notification_ids
+        ):
+            return jsonify({"message": "notification_ids must be a list of ids"}), 400
+        condition = Notification.id.in_(notification_ids)
+    elif "up_to_id" in data:
+        if not _is_id(data["up_to_id"]):
+            return jsonify({"message": "up_to_id must be an id"}), 400
+        condition = Notification.id <= data["up_to_id"]
+    else:
+        try:
+            up_to_time = datetime.fromisoformat(data["up_to_time"])
+        except Exception:
+            return jsonify({"message": "Invalid up_to_time format"}), 400
+        # notification_time is stored as naive UTC
+        if up_to_time.tzinfo is not None:
+            up_to_time = up_to_time.astimezone(timezone.utc).replace(tzinfo=None)
+        condition = Notification.notification_time <= up_to_time
+
+    updated_ids = (
+        db.session.execute(
+            update(Notification)
+            .where(
+                Notification.room_fkey == context.room_id,
+                Notification.notification_recipient == context.roommate_id,
+                Notification.is_read.is_(False),
+                condition,
+            )
+            .values(is_read=True)
+            .returning(Notification.id)
+            .execution_options(synchronize_session=False)
+        )
+        .scalars()
+        .all()
+    )
+
+    # Remaining unread count so clients can update their badge without refetching
+    unread_count = (
+        db.session.query(func.count(Notification.id))
+        .filter(
+            Notification.room_fkey == context.room_id,
+            Notification.notification_recipient == context.roommate_id,
+            Notification.is_read.is_(False),
+        )
+        .scalar()
+    )
+    db.session.commit()
+
+    return jsonify({"updated_ids": updated_ids, "unread_count": unread_count}), 200
+
+
+@identity_required
 def delete_notification():
+    context = current_context()
+    if not context or not context.room_id:
+        return jsonify({"room_id": None}), 404
+
     data = request.get_json()
-    notification = Notification.query.get(data["notification_id"])
+    notification = Notification.query.filter_by(
+        id=data["notification_id"], room_fkey=context.room_id
+    ).first()
 
     if notification:
         db.session.delete(notification)
@@ -3,12 +3,20 @@ import string
 from datetime import datetime
 
 from flask import jsonify, request
-from flask_jwt_extended import get_jwt_identity, jwt_required
+from flask_jwt_extended import get_jwt_identity
 
 from database import db
 from models.chore import Chore
 from models.expense import Expense, Expense_Period, Roommate_Expense
 from models.roommate import Room, Roommate
+from utils.context import (
+    bump_membership_version,
+    create_identity_token,
+    current_context,
+    invalidate_membership,
+)
+from utils.identity import identity_required
+from utils.projection import project
 
 
 # TODO: Increase length to be more secure. Keeping it short for now for development.
@@ -16,19 +24,17 @@ def generate_invite_code(length=4):
     return "".join(random.choices(string.ascii_uppercase + string.digits, k=length))
 
 
-@jwt_required()
+@identity_required
 def get_current_room():
-    roommate_id = int(get_jwt_identity())
-
-    roommate = Roommate.query.get(roommate_id)
-    if not roommate:
+    context = current_context()
+    if not context:
         return jsonify({"message": "Roommate not found"}), 404
 
     # If the roommate is not in a room, return None (this is still a valid response)
-    if not roommate.room_fkey:
+    if not context.room_id:
         return jsonify({"room_id": None}), 200
 
-    room = Room.query.get(roommate.room_fkey)
+    room = Room.query.get(context.room_id)
     if not room:
         return jsonify({"message": "Room not found"}), 404
 
@@ -46,7 +52,7 @@ def get_current_room():
     )
 
 
-@jwt_required()
+@identity_required
 def create_room():
     roommate_id = int(get_jwt_identity())
 
@@ -72,12 +78,15 @@ def create_room():
     db.session.flush()  # Ensures new_room.id is generated
 
     roommate.room_fkey = new_room.id
+    bump_membership_version(roommate)
 
     db.session.commit()
+    invalidate_membership(roommate_id)
 
     return (
         jsonify(
             {
+                "access_token": create_identity_token(roommate),
                 "room_id": new_room.id,
                 "name": new_room.name,
                 "invite_code": new_room.invite_code,
@@ -89,7 +98,7 @@ def create_room():
     )
 
 
-@jwt_required()
+@identity_required
 def join_room():
     roommate_id = int(get_jwt_identity())
 
@@ -108,12 +117,15 @@ def join_room():
         return jsonify({"message": "Room not found"}), 404
 
     roommate.room_fkey = room.id
+    bump_membership_version(roommate)
 
     db.session.commit()
+    invalidate_membership(roommate_id)
 
     return (
         jsonify(
             {
+                "access_token": create_identity_token(roommate),
                 "room_id": room.id,
                 "name": room.name,
                 "invite_code": room.invite_code,
@@ -125,7 +137,7 @@ def join_room():
     )
 
 
-@jwt_required()
+@identity_required
 def leave_room():
     roommate_id = int(get_jwt_identity())
 
@@ -141,8 +153,9 @@ def leave_room():
         return jsonify({"message": "Room not found"}), 404
 
     # Get all roommates in the same room
-    roommates = Roommate.query.filter_by(room_fkey=roommate.room_fkey).all()
-    roommate_ids = [rm.id for rm in roommates]
+    roommate_ids = [
+        rm.id for rm in project(Roommate, "id").filter_by(room_fkey=roommate.room_fkey)
+    ]
 
     # If this is the last roommate in the room
     if len(roommate_ids) == 1 and roommate_ids[0] == roommate_id:
@@ -178,10 +191,12 @@ def leave_room():
 
             # Finally update roommate and delete room
             roommate.room_fkey = None
+            bump_membership_version(roommate)
             db.session.delete(room)
             db.session.commit()
+            invalidate_membership(roommate_id)
 
-            return {}, 200
+            return jsonify({"access_token": create_identity_token(roommate)}), 200
         except Exception as e:
             db.session.rollback()
             return jsonify({"message": f"Error deleting room: {str(e)}"}), 500
@@ -221,6 +236,8 @@ def leave_room():
             chore.rotation_order = [r for r in chore.rotation_order if r != roommate_id]
 
     roommate.room_fkey = None
+    bump_membership_version(roommate)
     db.session.commit()
+    invalidate_membership(roommate_id)
 
-    return {}, 200
+    return jsonify({"access_token": create_identity_token(roommate)}), 200
@@ -1,70 +1,289 @@
 import base64
-from io import BytesIO
+import itertools
+import os
+import struct
 
-from flask import jsonify, request, send_file
+from flask import (
+    Response,
+    current_app,
+    jsonify,
+    make_response,
+    request,
+    send_file,
+)
 from flask_jwt_extended import (
     JWTManager,
     create_access_token,
     get_jwt_identity,
-    jwt_required,
 )
+from werkzeug.exceptions import RequestEntityTooLarge
 
 from database import db
-from models.roommate import Roommate
+from models.roommate import Device_Token, Roommate
+from utils.blob_store import BlobTooLarge, blob_store
+from utils.context import current_context
+from utils.identity import identity_required
+from utils.images import SNIFF_BYTES, sniff_file_type, sniff_image_type
+from utils.projection import project
+from utils.thumbnails import thumbnail_generator
+
+CHUNK_BYTES = 64 * 1024
+# Allowance for multipart form fields and part headers on top of the
+# PROFILE_PICTURE_MAX_BYTES upload size limit
+MULTIPART_OVERHEAD_BYTES = 16 * 1024
+
+AVATAR_SIZE = 128
+
+# Entry statuses in GET /roommates/avatars
+AVATAR_NONE = 0
+AVATAR_NOT_MODIFIED = 1
+AVATAR_INCLUDED = 2
+
+
+# Stores an uploaded profile picture and queues its thumbnails. Returns the
+# picture's digest.
+def store_profile_picture(data):
+    digest = blob_store.put(data)
+    thumbnail_generator.generate(digest)
+    return digest
+
+
+# Returns (path, ETag, final) of the file to serve for a picture at `size`
+# pixels: the matching thumbnail if it exists, otherwise the original. `final` is
+# False when the original stands in for a thumbnail that hasn't been written yet,
+# so the same request will be answered differently later.
+def profile_picture_file(profile_picture_hash, size=None):
+    thumbnail_size = None
+    if size is not None:
+        thumbnail_size = thumbnail_generator.available_size(profile_picture_hash, size)
+    if thumbnail_size is None:
+        final = size is None or thumbnail_generator.size_for(size) is None
+        return blob_store.path(profile_picture_hash), profile_picture_hash, final
+    return (
+        blob_store.variant_path(profile_picture_hash, str(thumbnail_size)),
+        f"{profile_picture_hash}-{thumbnail_size}",
+        True,
+    )
 
 
-@jwt_required()
+# GET /profile_picture
+# Returns a roommate's profile picture (the current user's unless user_id is
+# given). With ?size=<pixels>, returns the smallest thumbnail at least that big.
+# The ETag is the picture's SHA-256, so a matching If-None-Match is answered with
+# a 304 before the file is opened. URLs carrying the current hash as ?v= (see
+# profile_picture_version in GET /roommates) may be cached forever, unless the
+# original is standing in for a thumbnail still being made; otherwise clients
+# must revalidate.
+@identity_required
 def get_profile_picture():
-    user_id = request.args.get("user_id")
-    if user_id:
-        roommate = Roommate.query.get_or_404(user_id)
-    else:
-        roommate_id = get_jwt_identity()
-        roommate = Roommate.query.get_or_404(roommate_id)
+    size = request.args.get("size")
+    if size is not None:
+        try:
+            size = int(size)
+        except ValueError:
+            return jsonify({"message": "size must be a number of pixels"}), 400
 
-    if not roommate.profile_picture:
+    roommate_id = request.args.get("user_id") or get_jwt_identity()
+    (profile_picture_hash,) = (
+        db.session.query(Roommate.profile_picture_hash)
+        .filter_by(id=roommate_id)
+        .first_or_404()
+    )
+
+    if not profile_picture_hash:
         return jsonify({"message": "No profile picture found"}), 404
 
-    return send_file(
-        BytesIO(roommate.profile_picture),
-        mimetype="image/jpeg",
-        as_attachment=False,
+    path, etag, final = profile_picture_file(profile_picture_hash, size)
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        # Served straight from the file, which lets the server use sendfile
+        response = send_file(
+            path,
+            mimetype=sniff_file_type(path) or "image/jpeg",
+            as_attachment=False,
+            conditional=False,
+        )
+    response.set_etag(etag)
+    if final and request.args.get("v") == profile_picture_hash:
+        response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    else:
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+# GET /roommates/avatars
+# Returns the profile picture thumbnail of every roommate in the current user's
+# room in one response (?size=<pixels>, default 128). The body is a sequence of
+# entries, one per roommate, with integers big-endian:
+#   roommate id (uint32), status (uint8), ETag length (uint8), ETag (ASCII)
+#   if status is 2: mimetype length (uint8), mimetype (ASCII), image length
+#   (uint32), image bytes
+# Status 0 means no picture (empty ETag), 1 that the ETag was listed in the
+# request's If-None-Match so the client's copy is current, and 2 that the image
+# follows. ETags are the same as GET /profile_picture's, without the quotes.
+@identity_required
+def get_roommate_avatars():
+    context = current_context()
+    if not context:
+        return jsonify({"message": "User not found"}), 404
+
+    if not context.room_id:
+        return jsonify({"message": "User is not assigned to any room"}), 404
+
+    try:
+        size = int(request.args.get("size", AVATAR_SIZE))
+    except ValueError:
+        return jsonify({"message": "size must be a number of pixels"}), 400
+
+    roommates = (
+        project(Roommate, "id", "profile_picture_hash")
+        .filter_by(room_fkey=context.room_id)
+        .order_by(Roommate.id)
     )
 
+    # Work out every entry up front so the response length is known and the
+    # images can be streamed from disk one chunk at a time
+    entries = []
+    content_length = 0
+    for rm in roommates:
+        if not rm.profile_picture_hash:
+            header = struct.pack(">IBB", rm.id, AVATAR_NONE, 0)
+            entries.append((header, None))
+            content_length += len(header)
+            continue
 
-@jwt_required()
-def update_profile_picture():
-    roommate_id = get_jwt_identity()
-    roommate = Roommate.query.get_or_404(roommate_id)
+        path, etag, _ = profile_picture_file(rm.profile_picture_hash, size)
+        if request.if_none_match.contains(etag):
+            header = struct.pack(">IBB", rm.id, AVATAR_NOT_MODIFIED, len(etag))
+            header += etag.encode()
+            entries.append((header, None))
+            content_length += len(header)
+            continue
+
+        mimetype = (sniff_file_type(path) or "image/jpeg").encode()
+        image_length = os.path.getsize(path)
+        header = struct.pack(">IBB", rm.id, AVATAR_INCLUDED, len(etag))
+        header += etag.encode()
+        header += struct.pack(">B", len(mimetype)) + mimetype
+        header += struct.pack(">I", image_length)
+        entries.append((header, path))
+        content_length += len(header) + image_length
+
+    def generate():
+        for header, path in entries:
+            yield header
+            if path:
+                with open(path, "rb") as f:
+                    while chunk := f.read(CHUNK_BYTES):
+                        yield chunk
+
+    response = Response(generate(), mimetype="application/octet-stream")
+    response.content_length = content_length
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
-    data = request.get_json()
-    file = data.get("profile_picture")
 
-    if file:
+# Streams a raw or multipart profile picture upload into the blob store and
+# returns (digest, None), or (None, error response)
+def receive_profile_picture_upload():
+    max_bytes = current_app.config["PROFILE_PICTURE_MAX_BYTES"]
+    too_large = (
+        jsonify({"message": f"Profile picture must be at most {max_bytes} bytes"}),
+        413,
+    )
+
+    if request.mimetype == "multipart/form-data":
+        # Werkzeug spools the file part to disk as it parses; the form fields and
+        # part headers around it get some room on top of the picture itself
+        request.max_content_length = max_bytes + MULTIPART_OVERHEAD_BYTES
         try:
-            profile_picture = base64.b64decode(file)
-        except (base64.binascii.Error, TypeError):
-            return jsonify({"message": "Invalid base64-encoded profile picture"}), 400
+            upload = request.files.get("profile_picture")
+        except RequestEntityTooLarge:
+            return None, too_large
+        if not upload:
+            return None, (jsonify({"message": "No profile picture uploaded"}), 400)
+        stream = upload.stream
+    else:
+        if request.content_length and request.content_length > max_bytes:
+            return None, too_large
+        stream = request.stream
+
+    chunks = iter(lambda: stream.read(CHUNK_BYTES), b"")
+    first_chunk = next(chunks, b"")
+    if not first_chunk:
+        return None, (jsonify({"message": "No profile picture uploaded"}), 400)
+    if not sniff_image_type(first_chunk[:SNIFF_BYTES]):
+        return None, (
+            jsonify({"message": "Profile picture must be a JPEG, PNG, GIF or WebP"}),
+            415,
+        )
+
+    try:
+        digest = blob_store.put_stream(
+            itertools.chain([first_chunk], chunks), max_bytes=max_bytes
+        )
+    except BlobTooLarge:
+        return None, too_large
+    thumbnail_generator.generate(digest)
+    return digest, None
+
+
+# PUT /profile_picture
+# Replaces the current user's profile picture. The picture can be sent as the raw
+# request body (any image Content-Type), as the "profile_picture" part of a
+# multipart form, or base64-encoded in a JSON body (older clients). The upload is
+# stored before the roommate row is loaded, so no connection or transaction is
+# held open while the client sends it.
+@identity_required
+def update_profile_picture():
+    roommate_id = get_jwt_identity()
+
+    if not request.is_json:
+        digest, error = receive_profile_picture_upload()
+        if error:
+            return error
     else:
-        profile_picture = None
+        data = request.get_json()
+        file = data.get("profile_picture")
 
-    roommate.profile_picture = profile_picture
+        if file:
+            try:
+                profile_picture = base64.b64decode(file)
+            except (base64.binascii.Error, TypeError):
+                return (
+                    jsonify({"message": "Invalid base64-encoded profile picture"}),
+                    400,
+                )
+        else:
+            profile_picture = None
+        digest = store_profile_picture(profile_picture) if profile_picture else None
+
+    roommate = Roommate.query.get_or_404(roommate_id)
+    roommate.profile_picture_hash = digest
     db.session.commit()
     return jsonify({"message": "Profile picture updated successfully"}), 200
 
 
-@jwt_required()
+@identity_required
 def get_roommates_in_room():
-    roommate_id = int(get_jwt_identity())
-
-    current_roommate = Roommate.query.get(roommate_id)
-    if not current_roommate:
+    context = current_context()
+    if not context:
         return jsonify({"message": "User not found"}), 404
 
-    if not current_roommate.room_fkey:
+    if not context.room_id:
         return jsonify({"message": "User is not assigned to any room"}), 404
 
-    roommates = Roommate.query.filter_by(room_fkey=current_roommate.room_fkey).all()
+    roommates = project(
+        Roommate,
+        "id",
+        "first_name",
+        "last_name",
+        "username",
+        "created_at",
+        "updated_at",
+        "profile_picture_hash",
+    ).filter_by(room_fkey=context.room_id)
 
     data = []
     for rm in roommates:
@@ -76,12 +295,14 @@ def get_roommates_in_room():
                 "username": rm.username,
                 "created_at": rm.created_at.isoformat(),
                 "updated_at": rm.updated_at.isoformat(),
+                # Pass as ?v= to GET /profile_picture for a cacheable URL
+                "profile_picture_version": rm.profile_picture_hash,
             }
         )
     return jsonify({"roommates": data}), 200
 
 
-@jwt_required()
+@identity_required
 def update_user_info():
     roommate_id = get_jwt_identity()
     roommate = Roommate.query.get_or_404(roommate_id)
@@ -112,3 +333,45 @@ def update_user_info():
         ),
         200,
     )
+
+
+# POST /devices
+# Registers a push notification token for the current user's device.
+@identity_required
+def register_device():
+    context = current_context()
+    if not context:
+        return jsonify({"message": "User not found"}), 404
+
+    data = request.get_json()
+    token = (data.get("token") or "").strip()
+    if not token:
+        return jsonify({"message": "Device token is required"}), 400
+
+    # A token moves with the device if a different user logs in on it
+    device_token = Device_Token.query.filter_by(token=token).first()
+    if device_token:
+        device_token.roommate_fkey = context.roommate_id
+    else:
+        db.session.add(Device_Token(roommate_fkey=context.roommate_id, token=token))
+    db.session.commit()
+
+    return jsonify({"message": "Device registered successfully"}), 200
+
+
+# DELETE /devices
+# Stops push notifications to a device, e.g. on logout.
+@identity_required
+def unregister_device():
+    roommate_id = int(get_jwt_identity())
+
+    data = request.get_json()
+    device_token = Device_Token.query.filter_by(
+        token=data.get("token"), roommate_fkey=roommate_id
+    ).first()
+    if not device_token:
+        return jsonify({"message": "Device not found"}), 404
+
+    db.session.delete(device_token)
+    db.session.commit()
+    return {}, 204
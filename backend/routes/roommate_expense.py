@@ -5,26 +5,23 @@ from flask_jwt_extended import (
     JWTManager,
     create_access_token,
     get_jwt_identity,
-    jwt_required,
 )
 
 from database import db
 from models.expense import Expense, Roommate_Expense
-from models.roommate import Room, Roommate
+from models.roommate import Roommate
+from utils.context import current_context
+from utils.identity import identity_required
 
 
-@jwt_required()
+@identity_required
 def get_roommate_expense():
-    roommate_id = get_jwt_identity()
-    roommate = Roommate.query.get(roommate_id)
-    if not roommate or not roommate.room_fkey:
+    context = current_context()
+    if not context or not context.room_id:
         return jsonify({"room_id": None}), 404
-    room = Room.query.get(roommate.room_fkey)
-    if not room:
-        return jsonify({"message": "Room not found"}), 404
 
     roommate_expenses = Roommate_Expense.query.filter_by(
-        roommate_fkey=roommate.id
+        roommate_fkey=context.roommate_id
     ).all()
 
     result = []
@@ -0,0 +1,119 @@
+import hashlib
+import os
+import re
+import tempfile
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+_VARIANT_RE = re.compile(r"^[0-9a-z_]+$")
+
+
+class BlobTooLarge(Exception):
+    """Raised by BlobStore.put_stream() when the stream exceeds max_bytes."""
+
+
+# Content-addressed file store for uploaded images. Each blob is stored once at
+# <root>/<first 2 hex chars>/<next 2>/<sha256 hex digest>, so identical uploads
+# share a file and a digest always names the same bytes. Files are written to a
+# temporary file and renamed into place, so readers never see a partial blob.
+# Blobs are never deleted on write; `flask jobs prune-blobs` removes the ones no
+# longer referenced.
+class BlobStore:
+    def __init__(self, app=None):
+        self.root = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.root = app.config.get("BLOB_STORE_PATH") or os.path.join(
+            app.root_path, "blobs"
+        )
+        os.makedirs(self.root, exist_ok=True)
+        app.extensions["blob_store"] = self
+
+    def path(self, digest):
+        if not _DIGEST_RE.match(digest or ""):
+            raise ValueError(f"Invalid blob digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    # Path of a file derived from a blob (e.g. a thumbnail), stored next to it as
+    # <digest>.<name>
+    def variant_path(self, digest, name):
+        if not _VARIANT_RE.match(name):
+            raise ValueError(f"Invalid variant name: {name!r}")
+        return f"{self.path(digest)}.{name}"
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    # Stores `data` (bytes) and returns its digest. An existing copy has its
+    # mtime bumped instead, so prune-blobs' grace period covers it again until
+    # the row referencing it commits.
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        try:
+            os.utime(self.path(digest))
+        except FileNotFoundError:
+            self._write(digest, [data])
+        return digest
+
+    # Stores the bytes yielded by `chunks` without holding them all in memory and
+    # returns their digest. Raises BlobTooLarge (keeping nothing) once more than
+    # `max_bytes` have been read.
+    def put_stream(self, chunks, max_bytes=None):
+        sha256 = hashlib.sha256()
+        size = 0
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise BlobTooLarge(max_bytes)
+                    sha256.update(chunk)
+                    f.write(chunk)
+            digest = sha256.hexdigest()
+            path = self.path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return digest
+
+    def read(self, digest):
+        with open(self.path(digest), "rb") as f:
+            return f.read()
+
+    # Yields the digest of every stored blob
+    def digests(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if _DIGEST_RE.match(filename):
+                    yield filename
+
+    # Deletes a blob and its variants
+    def delete(self, digest):
+        path = self.path(digest)
+        for filename in os.listdir(os.path.dirname(path)):
+            if filename == digest or filename.startswith(f"{digest}."):
+                try:
+                    os.remove(os.path.join(os.path.dirname(path), filename))
+                except FileNotFoundError:
+                    pass
+
+    def _write(self, digest, chunks):
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+blob_store = BlobStore()
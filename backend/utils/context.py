@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import g
+from flask_jwt_extended import create_access_token, get_jwt_identity
+
+from database import db
+from models.roommate import Roommate
+
+# room_id is None when the roommate isn't in a room; version is the roommate's
+# membership_version, bumped every time room_id changes
+Membership = namedtuple("Membership", ["roommate_id", "room_id", "version"])
+
+
+# In-process LRU of roommate id -> room id. Entries expire after `ttl` seconds,
+# which bounds how stale another worker process's entry can get after a
+# membership change; the worker that made the change invalidates its own entry.
+class MembershipCache:
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_size = app.config.get("MEMBERSHIP_CACHE_SIZE", self.max_size)
+        self.ttl = app.config.get("MEMBERSHIP_CACHE_TTL", self.ttl)
+        app.extensions["membership_cache"] = self
+
+    def get(self, roommate_id):
+        with self._lock:
+            entry = self._entries.get(roommate_id)
+            if entry is None:
+                return None
+            membership, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[roommate_id]
+                return None
+            self._entries.move_to_end(roommate_id)
+            return membership
+
+    def set(self, membership):
+        with self._lock:
+            self._entries[membership.roommate_id] = (
+                membership,
+                time.monotonic() + self.ttl,
+            )
+            self._entries.move_to_end(membership.roommate_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, roommate_id):
+        with self._lock:
+            self._entries.pop(int(roommate_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+membership_cache = MembershipCache()
+
+
+# Returns the Membership of any roommate, or None if the roommate doesn't exist.
+# Cache misses select only room_fkey and membership_version, never the whole
+# roommate row. refresh=True skips the cache.
+def get_membership(roommate_id, refresh=False):
+    try:
+        roommate_id = int(roommate_id)
+    except (TypeError, ValueError):
+        return None
+
+    if not refresh:
+        membership = membership_cache.get(roommate_id)
+        if membership is not None:
+            return membership
+
+    row = (
+        db.session.query(Roommate.room_fkey, Roommate.membership_version)
+        .filter_by(id=roommate_id)
+        .first()
+    )
+    if row is None:
+        return None
+    membership = Membership(roommate_id, row.room_fkey, row.membership_version)
+    membership_cache.set(membership)
+    return membership
+
+
+# Resolves the current user's Membership from their access token. Tokens carry
+# room_id and membership_version claims (see create_identity_token):
+# - a token at the cached version is used as is, without touching the database
+# - a token newer than the cache means this worker missed a room change, so the
+#   membership is reloaded
+# - an older token (the user has since joined or left a room), or one issued
+#   before the claims existed, falls back to the cached membership
+def _resolve_context():
+    claims = g.get("jwt_claims") or {}
+    membership = get_membership(get_jwt_identity())
+    if membership is None:
+        return None
+
+    version = claims.get("membership_version")
+    if version is None or version < membership.version:
+        return membership
+    if version > membership.version:
+        return get_membership(membership.roommate_id, refresh=True)
+    return Membership(membership.roommate_id, claims.get("room_id"), version)
+
+
+# Returns the current user's Membership (or None if their roommate record is
+# gone), resolved at most once per request
+def current_context():
+    if "room_context" not in g:
+        g.room_context = _resolve_context()
+    return g.room_context
+
+
+# Starts a new membership version for a roommate whose room_fkey is changing.
+# Call before committing, then invalidate_membership() after.
+def bump_membership_version(roommate):
+    roommate.membership_version = (roommate.membership_version or 0) + 1
+
+
+# Call after committing a change to a roommate's room_fkey
+def invalidate_membership(roommate_id):
+    membership_cache.invalidate(roommate_id)
+    g.pop("room_context", None)
+
+
+# Issues an access token carrying the roommate's room and membership version
+def create_identity_token(roommate):
+    return create_access_token(
+        identity=str(roommate.id),
+        additional_claims={
+            "room_id": roommate.room_fkey,
+            "membership_version": roommate.membership_version or 0,
+        },
+    )
@@ -0,0 +1,96 @@
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from utils.notification_outbox import notification_outbox
+
+logger = logging.getLogger(__name__)
+
+# Maps event name -> function building the notifications for that event
+EVENT_HANDLERS = {}
+
+
+def domain_event_handler(name):
+    def decorator(fn):
+        EVENT_HANDLERS[name] = fn
+        return fn
+
+    return decorator
+
+
+# Records a domain event on the session's current transaction. The notifications
+# for every event recorded in a transaction are only generated once it commits,
+# and are written together through the notification outbox.
+def record_event(session, name, **payload):
+    session.info.setdefault("domain_events", []).append((name, payload))
+
+
+@event.listens_for(Session, "after_commit")
+def emit_domain_events(session):
+    events = session.info.pop("domain_events", [])
+    if not events:
+        return
+
+    notifications = []
+    for name, payload in events:
+        try:
+            notifications.extend(EVENT_HANDLERS[name](**payload))
+        except Exception as e:
+            logger.error(f"Failed to handle domain event {name}: {str(e)}")
+    if notifications:
+        notification_outbox.enqueue_many(notifications)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_domain_events(session):
+    session.info.pop("domain_events", None)
+
+
+@domain_event_handler("chore_assigned")
+def chore_assigned(room_id, chore_id, description, assignor_id, assignee_id):
+    # Nobody needs to be told about a chore they assigned to themselves
+    if assignee_id == assignor_id:
+        return []
+    return [
+        {
+            "room_fkey": room_id,
+            "notification_sender": assignor_id,
+            "notification_recipient": assignee_id,
+            "title": "New chore assigned",
+            "description": f"You have been assigned: {description}",
+            "subject_key": f"chore:{chore_id}",
+        }
+    ]
+
+
+@domain_event_handler("expense_created")
+def expense_created(room_id, expense_id, title, spender_id, participant_ids):
+    return [
+        {
+            "room_fkey": room_id,
+            "notification_sender": spender_id,
+            "notification_recipient": participant_id,
+            "title": "New expense",
+            "description": f"You were added to the expense: {title}",
+            "subject_key": f"expense:{expense_id}",
+        }
+        for participant_id in participant_ids
+        if participant_id != spender_id
+    ]
+
+
+@domain_event_handler("expense_period_closed")
+def expense_period_closed(room_id, expense_period_id, closed_by_id, roommate_ids):
+    return [
+        {
+            "room_fkey": room_id,
+            "notification_sender": closed_by_id,
+            "notification_recipient": roommate_id,
+            "title": "Expense period closed",
+            "description": "The current expense period was closed. Time to settle up!",
+            "subject_key": f"expense_period:{expense_period_id}",
+        }
+        for roommate_id in roommate_ids
+        if roommate_id != closed_by_id
+    ]
@@ -0,0 +1,43 @@
+from functools import wraps
+
+from flask import g
+from flask_jwt_extended import verify_jwt_in_request
+from flask_jwt_extended.exceptions import NoAuthorizationError
+
+
+# Verifies and decodes the request's access token once, in before_request, and
+# caches the result on g:
+# - g.jwt_claims: the decoded claims, or None when there is no valid token
+# - g.user_id: the token's identity, or None
+# - g.jwt_error: the exception raised for an invalid token, or None
+# flask_jwt_extended's get_jwt()/get_jwt_identity() read the same cached token.
+def load_identity():
+    g.jwt_claims = None
+    g.user_id = None
+    g.jwt_error = None
+    try:
+        decoded = verify_jwt_in_request(optional=True)
+    except Exception as e:
+        g.jwt_error = e
+    else:
+        if decoded:
+            g.jwt_claims = decoded[1]
+            g.user_id = g.jwt_claims.get("sub")
+    g.identity_loaded = True
+
+
+# Drop-in replacement for @jwt_required() that reuses the token decoded by
+# load_identity() instead of verifying it again. Invalid or missing tokens raise
+# the same flask_jwt_extended errors, so responses are unchanged.
+def identity_required(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not g.get("identity_loaded"):
+            load_identity()
+        if g.jwt_error is not None:
+            raise g.jwt_error
+        if g.jwt_claims is None:
+            raise NoAuthorizationError("Missing Authorization Header")
+        return fn(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,26 @@
+# Leading bytes of the image formats accepted as profile pictures
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+# How many leading bytes sniff_image_type() needs
+SNIFF_BYTES = 12
+
+
+# Returns the mimetype of an image from its first SNIFF_BYTES bytes, or None if
+# it isn't a supported image format. The client's Content-Type isn't trusted.
+def sniff_image_type(header):
+    for signature, mimetype in _SIGNATURES:
+        if header.startswith(signature):
+            return mimetype
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def sniff_file_type(path):
+    with open(path, "rb") as f:
+        return sniff_image_type(f.read(SNIFF_BYTES))
@@ -0,0 +1,246 @@
+import atexit
+import bisect
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy.pool import QueuePool
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets (a +Inf bucket is always added)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name -> (type, help) of every exported metric family
+METRICS = {
+    "http_requests_total": ("counter", "Requests handled, by endpoint and status"),
+    "http_request_duration_seconds": ("histogram", "Request latency in seconds"),
+    "http_response_size_bytes": ("histogram", "Response body size in bytes"),
+    "db_pool_size": ("gauge", "Connections the pool keeps open"),
+    "db_pool_checked_out": ("gauge", "Connections in use"),
+    "db_pool_checked_in": ("gauge", "Idle connections in the pool"),
+    "db_pool_overflow": ("gauge", "Connections open beyond the pool size"),
+}
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+# Samples recording `value` in a histogram: one per bucket it falls in
+# (buckets are cumulative), plus the _sum and _count
+def _histogram(name, labels, buckets, value):
+    samples = [
+        (f"{name}_bucket", f'{labels},le="{bound}"', 1)
+        for bound in buckets[bisect.bisect_left(buckets, value) :]
+    ]
+    samples.append((f"{name}_bucket", f'{labels},le="+Inf"', 1))
+    samples.append((f"{name}_sum", labels, value))
+    samples.append((f"{name}_count", labels, 1))
+    return samples
+
+
+# Sort key that keeps a histogram's buckets in numeric order
+def _sample_order(row):
+    name, labels = row[0], row[1]
+    base, _, bound = labels.rpartition(',le="')
+    if name.endswith("_bucket") and bound:
+        bound = bound.rstrip('"')
+        return name, base, float("inf") if bound == "+Inf" else float(bound)
+    return name, labels, 0
+
+
+# Per-endpoint request counts, latency and response size histograms, and
+# database pool gauges, exported in the Prometheus text format.
+#
+# Recording a request only adds to a dict in this process under a short lock. A
+# background thread adds those increments to a SQLite file (in /dev/shm when
+# available) every `flush_interval` seconds, so every worker process on the host
+# contributes to, and any of them can export, the same totals. Pool gauges are
+# written per process and dropped once a process stops reporting.
+class RequestMetrics:
+    def __init__(self, app=None):
+        self.app = None
+        self.path = None
+        self.flush_interval = 5
+        self._pending = defaultdict(float)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._thread = None
+        self._pid = None
+        self._worker_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        shm = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        self.path = app.config.get("METRICS_SQLITE_PATH") or os.path.join(
+            shm, "roomies-metrics.sqlite"
+        )
+        self.flush_interval = app.config.get("METRICS_FLUSH_INTERVAL", 5)
+        app.extensions["request_metrics"] = self
+
+    # Records one request. `endpoint` is the Flask endpoint name (None when no
+    # route matched); `size` is the response size in bytes, if known.
+    def observe(self, endpoint, method, status, duration, size=None):
+        self._ensure_worker()
+        labels = (
+            f'endpoint="{_label_value(endpoint or "unmatched")}",'
+            f'method="{_label_value(method)}"'
+        )
+        samples = [("http_requests_total", f'{labels},status="{status}"', 1)]
+        samples += _histogram(
+            "http_request_duration_seconds", labels, DURATION_BUCKETS, duration
+        )
+        if size is not None:
+            samples += _histogram(
+                "http_response_size_bytes", labels, SIZE_BUCKETS, size
+            )
+        with self._lock:
+            for name, sample_labels, value in samples:
+                self._pending[(name, sample_labels)] += value
+
+    # Writes this process's increments and pool gauges to the shared file
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+        gauges = self._pool_gauges()
+        conn = self._connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO counters (name, labels, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (name, labels) DO UPDATE "
+                    "SET value = value + excluded.value",
+                    [
+                        (name, labels, value)
+                        for (name, labels), value in pending.items()
+                    ],
+                )
+                conn.executemany(
+                    "INSERT INTO gauges (name, labels, value, updated) "
+                    "VALUES (?, ?, ?, ?) ON CONFLICT (name, labels) DO UPDATE "
+                    "SET value = excluded.value, updated = excluded.updated",
+                    gauges,
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception:
+            # Keep the increments for the next flush
+            with self._lock:
+                for key, value in pending.items():
+                    self._pending[key] += value
+            raise
+
+    # Totals from every process, in the Prometheus text exposition format
+    def render(self):
+        self.flush()
+        conn = self._connection()
+        rows = conn.execute("SELECT name, labels, value FROM counters").fetchall()
+        # Gauges from processes that have stopped flushing are left out
+        rows += conn.execute(
+            "SELECT name, labels, value FROM gauges WHERE updated > ?",
+            (time.time() - 3 * self.flush_interval,),
+        ).fetchall()
+
+        lines = []
+        family = None
+        for name, labels, value in sorted(rows, key=_sample_order):
+            base = name
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and name[: -len(suffix)] in METRICS:
+                    base = name[: -len(suffix)]
+            if base != family:
+                family = base
+                kind, help_text = METRICS.get(base, ("untyped", base))
+                lines.append(f"# HELP {base} {help_text}")
+                lines.append(f"# TYPE {base} {kind}")
+            lines.append(f"{name}{{{labels}}} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._pending.clear()
+        conn = self._connection()
+        conn.execute("DELETE FROM counters")
+        conn.execute("DELETE FROM gauges")
+
+    # Current state of this process's connection pool as gauge rows
+    def _pool_gauges(self):
+        with self.app.app_context():
+            pool = db.engine.pool
+        if not isinstance(pool, QueuePool):
+            return []
+        labels = f'pid="{os.getpid()}"'
+        now = time.time()
+        return [
+            ("db_pool_size", labels, pool.size(), now),
+            ("db_pool_checked_out", labels, pool.checkedout(), now),
+            ("db_pool_checked_in", labels, pool.checkedin(), now),
+            ("db_pool_overflow", labels, pool.overflow(), now),
+        ]
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads or forks
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters (name TEXT NOT NULL, "
+                "labels TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (name, labels))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS gauges (name TEXT NOT NULL, "
+                "labels TEXT NOT NULL, value REAL NOT NULL, updated REAL NOT NULL, "
+                "PRIMARY KEY (name, labels))"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # Starts the flush thread in each process (again after a fork)
+    def _ensure_worker(self):
+        if self._pid == os.getpid():
+            return
+        with self._worker_lock:
+            if self._pid == os.getpid():
+                return
+            with self._lock:
+                # Increments copied from the parent were already counted there
+                self._pending = defaultdict(float)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="metrics-flush", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self._flush_quietly)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self._flush_quietly()
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Failed to flush request metrics: {str(e)}")
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,205 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from database import db
+from models.notifications import Notification
+from utils.push_dispatcher import push_dispatcher
+
+logger = logging.getLogger(__name__)
+
+
+# Write-behind buffer for notifications generated on the server. enqueue() only
+# puts the row on a bounded in-process queue; a background thread writes the
+# queue out as multi-row INSERTs every `flush_interval` or `batch_size` rows,
+# whichever comes first. When the queue is full, enqueue() blocks for up to
+# `enqueue_timeout` and then writes the row itself, so producers are slowed down
+# instead of notifications being dropped. A batch the database rejects is written
+# again row by row, so only the rows it keeps rejecting are dropped (and logged).
+# Pending rows are flushed at exit.
+class NotificationOutbox:
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.get("NOTIFICATION_OUTBOX_BATCH_SIZE", 100)
+        self.flush_interval = app.config.get("NOTIFICATION_OUTBOX_FLUSH_MS", 200) / 1000
+        self.enqueue_timeout = app.config.get(
+            "NOTIFICATION_OUTBOX_ENQUEUE_TIMEOUT", 0.5
+        )
+        self._queue = queue.Queue(
+            maxsize=app.config.get("NOTIFICATION_OUTBOX_MAX_PENDING", 10000)
+        )
+        app.extensions["notification_outbox"] = self
+        atexit.register(self.shutdown)
+
+    def enqueue(
+        self,
+        room_fkey,
+        notification_recipient,
+        title=None,
+        description=None,
+        notification_sender=None,
+        subject_key=None,
+    ):
+        self.enqueue_many(
+            [
+                {
+                    "room_fkey": room_fkey,
+                    "notification_recipient": notification_recipient,
+                    "title": title,
+                    "description": description,
+                    "notification_sender": notification_sender,
+                    "subject_key": subject_key,
+                }
+            ]
+        )
+
+    # `notifications` is a list of dicts with enqueue()'s keyword arguments
+    def enqueue_many(self, notifications):
+        now = datetime.utcnow()
+        rows = [
+            {
+                "title": n.get("title"),
+                "description": n.get("description"),
+                "notification_time": now,
+                "notification_sender": n.get("notification_sender"),
+                "notification_recipient": n["notification_recipient"],
+                "room_fkey": n["room_fkey"],
+                "is_read": False,
+                "subject_key": n.get("subject_key"),
+                "coalesced_count": 1,
+            }
+            for n in notifications
+        ]
+        self._ensure_worker()
+        for i, row in enumerate(rows):
+            try:
+                self._queue.put(row, timeout=self.enqueue_timeout)
+            except queue.Full:
+                logger.warning("Notification outbox full, writing notifications inline")
+                self._write(rows[i:])
+                return
+
+    # Writes every pending notification in the caller's thread, then waits for any
+    # batch the flusher thread is still writing
+    def flush(self):
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                break
+            self._write_queued(batch)
+        self._queue.join()
+
+    def shutdown(self):
+        self._stopping.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=self.flush_interval * 5)
+        self.flush()
+
+    # Started lazily (and again after a fork) so every worker process gets its own
+    # flusher thread
+    def _ensure_worker(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="notification-outbox", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write_queued(batch)
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_queued(self, batch):
+        try:
+            self._write(batch)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    # Writes a batch with one INSERT. If that fails, the rows are written one at
+    # a time (each retried once), so a row the database rejects doesn't take the
+    # rest of its batch with it; only rows that still fail are logged and dropped.
+    def _write(self, batch):
+        notifications = self._insert(batch)
+        if notifications is None:
+            notifications = []
+            for row in batch:
+                written = self._insert([row]) if len(batch) > 1 else None
+                if written is None:
+                    time.sleep(self.flush_interval)
+                    written = self._insert([row])
+                if written is None:
+                    logger.error(f"Dropped notification after retrying: {row}")
+                    continue
+                notifications.extend(written)
+        if notifications:
+            push_dispatcher.dispatch(notifications)
+
+    # INSERTs `rows` and returns them with their ids, or None when the database
+    # refused them
+    def _insert(self, rows):
+        # Runs in its own app context (and so its own session) so it never
+        # commits or rolls back a request's session
+        with self.app.app_context():
+            try:
+                ids = db.session.execute(
+                    insert(Notification).returning(
+                        Notification.id, sort_by_parameter_order=True
+                    ),
+                    rows,
+                ).scalars()
+                notifications = [dict(row, id=id) for row, id in zip(rows, ids)]
+                db.session.commit()
+                return notifications
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Failed to write {len(rows)} notifications: {str(e)}")
+                return None
+
+
+notification_outbox = NotificationOutbox()
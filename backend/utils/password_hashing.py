@@ -0,0 +1,80 @@
+import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+from utils.process_pool import ProcessPool
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hash jobs are already queued."""
+
+
+# These run in the worker processes (see ProcessPool)
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode(
+        "utf-8"
+    )
+
+
+def _check_password(password_hash, password):
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
+    except ValueError:
+        # Malformed stored hash
+        return False
+
+
+# Runs bcrypt in a bounded pool of worker processes, so hashing never holds up
+# request threads (or the GIL) of the web worker. At most `max_pending` jobs may
+# be queued at once; beyond that callers wait up to `timeout` seconds for a slot
+# and then get PasswordHasherBusy.
+class PasswordHasher:
+    def __init__(self, app=None):
+        self._pool = ProcessPool()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.rounds = app.config.get("BCRYPT_LOG_ROUNDS", 12)
+        self._pool.workers = app.config.get("PASSWORD_HASH_WORKERS") or os.cpu_count()
+        self.timeout = app.config.get("PASSWORD_HASH_TIMEOUT", 10)
+        self._slots = threading.BoundedSemaphore(
+            app.config.get("PASSWORD_HASH_MAX_PENDING", 64)
+        )
+        app.extensions["password_hasher"] = self
+
+    def hash(self, password):
+        return self._run(_hash_password, password, self.rounds)
+
+    def verify(self, password_hash, password):
+        if not password or not password_hash:
+            return False
+        return self._run(_check_password, password_hash, password)
+
+    # True when the hash was made with a different cost factor than the one
+    # configured now, e.g. after BCRYPT_LOG_ROUNDS was raised
+    def needs_rehash(self, password_hash):
+        try:
+            return int(password_hash.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PasswordHasherBusy()
+        try:
+            return self._pool.submit(fn, *args).result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise PasswordHasherBusy()
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool on the next call
+            self._pool.reset()
+            raise
+        finally:
+            self._slots.release()
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,35 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Pool of worker processes for CPU-bound work (password hashing, thumbnails).
+# The executor is created lazily (and again after a fork) so each web worker owns
+# its pool. Workers are spawned rather than forked since the web worker already
+# runs background threads, which means submitted functions must be importable
+# top-level functions with no app dependencies. After a BrokenProcessPool (a
+# worker died), call reset() so the next submit() starts a fresh pool.
+class ProcessPool:
+    def __init__(self, workers=None):
+        self.workers = workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        return self._get_executor().submit(fn, *args)
+
+    def reset(self):
+        self._pid = None
+
+    def _get_executor(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                    self._pid = os.getpid()
+        return self._executor
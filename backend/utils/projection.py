@@ -0,0 +1,9 @@
+from database import db
+
+
+# Query selecting only the named columns of `model`, for endpoints that
+# serialise a handful of fields and shouldn't load whole rows (or trigger loads
+# of deferred columns). The rows it returns support attribute access like model
+# instances, e.g. project(Roommate, "id", "username").filter_by(...).all().
+def project(model, *columns):
+    return db.session.query(*(getattr(model, column) for column in columns))
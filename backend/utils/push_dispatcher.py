@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+from models.roommate import Device_Token
+
+logger = logging.getLogger(__name__)
+
+
+class PushDeliveryError(Exception):
+    """Raised by a push backend when a batch should be retried."""
+
+
+# Appends each batch as a JSON line to a local file. Default backend, so pushes
+# can be inspected offline.
+class FilePushBackend:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, token, messages):
+        line = json.dumps(
+            {
+                "token": token,
+                "messages": messages,
+                "sent_at": datetime.utcnow().isoformat(),
+            }
+        )
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+
+# POSTs each batch as JSON to a push gateway (or a local stub of one)
+class HttpPushBackend:
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, token, messages):
+        body = json.dumps({"token": token, "messages": messages}).encode("utf-8")
+        req = urllib.request.Request(
+            self.url,
+            data=body,
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout):
+                pass
+        except urllib.error.HTTPError as e:
+            # Client errors won't succeed on retry
+            if e.code < 500:
+                logger.error(f"Push gateway rejected batch: {e.code}")
+                return
+            raise PushDeliveryError(f"Push gateway returned {e.code}") from e
+        except (urllib.error.URLError, TimeoutError) as e:
+            raise PushDeliveryError(str(e)) from e
+
+
+PUSH_BACKENDS = {
+    "file": lambda config: FilePushBackend(config["PUSH_FILE_PATH"]),
+    "http": lambda config: HttpPushBackend(config["PUSH_HTTP_URL"]),
+}
+
+
+# Sends push messages for newly written notifications. dispatch() returns
+# immediately; a worker pool looks up the recipients' device tokens, groups the
+# messages per token and sends them in batches, retrying failed batches with
+# exponential backoff. The pool is created lazily (and again after a fork), since
+# a forked worker inherits the parent's pool without its threads.
+class PushDispatcher:
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = None
+        self.workers = 4
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.backend = PUSH_BACKENDS[app.config.get("PUSH_BACKEND", "file")](app.config)
+        self.batch_size = app.config.get("PUSH_BATCH_SIZE", 50)
+        self.max_retries = app.config.get("PUSH_MAX_RETRIES", 3)
+        self.backoff = app.config.get("PUSH_BACKOFF_SECONDS", 0.5)
+        self.workers = app.config.get("PUSH_WORKERS", 4)
+        app.extensions["push_dispatcher"] = self
+
+    # `notifications` is a list of dicts with at least "notification_recipient"
+    def dispatch(self, notifications):
+        notifications = [
+            n for n in notifications if n.get("notification_recipient") is not None
+        ]
+        if notifications:
+            self._submit(self._deliver, notifications)
+
+    # Blocks until every dispatched push has been sent or given up on
+    def wait(self):
+        while True:
+            with self._pending_lock:
+                pending = list(self._pending)
+            if not pending:
+                return
+            wait(pending)
+
+    def _submit(self, fn, *args):
+        future = self._get_executor().submit(fn, *args)
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _get_executor(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix="push-dispatcher",
+                    )
+                    # Pushes pending in the parent will never finish here
+                    self._pending = set()
+                    self._pending_lock = threading.Lock()
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _discard(self, future):
+        if future.exception() is not None:
+            logger.error(f"Push dispatch failed: {str(future.exception())}")
+        with self._pending_lock:
+            self._pending.discard(future)
+
+    def _deliver(self, notifications):
+        recipient_ids = {n["notification_recipient"] for n in notifications}
+        with self.app.app_context():
+            device_tokens = Device_Token.query.filter(
+                Device_Token.roommate_fkey.in_(recipient_ids)
+            ).all()
+            tokens_by_recipient = {}
+            for device_token in device_tokens:
+                tokens_by_recipient.setdefault(device_token.roommate_fkey, []).append(
+                    device_token.token
+                )
+
+        messages_by_token = {}
+        for n in notifications:
+            message = {
+                "notification_id": n.get("id"),
+                "title": n.get("title"),
+                "body": n.get("description"),
+            }
+            for token in tokens_by_recipient.get(n["notification_recipient"], []):
+                messages_by_token.setdefault(token, []).append(message)
+
+        for token, messages in messages_by_token.items():
+            for start in range(0, len(messages), self.batch_size):
+                self._submit(
+                    self._send_with_retry,
+                    token,
+                    messages[start : start + self.batch_size],
+                )
+
+    def _send_with_retry(self, token, messages):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.backend.send(token, messages)
+                return
+            except PushDeliveryError as e:
+                if attempt == self.max_retries:
+                    logger.error(
+                        f"Giving up on {len(messages)} pushes after "
+                        f"{attempt + 1} attempts: {str(e)}"
+                    )
+                    return
+                time.sleep(self.backoff * 2**attempt)
+
+
+push_dispatcher = PushDispatcher()
@@ -0,0 +1,139 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+)"
+_PLACEHOLDER_LIST_RE = re.compile(
+    rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})+\s*\)"
+)
+
+
+# Shape of a SQL statement: literals become ? and lists of placeholders (as in
+# an expanded IN) become (...), so the same query with different values or list
+# lengths normalises to the same string
+def normalize_sql(statement):
+    statement = _WHITESPACE_RE.sub(" ", statement).strip()
+    statement = _STRING_RE.sub("?", statement)
+    statement = _NUMBER_RE.sub("?", statement)
+    return _PLACEHOLDER_LIST_RE.sub("(...)", statement)
+
+
+# Statements run while handling one request
+class RequestQueries:
+    def __init__(self, endpoint=None):
+        self.endpoint = endpoint
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.shapes[normalize_sql(statement)] += 1
+
+    # (shape, count) of every statement shape run more than `threshold` times
+    def repeated(self, threshold):
+        return [
+            (shape, count) for shape, count in self.shapes.items() if count > threshold
+        ]
+
+
+# Counts the statements each request runs and the time spent in them, using
+# engine events. Statement shapes run more than `repeat_threshold` times in one
+# request (usually a query inside a loop) are logged as a possible N+1, and
+# every response gets a Server-Timing header splitting database time from the
+# rest. Statements run outside a request (background threads, jobs) are ignored.
+class QueryProfiler:
+    def __init__(self, app=None):
+        self.repeat_threshold = 5
+        self._captures = []
+        self._statement_listeners = []
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.repeat_threshold = app.config.get("QUERY_REPEAT_THRESHOLD", 5)
+        if not self._listening:
+            event.listen(Engine, "before_cursor_execute", self._before_execute)
+            event.listen(Engine, "after_cursor_execute", self._after_execute)
+            self._listening = True
+        app.extensions["query_profiler"] = self
+
+    # Called at the start of each request
+    def start(self):
+        g.request_queries = RequestQueries()
+
+    # Called with each response; flags repeated statements and adds the
+    # Server-Timing header
+    def finish(self, response, started=None):
+        queries = g.pop("request_queries", None)
+        if queries is None:
+            return response
+        queries.endpoint = request.endpoint
+
+        for shape, count in queries.repeated(self.repeat_threshold):
+            logger.warning(
+                f"Possible N+1 query in {request.endpoint}: ran {count} times: "
+                f"{shape[:300]}"
+            )
+
+        db_ms = queries.duration * 1000
+        timing = f'db;dur={db_ms:.1f};desc="{queries.count} queries"'
+        if started is not None:
+            total_ms = (time.perf_counter() - started) * 1000
+            timing += f", app;dur={max(total_ms - db_ms, 0):.1f}"
+        response.headers["Server-Timing"] = timing
+
+        for captured in self._captures:
+            captured.append(queries)
+        return response
+
+    # Registers fn(conn, statement, parameters, context, executemany, duration)
+    # to be called after every statement run during a request, so other tools
+    # (see SlowQueryLog) reuse this timing instead of adding engine listeners
+    def add_statement_listener(self, fn):
+        if fn not in self._statement_listeners:
+            self._statement_listeners.append(fn)
+
+    # Collects the RequestQueries of every request finished inside the block,
+    # so tests can hold an endpoint to a query budget
+    @contextmanager
+    def capture(self):
+        captured = []
+        self._captures.append(captured)
+        try:
+            yield captured
+        finally:
+            self._captures.remove(captured)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, many):
+        if context is not None:
+            context._profiler_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, many):
+        if not has_request_context():
+            return
+        started = getattr(context, "_profiler_started", None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        queries = g.get("request_queries")
+        if queries is not None:
+            queries.record(statement, duration)
+        for listener in self._statement_listeners:
+            listener(conn, statement, parameters, context, many, duration)
+
+
+query_profiler = QueryProfiler()
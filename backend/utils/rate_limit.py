@@ -0,0 +1,167 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+def _refill(tokens, updated, capacity, refill_per_second, now):
+    # Returns (allowed, tokens left, seconds until a token is available)
+    tokens = min(capacity, tokens + (now - updated) * refill_per_second)
+    if tokens >= 1:
+        return True, tokens - 1, 0
+    return False, tokens, (1 - tokens) / refill_per_second
+
+
+# Buckets kept in this process only. Fine for a single worker and for tests.
+class MemoryBucketStore:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill_per_second, now):
+        allowed, retry_after, _ = self.take_all(
+            [(key, capacity, refill_per_second)], now
+        )
+        return allowed, retry_after
+
+    # Takes a token from every bucket in `buckets` ((key, capacity,
+    # refill_per_second) tuples), or from none of them when any is empty.
+    # Returns (allowed, retry_after, key of the empty bucket).
+    def take_all(self, buckets, now):
+        with self._lock:
+            refilled = []
+            for key, capacity, refill_per_second in buckets:
+                tokens, updated = self._buckets.get(key, (capacity, now))
+                allowed, tokens, retry_after = _refill(
+                    tokens, updated, capacity, refill_per_second, now
+                )
+                if not allowed:
+                    return False, retry_after, key
+                refilled.append((key, tokens))
+            for key, tokens in refilled:
+                if len(self._buckets) >= self.max_keys and key not in self._buckets:
+                    # Forget the stalest buckets; a forgotten bucket starts full again
+                    stalest = sorted(self._buckets.items(), key=lambda item: item[1][1])
+                    for old_key, _ in stalest[: self.max_keys // 10]:
+                        del self._buckets[old_key]
+                self._buckets[key] = (tokens, now)
+            return True, 0, None
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# Buckets kept in a SQLite file (in /dev/shm when available, so it lives in
+# shared memory) that every worker process on the host reads and updates
+# atomically
+class SqliteBucketStore:
+    def __init__(self, path=None):
+        shm = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        self.path = path or os.path.join(shm, "roomies-rate-limit.sqlite")
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads or forks
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, capacity, refill_per_second, now):
+        allowed, retry_after, _ = self.take_all(
+            [(key, capacity, refill_per_second)], now
+        )
+        return allowed, retry_after
+
+    # Same as MemoryBucketStore.take_all, in one transaction
+    def take_all(self, buckets, now):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            refilled = []
+            for key, capacity, refill_per_second in buckets:
+                row = conn.execute(
+                    "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                allowed, tokens, retry_after = _refill(
+                    tokens, updated, capacity, refill_per_second, now
+                )
+                if not allowed:
+                    conn.execute("ROLLBACK")
+                    return False, retry_after, key
+                refilled.append((key, tokens))
+            conn.executemany(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, "
+                "updated = excluded.updated",
+                [(key, tokens, now) for key, tokens in refilled],
+            )
+            # Now and then drop buckets that have been idle long enough to be full
+            if random.random() < 0.001:
+                refill_seconds = max(
+                    capacity / refill_per_second
+                    for _, capacity, refill_per_second in buckets
+                )
+                conn.execute(
+                    "DELETE FROM buckets WHERE updated < ?", (now - refill_seconds,)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return True, 0, None
+
+    def reset(self):
+        self._connection().execute("DELETE FROM buckets")
+
+
+RATE_LIMIT_STORES = {
+    "memory": lambda config: MemoryBucketStore(),
+    "sqlite": lambda config: SqliteBucketStore(config.get("RATE_LIMIT_SQLITE_PATH")),
+}
+
+
+# Token-bucket limiter. Each key gets a bucket of `capacity` tokens refilled at
+# `per_minute` tokens a minute; a request takes one token or is rejected.
+class RateLimiter:
+    def __init__(self, app=None):
+        self.store = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.store = RATE_LIMIT_STORES[app.config.get("RATE_LIMIT_STORAGE", "sqlite")](
+            app.config
+        )
+        app.extensions["rate_limiter"] = self
+
+    # Returns (allowed, retry_after_seconds)
+    def take(self, key, capacity, per_minute):
+        return self.store.take(key, capacity, per_minute / 60, time.time())
+
+    # Takes a token from each of `buckets` ((key, capacity, per_minute) tuples)
+    # only if every one has a token, so a rejected request costs nothing.
+    # Returns (allowed, retry_after_seconds, key of the bucket that was empty).
+    def take_all(self, buckets):
+        return self.store.take_all(
+            [(key, capacity, per_minute / 60) for key, capacity, per_minute in buckets],
+            time.time(),
+        )
+
+    def reset(self):
+        self.store.reset()
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import db
+from models.roommate import Revoked_Token
+
+logger = logging.getLogger(__name__)
+
+
+# In-memory mirror of the revoked_tokens table, so checking whether a token is
+# revoked is a dict lookup instead of a query. Each worker process loads the
+# table once, then a background thread pulls newly revoked tokens every
+# `sync_interval` seconds and evicts entries whose token has expired (an expired
+# token is rejected anyway). Tokens revoked by this process are added at once;
+# ones revoked by another worker are seen here within `sync_interval`.
+class RevocationList:
+    # Rows are fetched by revoked_at, which is set before the row commits, so each
+    # sync looks back this far to catch slow transactions
+    SYNC_OVERLAP = timedelta(seconds=30)
+
+    def __init__(self, app=None):
+        self.app = None
+        self.sync_interval = 5
+        self._expiries = {}  # jti -> expiry as a unix timestamp
+        self._synced_at = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.sync_interval = app.config.get("REVOCATION_SYNC_INTERVAL", 5)
+        app.extensions["revocation_list"] = self
+
+    def is_revoked(self, jti):
+        self._ensure_worker()
+        expires_at = self._expiries.get(jti)
+        return expires_at is not None and expires_at > time.time()
+
+    # Records a revoked token in the caller's session (the caller commits) and in
+    # this process's set. `claims` are the token's decoded claims. Returns False,
+    # adding nothing, when this process already knows the token is revoked; a
+    # token revoked by another worker since the last sync makes the commit fail
+    # on the unique jti instead.
+    def revoke(self, session, claims):
+        with self._update_lock:
+            if claims["jti"] in self._expiries:
+                return False
+            self._expiries[claims["jti"]] = claims["exp"]
+        session.add(
+            Revoked_Token(
+                jti=claims["jti"],
+                roommate_fkey=claims.get("sub"),
+                expires_at=datetime.utcfromtimestamp(claims["exp"]),
+            )
+        )
+        return True
+
+    def reset(self):
+        with self._update_lock:
+            self._expiries = {}
+            self._synced_at = None
+
+    # The first call in each process (or after a fork) loads the whole table
+    # before returning, so no revoked token slips through while the worker starts
+    def _ensure_worker(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._expiries = {}
+            self._synced_at = None
+            self._sync()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="revocation-sync", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.sync_interval)
+            self._sync()
+
+    def _sync(self):
+        started_at = datetime.utcnow()
+        # Runs in its own app context (and so its own session)
+        with self.app.app_context():
+            try:
+                query = db.session.query(Revoked_Token.jti, Revoked_Token.expires_at)
+                query = query.filter(Revoked_Token.expires_at > started_at)
+                if self._synced_at is not None:
+                    query = query.filter(
+                        Revoked_Token.revoked_at > self._synced_at - self.SYNC_OVERLAP
+                    )
+                rows = query.all()
+            except Exception as e:
+                logger.error(f"Failed to sync revoked tokens: {str(e)}")
+                return
+            finally:
+                db.session.remove()
+
+        now = time.time()
+        with self._update_lock:
+            # Drop expired tokens, then add the newly revoked ones
+            expiries = {
+                jti: expires_at
+                for jti, expires_at in self._expiries.items()
+                if expires_at > now
+            }
+            for jti, expires_at in rows:
+                expiries[jti] = (expires_at - datetime(1970, 1, 1)).total_seconds()
+            self._expiries = expiries
+            self._synced_at = started_at
+
+
+revocation_list = RevocationList()
+
+
+# Deletes revoked_tokens rows whose token has expired. Returns how many were
+# deleted.
+def prune_revoked_tokens():
+    deleted = Revoked_Token.query.filter(
+        Revoked_Token.expires_at <= datetime.utcnow()
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
@@ -0,0 +1,255 @@
+import hashlib
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import threading
+import time
+
+from flask import request
+
+from database import db
+from logs.logging_config import REDACTED, JsonFormatter, truncate
+from utils.query_profiler import normalize_sql, query_profiler
+
+logger = logging.getLogger(__name__)
+
+_SEQ_SCAN_RE = re.compile(r"Seq Scan on (\w+)")
+_SELECT_RE = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+_SIDE_EFFECT_RE = re.compile(
+    r"\bFOR\s+(?:NO\s+KEY\s+)?UPDATE\b|\bFOR\s+(?:KEY\s+)?SHARE\b"
+    r"|\bpg_(?:try_)?advisory\w*|\b(?:nextval|setval)\s*\(",
+    re.IGNORECASE,
+)
+# SQLAlchemy numbers parameters for repeated columns (password_hash_1)
+_PARAM_SUFFIX_RE = re.compile(r"_\d+$")
+
+
+# True when EXPLAIN ANALYZE may run the statement: a plain SELECT, without row
+# locks or functions that take locks or advance sequences
+def can_analyze(statement):
+    return bool(_SELECT_RE.match(statement)) and not _SIDE_EFFECT_RE.search(statement)
+
+
+# Records statements run by requests that are slower than `threshold_ms` to a
+# rotating JSON-lines log (logs/slow_queries.log by default): the normalised
+# SQL, parameters, duration, endpoint and, on Postgres, the query plan. Timing
+# comes from the QueryProfiler, so a statement only pays for a threshold check;
+# matching statements are handed to a background thread, which explains them on
+# its own pooled connection inside a transaction that is rolled back, with short
+# lock and statement timeouts. Plain SELECTs get EXPLAIN (ANALYZE, BUFFERS);
+# anything that writes or takes locks when run gets a plain EXPLAIN, which
+# doesn't execute it. A failed EXPLAIN is logged with the record.
+#
+# Parameters named in LOG_REDACT_FIELDS (ignoring SQLAlchemy's _1 suffixes) are
+# redacted, others are truncated; positional parameters can't be told apart, so
+# only their types and sizes are logged.
+#
+# Records are deduplicated by fingerprint (a hash of the normalised SQL): a
+# statement is logged at most once every `dedupe_seconds`, and the next record
+# for it says how many slow runs were skipped in between.
+class SlowQueryLog:
+    # Most fingerprints remembered for deduplication
+    MAX_FINGERPRINTS = 1000
+    # How long an EXPLAIN waits for a lock before giving up, so it never queues
+    # behind (and holds up) the request's own writers
+    EXPLAIN_LOCK_TIMEOUT_MS = 100
+    # Dialects whose EXPLAIN syntax _explain() speaks
+    EXPLAIN_DIALECTS = {"postgresql"}
+
+    def __init__(self, app=None):
+        self.app = None
+        self.threshold_ms = 200
+        self.dedupe_seconds = 3600
+        self.explain = True
+        self.explain_timeout_ms = 5000
+        self.redact = set()
+        self._seen = {}  # fingerprint -> [last logged at, slow runs since]
+        self._seen_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=100)
+        self._thread = None
+        self._pid = None
+        self._worker_lock = threading.Lock()
+        self._file_logger = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.threshold_ms = app.config.get("SLOW_QUERY_THRESHOLD_MS", 200)
+        self.dedupe_seconds = app.config.get("SLOW_QUERY_DEDUPE_SECONDS", 3600)
+        self.explain = app.config.get("SLOW_QUERY_EXPLAIN", True)
+        self.explain_timeout_ms = app.config.get("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", 5000)
+        self.redact = app.config.get("LOG_REDACT_FIELDS", set())
+
+        handler = logging.handlers.RotatingFileHandler(
+            app.config.get("SLOW_QUERY_LOG_FILE", "logs/slow_queries.log"),
+            maxBytes=app.config.get("LOG_MAX_BYTES", 10 * 1024 * 1024),
+            backupCount=app.config.get("LOG_BACKUP_COUNT", 5),
+        )
+        handler.setFormatter(JsonFormatter())
+        file_logger = logging.getLogger("slow_queries")
+        for old_handler in list(file_logger.handlers):
+            file_logger.removeHandler(old_handler)
+            old_handler.close()
+        file_logger.addHandler(handler)
+        file_logger.setLevel(logging.INFO)
+        # Written by the background thread only, so no need for the log queue
+        file_logger.propagate = False
+        self._file_logger = file_logger
+
+        query_profiler.add_statement_listener(self._on_statement)
+        app.extensions["slow_query_log"] = self
+
+    # Blocks until every queued slow statement has been written
+    def wait(self):
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def reset(self):
+        with self._seen_lock:
+            self._seen.clear()
+
+    # Called by the QueryProfiler after each statement run during a request
+    def _on_statement(self, conn, statement, parameters, context, many, duration):
+        duration_ms = duration * 1000
+        if duration_ms < self.threshold_ms:
+            return
+        # The EXPLAINs run by this log are slow too
+        if context.execution_options.get("slow_query_log") is False:
+            return
+
+        shape = normalize_sql(statement)
+        fingerprint = hashlib.sha1(shape.encode("utf-8")).hexdigest()[:16]
+        now = time.monotonic()
+        with self._seen_lock:
+            seen = self._seen.get(fingerprint)
+            if seen is not None and now - seen[0] < self.dedupe_seconds:
+                seen[1] += 1
+                return
+
+            job = {
+                "statement": statement,
+                "parameters": parameters,
+                "executemany": many,
+                "fields": {
+                    "fingerprint": fingerprint,
+                    "sql": shape,
+                    "parameters": self._summarize_parameters(parameters, many),
+                    "duration_ms": round(duration_ms, 1),
+                    "endpoint": request.endpoint,
+                    "dialect": conn.dialect.name,
+                    "skipped_since_last": seen[1] if seen is not None else 0,
+                },
+            }
+            self._ensure_worker()
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                # Not logged, so the next slow run gets another chance
+                logger.warning(
+                    "Slow query log queue is full, dropping a slow statement"
+                )
+                return
+
+            # The dedupe window starts once the record is on its way
+            self._seen.pop(fingerprint, None)
+            if len(self._seen) >= self.MAX_FINGERPRINTS:
+                # Forget the longest-logged fingerprint (dicts keep insertion order)
+                self._seen.pop(next(iter(self._seen)))
+            self._seen[fingerprint] = [now, 0]
+
+    def _summarize_parameters(self, parameters, many):
+        if many:
+            return f"<{len(parameters)} parameter sets>"
+        if isinstance(parameters, dict):
+            return {
+                name: (
+                    REDACTED
+                    if _PARAM_SUFFIX_RE.sub("", name.lower()) in self.redact
+                    or name.lower() in self.redact
+                    else self._summarize_value(value)
+                )
+                for name, value in parameters.items()
+            }
+        return [self._describe_value(value) for value in parameters or ()]
+
+    def _summarize_value(self, value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return f"<{len(value)} bytes>"
+        return truncate(value, 64)
+
+    # Type (and size) of a value, without the value itself
+    def _describe_value(self, value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return f"<bytes, {len(value)} bytes>"
+        if isinstance(value, str):
+            return f"<str, {len(value)} chars>"
+        return f"<{type(value).__name__}>"
+
+    # Runs in each process (again after a fork) on first use
+    def _ensure_worker(self):
+        if self._pid == os.getpid():
+            return
+        with self._worker_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=100)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="slow-query-log", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                fields = job["fields"]
+                if self.explain and fields["dialect"] in self.EXPLAIN_DIALECTS:
+                    try:
+                        fields.update(self._explain(job))
+                    except Exception as e:
+                        fields.update(plan=None, explain_error=str(e))
+                self._file_logger.info(
+                    f"Slow query ({fields['duration_ms']} ms)", extra={"fields": fields}
+                )
+            except Exception as e:
+                logger.error(f"Failed to record slow query: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    # Plan of the statement from its own connection. Only plain SELECTs are run
+    # (EXPLAIN ANALYZE); the rest are planned without running them. Either way
+    # the transaction is rolled back.
+    def _explain(self, job):
+        if job["executemany"]:
+            return {"plan": None}
+        statement = job["statement"]
+        analyze = can_analyze(statement)
+        explain = "EXPLAIN (ANALYZE, BUFFERS)" if analyze else "EXPLAIN"
+        with self.app.app_context():
+            with db.engine.connect() as conn:
+                conn = conn.execution_options(slow_query_log=False)
+                with conn.begin() as transaction:
+                    conn.exec_driver_sql(
+                        f"SET LOCAL statement_timeout = {int(self.explain_timeout_ms)}"
+                    )
+                    conn.exec_driver_sql(
+                        f"SET LOCAL lock_timeout = {self.EXPLAIN_LOCK_TIMEOUT_MS}"
+                    )
+                    rows = conn.exec_driver_sql(
+                        f"{explain} {statement}", job["parameters"]
+                    ).fetchall()
+                    transaction.rollback()
+        plan = "\n".join(row[0] for row in rows)
+        return {
+            "plan": plan,
+            "plan_analyzed": analyze,
+            # Tables read in full, usually for want of an index
+            "seq_scans": sorted(set(_SEQ_SCAN_RE.findall(plan))),
+        }
+
+
+slow_query_log = SlowQueryLog()
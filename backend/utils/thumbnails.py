@@ -0,0 +1,96 @@
+import logging
+import os
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps
+
+from utils.blob_store import blob_store
+from utils.process_pool import ProcessPool
+
+logger = logging.getLogger(__name__)
+
+
+# Runs in the worker processes (see ProcessPool). Writes a square JPEG of each size next to the
+# original (see BlobStore.variant_path); sizes that already exist are skipped.
+def _write_thumbnails(original_path, targets, quality):
+    with Image.open(original_path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        for size, path in targets:
+            if os.path.exists(path):
+                continue
+            thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    thumbnail.save(f, "JPEG", quality=quality, optimize=True)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+
+
+# Builds fixed-size thumbnails of uploaded profile pictures in a pool of worker
+# processes. generate() returns as soon as the job is queued; until a thumbnail
+# exists, available_size() falls back to the original picture.
+class ThumbnailGenerator:
+    def __init__(self, app=None):
+        self._pool = ProcessPool()
+        self.sizes = (64, 128, 256)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.sizes = tuple(sorted(app.config.get("THUMBNAIL_SIZES", self.sizes)))
+        self._pool.workers = app.config.get("THUMBNAIL_WORKERS", 2)
+        self.quality = app.config.get("THUMBNAIL_QUALITY", 85)
+        app.extensions["thumbnail_generator"] = self
+
+    # Queues thumbnails for the blob with this digest and returns the future (or
+    # None when the pool is unavailable)
+    def generate(self, digest):
+        targets = [
+            (size, blob_store.variant_path(digest, str(size))) for size in self.sizes
+        ]
+        try:
+            future = self._pool.submit(
+                _write_thumbnails, blob_store.path(digest), targets, self.quality
+            )
+        except BrokenProcessPool:
+            self._pool.reset()
+            logger.warning("Thumbnail pool is broken, skipping thumbnails")
+            return None
+        future.add_done_callback(self._log_failure)
+        return future
+
+    # Smallest configured size at least `size` pixels wide, or None when the
+    # original is the smallest picture that large
+    def size_for(self, size):
+        for available in self.sizes:
+            if available >= size:
+                return available
+        return None
+
+    # Size of the thumbnail to serve for a request of `size` pixels, or None when
+    # the original should be served (nothing smaller fits, or that thumbnail
+    # hasn't been written yet)
+    def available_size(self, digest, size):
+        thumbnail_size = self.size_for(size)
+        if thumbnail_size is not None and os.path.exists(
+            blob_store.variant_path(digest, str(thumbnail_size))
+        ):
+            return thumbnail_size
+        return None
+
+    def _log_failure(self, future):
+        if future.cancelled() or future.exception() is None:
+            return
+        error = future.exception()
+        # Pillow raises an OSError for uploads it can't read as an image
+        logger.warning(f"Could not make thumbnails: {str(error)}")
+        if isinstance(error, BrokenProcessPool):
+            # A worker died; start a fresh pool on the next upload
+            self._pool.reset()
+
+
+thumbnail_generator = ThumbnailGenerator()
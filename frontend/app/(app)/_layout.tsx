@@ -35,7 +35,9 @@ export default function AppLayout() {
       if (!session || !userId) return;
 
       try {
-        const data = await apiGetNotifications(session);
+        const data = await apiGetNotifications(session, {
+          notification_recipient: userId,
+        });
 
         // Only count unread notifications for the current user
         const unreadUserNotifications = data.filter(
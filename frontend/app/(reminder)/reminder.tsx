@@ -40,7 +40,9 @@ export default function NotificationsScreen() {
   const fetchNotifications = async () => {
     if (!session) return;
     try {
-      const data = await apiGetNotifications(session);
+      const data = await apiGetNotifications(session, {
+        notification_recipient: userId ?? undefined,
+      });
       const filteredNotifications = data.filter(
         (notification: Notification) =>
           notification.notification_recipient === userId,
@@ -482,6 +482,9 @@ export async function apiUpdateProfilePicture(
 }
 
 //Notifications API
+// Largest page the server returns (MAX_PAGE_SIZE in routes/notifications.py)
+const NOTIFICATIONS_PAGE_SIZE = 200;
+
 export async function apiCreateNotification(
   session: any,
   notification: {
@@ -507,6 +510,8 @@ export async function apiCreateNotification(
   return response.json();
 }
 
+// Lists are paginated by the server (see X-Next-Cursor); this follows the cursor
+// and returns every page. A notification_id query returns the single notification.
 export async function apiGetNotifications(
   session: any,
   query?: {
@@ -523,18 +528,35 @@ export async function apiGetNotifications(
       }
     });
   }
-  const response = await fetch(url.toString(), {
-    method: 'GET',
-    headers: {
-      Authorization: `Bearer ${session}`,
-    },
-  });
+  if (query?.notification_id === undefined) {
+    url.searchParams.set('limit', NOTIFICATIONS_PAGE_SIZE.toString());
+  }
 
-  if (!response.ok) {
-    const errorData = await response.json();
-    throw new Error(errorData.message);
+  const notifications: any[] = [];
+  while (true) {
+    const response = await fetch(url.toString(), {
+      method: 'GET',
+      headers: {
+        Authorization: `Bearer ${session}`,
+      },
+    });
+
+    if (!response.ok) {
+      const errorData = await response.json();
+      throw new Error(errorData.message);
+    }
+    const data = await response.json();
+    if (!Array.isArray(data)) {
+      return data;
+    }
+    notifications.push(...data);
+
+    const cursor = response.headers.get('X-Next-Cursor');
+    if (!cursor) {
+      return notifications;
+    }
+    url.searchParams.set('cursor', cursor);
   }
-  return response.json();
 }
 
 export async function apiUpdateNotification(